@@ -1,3 +1,6 @@
+import asyncio, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from typing_extensions import Annotated
@@ -5,8 +8,11 @@ from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
 import jwt
 import os
-from database import SessionLocal
+from sqlalchemy import select, event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
 from models import User
+from utils.metrics import metrics
 from jwt.exceptions import InvalidTokenError
 from datetime import datetime, timedelta, timezone
 from functools import wraps
@@ -15,17 +21,17 @@ from typing import Callable
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+HASH_MAX_QUEUE = int(os.getenv("HASH_MAX_QUEUE", "32"))     # in flight + waiting; beyond this -> 503
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def get_db():
-    db = SessionLocal()
-    try:    
-        yield db
-    finally:
-        db.close()
+metrics.histogram("deepply_password_hash_seconds", "bcrypt time on the hash executor, by op (hash | verify).")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -33,17 +39,73 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
-def get_user(db, username: str):
-    user = db.query(User).filter(User.username == username).first()
+class HashExecutor:
+    """Runs bcrypt on a small dedicated thread pool so login bursts can't starve the event loop
+    (or the default executor). Rejects work with 503 once HASH_MAX_QUEUE calls are pending."""
+
+    def __init__(self, workers: int = HASH_WORKERS, max_queue: int = HASH_MAX_QUEUE):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.max_queue = max_queue
+        self.pending = 0
+        self.rejected = 0
+        self.stats: dict = {}                                  # op -> {"count", "total_ms", "max_ms"}
+
+    def _record(self, op: str, ms: float) -> None:
+        st = self.stats.setdefault(op, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        st["count"] += 1
+        st["total_ms"] += ms
+        st["max_ms"] = max(st["max_ms"], ms)
+        metrics.observe("deepply_password_hash_seconds", ms / 1000, op=op)
+
+    async def run(self, op: str, fn, *args):
+        if self.pending >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Server busy, try again shortly",
+                                headers={"Retry-After": "1"})
+        self.pending += 1
+        try:
+            def timed():
+                start = time.perf_counter()
+                try:
+                    return fn(*args)
+                finally:
+                    self._record(op, (time.perf_counter() - start) * 1000)
+            return await asyncio.get_running_loop().run_in_executor(self._pool, timed)
+        finally:
+            self.pending -= 1
+
+    def snapshot(self) -> dict:
+        return {
+            "pending": self.pending,
+            "rejected": self.rejected,
+            "ops": {op: {**st, "avg_ms": st["total_ms"] / st["count"]} for op, st in self.stats.items()},
+        }
+
+hash_executor = HashExecutor()
+
+async def hash_password_async(password: str) -> str:
+    return await hash_executor.run("hash", get_password_hash, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """(matches, new_hash). new_hash is set when the stored hash uses an outdated cost."""
+    return await hash_executor.run("verify", pwd_context.verify_and_update, plain_password, hashed_password)
+
+async def get_user(db: AsyncSession, username: str):
+    user = (await db.execute(select(User).where(User.username == username))).scalar_one_or_none()
     if user:
         return user
 
-def auth_user(db, username: str, password: str):
-    user = get_user(db, username)
+async def auth_user(db: AsyncSession, username: str, password: str):
+    user = await get_user(db, username)
     if not user or not hasattr(user, 'password_hash'):
         return False
-    if not verify_password(password, user.password_hash):
+    ok, new_hash = await verify_password_async(password, user.password_hash)
+    if not ok:
         return False
+    if new_hash is not None:
+        # BCRYPT_ROUNDS changed since this hash was made; upgrade it transparently.
+        user.password_hash = new_hash
+        await db.commit()
     return user
 
 def create_access_token(data: dict, expires_delta: timedelta = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)):
@@ -53,12 +115,77 @@ def create_access_token(data: dict, expires_delta: timedelta = timedelta(minutes
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+class TokenUserCache:
+    """token -> User, so authenticated requests skip the JWT decode and the users lookup.
+
+    Entries expire after AUTH_CACHE_TTL or at the token's exp, whichever is first, and are
+    dropped when the user row is updated (e.g. disabled) or deleted.
+    """
+
+    def __init__(self, ttl: float = AUTH_CACHE_TTL, size: int = AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()   # token -> (user, expires_at)
+        self._by_user: dict = {}                                    # username -> {tokens}
+
+    def get(self, token: str):
+        entry = self._entries.get(token)
+        if entry is None or entry[1] <= time.time():
+            if entry is not None:
+                self._drop(token)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def put(self, token: str, user: User, exp: float | None) -> None:
+        if self.ttl <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        self._entries[token] = (user, expires_at)
+        self._by_user.setdefault(user.username, set()).add(token)
+        while len(self._entries) > self.size:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, token: str) -> None:
+        user, _ = self._entries.pop(token)
+        tokens = self._by_user.get(user.username)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_user[user.username]
+
+    def invalidate_user(self, username: str) -> None:
+        for token in list(self._by_user.get(username, ())):
+            self._drop(token)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._by_user.clear()
+
+token_cache = TokenUserCache()
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    token_cache.invalidate_user(target.username)
+    # A rename leaves cached tokens under the old name.
+    for old in inspect(target).attrs.username.history.deleted or ():
+        token_cache.invalidate_user(old)
+
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSession = Depends(get_db)):
     credentials_ex = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username = payload.get('sub')
@@ -66,14 +193,17 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
             raise credentials_ex
     except InvalidTokenError:
         raise credentials_ex
-    db = next(get_db())
-    user = get_user(db, username=username)
+    user = await get_user(db, username=username)
     if user is None:
         raise credentials_ex
+    token_cache.put(token, user, payload.get("exp"))
     return user
 
-async def get_current_active_user(token: Annotated[str, Depends(oauth2_scheme)]):
-    user = await get_current_user(token)
+async def get_current_active_user(user: Annotated[User, Depends(get_current_user)]):
+    # Declared as a sub-dependency so FastAPI resolves it once per request, even when a
+    # router lists it in `dependencies=` and the route asks for it again.
     if user is None:
         raise HTTPException(status_code=401, detail="Not authenticated")
+    if user.disabled:
+        raise HTTPException(status_code=400, detail="Inactive user")
     return user
@@ -1,5 +1,5 @@
 from database import Base, engine
-from models import User, Game, Analysis
+from models import User, Game, Analysis, PositionEval, GameAnalysis, UserStat, PositionIndex, AnalysisJob
 
 print("Creating tables...")
 Base.metadata.create_all(bind=engine)
@@ -1,4 +1,5 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
 from dotenv import load_dotenv
@@ -7,9 +8,60 @@ load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-# Create engine and session
-engine = create_engine(DATABASE_URL)
+# Async drivers for the sync URLs we already use: MySQL via aiomysql, SQLite via aiosqlite.
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+def _async_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+
+def _engine_kwargs(url: str) -> dict:
+    if url.startswith("sqlite"):
+        # SQLite uses its own pool classes; the sizing options below don't apply.
+        return {"connect_args": {"check_same_thread": False}}
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),   # below MySQL's wait_timeout
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") != "0",
+    }
+
+# Sync engine: create_tables.py, scripts and work that already runs in a thread.
+engine = create_engine(DATABASE_URL, **_engine_kwargs(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine: everything on the request path.
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_kwargs(ASYNC_DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def upsert(model, dialect: str, values: dict, keys: list, update: list):
+    """INSERT that updates `update` columns when a row with the same unique `keys` already exists."""
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(model).values(**values)
+        return stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in update})
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(model).values(**values)
+        return stmt.on_conflict_do_update(index_elements=keys, set_={c: stmt.excluded[c] for c in update})
+    raise NotImplementedError(f"upsert is not implemented for {dialect}")
+
 # Base class for ORM models
 Base = declarative_base()
@@ -1,12 +1,41 @@
-from fastapi import FastAPI
+import os, time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from typing import Annotated
 from pydantic import BaseModel
-from routers import upload, user
-from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
 load_dotenv()
-app = FastAPI()
+load_dotenv(os.getenv("ENGINE_PROFILE", "engine_profile.env"))   # from `python -m utils.calibrate`; env and .env win
+
+from routers import analyze, upload, user
+from fastapi.middleware.cors import CORSMiddleware
+from utils.enginepool import pool as engine_pool
+from utils.evalcache import eval_cache
+from utils.openings import opening_book
+from utils.tablebase import tablebase
+from utils.scheduler import scheduler, CLASSES
+from auth_utils import token_cache, hash_executor
+from database import async_engine
+from utils.metrics import metrics, SERVER_TIMING, start_request, end_request, server_timing
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        await engine_pool.start()
+    except Exception as e:
+        # Reviews fall back to a one-off engine per request.
+        print(f"Engine pool not started: {e}")
+    opening_book.load()
+    yield
+    await engine_pool.close()
+    opening_book.close()
+    tablebase.close()
+    # aiosqlite keeps a non-daemon thread per pooled connection; without this the process can't exit.
+    await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,12 +43,64 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
 
+@app.middleware("http")
+async def timing(request: Request, call_next):
+    token = start_request()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        elapsed = time.perf_counter() - start
+        timings = end_request(token)
+    route = request.scope.get("route")
+    metrics.observe("deepply_http_request_seconds", elapsed, method=request.method,
+                    route=getattr(route, "path", "unmatched"), status=response.status_code)
+    # Streaming responses (review job streams) are timed up to the first byte only.
+    if SERVER_TIMING or request.headers.get("X-Timing") == "1":
+        response.headers["Server-Timing"] = server_timing(timings, elapsed * 1000)
+    return response
+
 class UserCreate(BaseModel):
     username: str
     email: str
     password: str
 
+app.include_router(analyze.router)
 app.include_router(upload.router)
 app.include_router(user.router)
+
+@metrics.collector
+def _component_metrics():
+    ev = eval_cache.stats()
+    for source in ("hits", "db_hits", "misses"):
+        yield "deepply_eval_cache_lookups_total", "counter", "Eval cache lookups by outcome.", {"result": source}, ev[source]
+    yield "deepply_tablebase_probes_total", "counter", "Syzygy probes attempted.", {}, tablebase.probes
+    yield "deepply_tablebase_hits_total", "counter", "Syzygy probes answered.", {}, tablebase.hits
+    yield "deepply_opening_book_plies_total", "counter", "Game plies recognised as book.", {}, opening_book.hits
+    yield "deepply_auth_cache_lookups_total", "counter", "Token cache lookups by outcome.", {"result": "hit"}, token_cache.hits
+    yield "deepply_auth_cache_lookups_total", "counter", "Token cache lookups by outcome.", {"result": "miss"}, token_cache.misses
+    hashing = hash_executor.snapshot()
+    yield "deepply_password_hash_pending", "gauge", "bcrypt jobs queued or running.", {}, hashing["pending"]
+    yield "deepply_password_hash_rejected_total", "counter", "bcrypt jobs refused with 503.", {}, hashing["rejected"]
+    yield "deepply_engine_pool_size", "gauge", "Engines in the pool.", {}, engine_pool.size if engine_pool.started else 0
+    yield "deepply_engine_pool_idle", "gauge", "Engines waiting for work.", {}, engine_pool.idle
+    yield "deepply_engine_restarts_total", "counter", "Engines replaced after a crash or hang.", {}, engine_pool.restarts
+    for cls in CLASSES:
+        yield "deepply_engine_queue_depth", "gauge", "Checkouts waiting for an engine, by class.", {"class": cls}, scheduler.waiting(cls)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "eval_cache": eval_cache.stats(),
+        "auth_cache": {"size": len(token_cache._entries), "hits": token_cache.hits, "misses": token_cache.misses},
+        "password_hashing": hash_executor.snapshot(),
+        "tablebase": tablebase.stats(),
+        "engine_scheduler": scheduler.snapshot(),
+    }
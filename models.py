@@ -1,8 +1,14 @@
-from sqlalchemy import Boolean, Column, Integer, String, Text, ForeignKey, DateTime, Enum
+from sqlalchemy import Boolean, Column, Integer, BigInteger, SmallInteger, String, Text, ForeignKey, DateTime, Enum, Index, LargeBinary, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from datetime import datetime, timezone
 from database import Base
 
+def utcnow() -> datetime:
+    # Set in Python rather than by the database: SQLite's CURRENT_TIMESTAMP drops fractional seconds,
+    # so a pagination cursor bound back as a datetime wouldn't compare equal to the stored value.
+    return datetime.now(timezone.utc)
+
 class User(Base):
     __tablename__ = "users"
 
@@ -34,6 +40,7 @@ class Game(Base):
 
     TIME_CONTROLS = ("bullet", "blitz", "rapid", "classical")
     GAME_TYPES = ("online", "otb")
+    RESULTS = ("1-0", "0-1", "1/2-1/2")
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -44,9 +51,16 @@ class Game(Base):
     time_control = Column(Enum(*TIME_CONTROLS, name="time_control_enum"), nullable=False)
     game_type = Column(Enum(*GAME_TYPES, name="game_type_enum"), nullable=False)
     description = Column(String(255))
-    created_at = Column(DateTime, default=func.now())
+    created_at = Column(DateTime, default=utcnow)
 
     owner = relationship("User", back_populates="games")
+    analysis = relationship("GameAnalysis", back_populates="game", uselist=False, cascade="all, delete-orphan")
+
+    # Keyset pagination for game listings: newest first, optionally filtered.
+    __table_args__ = (
+        Index("ix_games_user_created", "user_id", "created_at", "id"),
+        Index("ix_games_user_tc_created", "user_id", "time_control", "created_at", "id"),
+    )
 
 class Analysis(Base):
     __tablename__ = "analyses"
@@ -54,7 +68,105 @@ class Analysis(Base):
     id = Column(Integer, primary_key=True, index=True)
     fen = Column(String(100), nullable=False)
     depth = Column(Integer, nullable=False)
-    evaluation = Column(Integer, nullable=False)
-    top_moves = Column(Text, nullable=False)
+    evaluation = Column(Text, nullable=False)           # JSON {"type", "value"}
+    top_moves = Column(Text, nullable=False)            # JSON list
+
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)   # first user to request it
+
+    __table_args__ = (
+        UniqueConstraint("fen", "depth", name="uq_analyses_fen_depth"),
+    )
+
+class PositionEval(Base):
+    """Shared engine evaluations keyed by normalized FEN (see utils/evalcache.py)."""
+    __tablename__ = "position_evals"
+
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String(100), unique=True, nullable=False, index=True)
+    depth = Column(Integer, nullable=False)
+    time_ms = Column(Integer, nullable=False, default=0)
+    multipv = Column(Integer, nullable=False, default=1)
+    result = Column(Text, nullable=False)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+class GameAnalysis(Base):
+    """A game's stored review as packed little-endian arrays, one entry per analysed ply (see utils/gameanalysis.py)."""
+    __tablename__ = "game_analyses"
+
+    id = Column(Integer, primary_key=True, index=True)
+    game_id = Column(Integer, ForeignKey("games.id", ondelete="CASCADE"), unique=True, nullable=False, index=True)
+    version = Column(String(16), nullable=False)        # hash of the engine/review settings that produced it
+    plies = Column(Integer, nullable=False)
+    book_plies = Column(Integer, nullable=False, default=0)
+    score = Column(LargeBinary, nullable=False)         # int32 centipawns, side to move
+    mate = Column(LargeBinary, nullable=False)          # int16 mate distance
+    best = Column(LargeBinary, nullable=False)          # uint16 best move (from | to << 6 | promotion << 12)
+    labels = Column(LargeBinary, nullable=False)        # int8 classification code
+    opening_eco = Column(String(8))
+    opening_name = Column(String(255))
+    created_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    game = relationship("Game", back_populates="analysis")
+
+class UserStat(Base):
+    """Running per-user review counters for one bucket of one dimension (see utils/userstats.py)."""
+    __tablename__ = "user_stats"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    dimension = Column(String(16), nullable=False)      # all | phase | time_control | color | opening
+    bucket = Column(String(255), nullable=False)
+    games = Column(Integer, nullable=False, default=0)
+    moves = Column(Integer, nullable=False, default=0)
+    mistakes = Column(Integer, nullable=False, default=0)
+    blunders = Column(Integer, nullable=False, default=0)
+    great_moves = Column(Integer, nullable=False, default=0)
+    cp_loss = Column(BigInteger, nullable=False, default=0)   # summed over cp_loss_moves
+    cp_loss_moves = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "dimension", "bucket", name="uq_user_stats_bucket"),
+    )
+
+class PositionIndex(Base):
+    """Zobrist hash of every position reached in a game, first occurrence only (see utils/positionindex.py)."""
+    __tablename__ = "position_index"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    hash = Column(BigInteger, primary_key=True)         # polyglot zobrist_hash, stored signed
+    game_id = Column(Integer, ForeignKey("games.id", ondelete="CASCADE"), primary_key=True)
+    ply = Column(SmallInteger, nullable=False)          # half-moves played to reach it
+
+    __table_args__ = (
+        Index("ix_position_index_game", "game_id"),
+    )
+
+class AnalysisJob(Base):
+    """A unit of engine work for the analysis workers (see utils/jobqueue.py and worker.py)."""
+    __tablename__ = "analysis_jobs"
+
+    STATUSES = ("queued", "running", "done", "error")
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(16), nullable=False, default="review")
+    game_id = Column(Integer, ForeignKey("games.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    status = Column(String(8), nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    run_after = Column(DateTime(timezone=True))         # retry backoff; NULL = now
+    worker_id = Column(String(64))
+    lease_until = Column(DateTime(timezone=True))       # running jobs past this are reclaimed
+    heartbeat_at = Column(DateTime(timezone=True))
+    error = Column(Text)
+    result = Column(Text(length=2**24))                 # game_analysis() JSON; MEDIUMTEXT on MySQL
+    created_at = Column(DateTime(timezone=True), default=func.now())
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
 
-    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
\ No newline at end of file
+    __table_args__ = (
+        Index("ix_analysis_jobs_claim", "status", "run_after", "id"),
+        Index("ix_analysis_jobs_lease", "status", "lease_until"),
+        Index("ix_analysis_jobs_game", "game_id", "status"),
+    )
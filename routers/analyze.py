@@ -1,40 +1,128 @@
+import os, json, asyncio
+import chess
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 from auth_utils import get_current_active_user
-from database import SessionLocal
-from utils.analyze import analyze_position
+from database import get_db, upsert
+from utils.batchsf import analyse_batch_stockfishlike
+from utils.evalcache import position_key
+from utils.metrics import stage
+from utils.scheduler import scheduler, priority
+from utils.singleflight import SingleFlight
 from pydantic import BaseModel
 from models import Analysis, User
 
 router = APIRouter()
+analyze_flight = SingleFlight("analyze")            # same positions and limits -> one search
+
+ANALYZE_MAX_FENS    = int(os.getenv("ANALYZE_MAX_FENS", "64"))
+ANALYZE_MAX_DEPTH   = int(os.getenv("ANALYZE_MAX_DEPTH", "30"))
+ANALYZE_MAX_MS      = int(os.getenv("ANALYZE_MAX_MS", "10000"))
+ANALYZE_MAX_MULTIPV = int(os.getenv("ANALYZE_MAX_MULTIPV", "5"))
+ANALYZE_DEPTH       = int(os.getenv("ANALYZE_DEPTH", "20"))        # when neither depth nor time_ms is given
+ANALYZE_WORKERS     = int(os.getenv("ANALYZE_WORKERS", "2"))
 
 class PositionAnalysisRequest(BaseModel):
-    fen: str
-    depth: int = 20
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-@router.get('/analyze', response_model=dict)
-def analyze_pos_route(request: PositionAnalysisRequest, db: Session = Depends(get_db), user: User = Depends(get_current_active_user)):
-    check = db.query(Analysis).filter(Analysis.fen == request.fen, Analysis.depth == request.depth).first()
-    if check:
-        return check
-
-    result = analyze_position(request.fen, request.depth)
-    AnalysisRecord = Analysis(
-        fen=request.fen, 
-        depth=request.depth, 
-        evaluation=result.get("evaluation"), 
-        top_moves=result.get("top_moves"),
-        owner_id=user.id
-    )
-    db.add(AnalysisRecord)
-    db.commit()
-    if "error" in result:
-        raise HTTPException(status_code=400, detail=result["error"])
-    return result
\ No newline at end of file
+    fens: List[str]
+    depth: Optional[int] = None
+    time_ms: Optional[int] = None                   # per position; instead of depth
+    multipv: int = 1
+
+def _check(request: PositionAnalysisRequest) -> None:
+    if not request.fens or len(request.fens) > ANALYZE_MAX_FENS:
+        raise HTTPException(status_code=400, detail=f"fens must hold 1 to {ANALYZE_MAX_FENS} positions")
+    if request.depth is not None and request.time_ms is not None:
+        raise HTTPException(status_code=400, detail="Give depth or time_ms, not both")
+    if request.depth is not None and not 1 <= request.depth <= ANALYZE_MAX_DEPTH:
+        raise HTTPException(status_code=400, detail=f"depth must be between 1 and {ANALYZE_MAX_DEPTH}")
+    if request.time_ms is not None and not 10 <= request.time_ms <= ANALYZE_MAX_MS:
+        raise HTTPException(status_code=400, detail=f"time_ms must be between 10 and {ANALYZE_MAX_MS}")
+    if not 1 <= request.multipv <= ANALYZE_MAX_MULTIPV:
+        raise HTTPException(status_code=400, detail=f"multipv must be between 1 and {ANALYZE_MAX_MULTIPV}")
+    for i, fen in enumerate(request.fens):
+        try:
+            ok = chess.Board(fen).is_valid()
+        except ValueError:
+            ok = False
+        if not ok:
+            raise HTTPException(status_code=400, detail=f"Invalid FEN at index {i}")
+
+async def _record(db: AsyncSession, user_id: int, fens: List[str], depth: int, results: List[dict]) -> None:
+    # Upsert: a request for the same FEN/depth that finished first may have inserted the row already.
+    with stage("db_commit"):
+        for fen, res in zip(fens, results):
+            if not res["top_moves"]:
+                continue
+            values = {"fen": fen, "depth": depth, "owner_id": user_id,
+                      "evaluation": json.dumps(res["evaluation"]), "top_moves": json.dumps(res["top_moves"])}
+            await db.execute(upsert(Analysis, db.bind.dialect.name, values, ["fen", "depth"], ["evaluation", "top_moves"]))
+        await db.commit()
+
+def _item(i: int, fen: str, result: dict) -> dict:
+    return {"index": i, "fen": fen, "evaluation": result["evaluation"], "top_moves": result["top_moves"]}
+
+@router.post('/analyze')
+async def analyze_positions(request: PositionAnalysisRequest, format: str = "json",
+                            db: AsyncSession = Depends(get_db), user: User = Depends(get_current_active_user)):
+    """Analyse a list of positions in one call; results come back in the order given.
+
+    format=json (default) returns them all at once; ndjson or sse streams each one
+    as soon as it and every position before it are done. Depth-limited JSON results
+    are also recorded in the analyses table, one row per (fen, depth).
+    """
+    if format not in ("json", "ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be 'json', 'ndjson' or 'sse'")
+    _check(request)
+    fens, multipv, time_ms = request.fens, request.multipv, request.time_ms
+    depth = ANALYZE_DEPTH if request.depth is None and time_ms is None else request.depth
+    scheduler.admit("interactive", user.id)
+
+    def search(on_result=None):
+        return analyse_batch_stockfishlike(fens, multipv=multipv, workers=ANALYZE_WORKERS, on_result=on_result,
+                                           time_ms=time_ms, depth=depth, order="forward")
+
+    if format == "json":
+        key = (tuple(position_key(f) for f in fens), depth, time_ms, multipv)
+        with stage("analyze_positions"), priority("interactive", user.id):
+            results, leader = await analyze_flight.do(key, search)
+        if leader and depth is not None:
+            await _record(db, user.id, fens, depth, results)
+        return {"results": [_item(i, f, r) for i, (f, r) in enumerate(zip(fens, results))]}
+
+    queue: asyncio.Queue = asyncio.Queue()
+    ready, emitted = {}, 0
+
+    def on_result(i, res):
+        # Engines may finish out of order; release results as a contiguous prefix.
+        nonlocal emitted
+        ready[i] = res
+        while emitted in ready:
+            queue.put_nowait(_item(emitted, fens[emitted], ready.pop(emitted)))
+            emitted += 1
+
+    with priority("interactive", user.id):
+        task = asyncio.ensure_future(search(on_result))
+    task.add_done_callback(lambda t: queue.put_nowait(None))
+
+    def line(ev: dict) -> str:
+        if format == "sse":
+            return f"event: {ev['event']}\ndata: {json.dumps(ev)}\n\n"
+        return json.dumps(ev) + "\n"
+
+    async def lines():
+        try:
+            while (item := await queue.get()) is not None:
+                yield line({"event": "result", **item})
+            try:
+                await task
+            except Exception as e:
+                yield line({"event": "error", "error": str(e) or type(e).__name__})
+            else:
+                yield line({"event": "done", "count": len(fens)})
+        finally:
+            task.cancel()                                   # client went away mid-stream
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(lines(), media_type=media_type, headers={"Cache-Control": "no-cache"})
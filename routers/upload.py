@@ -1,10 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+import io, json, os, asyncio, base64
+import chess
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from auth_utils import get_current_active_user
-from database import SessionLocal
-from models import Game, User
+from database import SessionLocal, AsyncSessionLocal, get_db
+from models import Game, GameAnalysis, User
 from pydantic import BaseModel
-from utils.pgnvalidate import validate_pgn, game_analysis
+from utils.pgnvalidate import (ParsedGame, parse_pgn, validate_pgn, validate_game, game_analysis, replay_plies,
+                               iter_games, time_control_from_headers)
+from utils.jobs import jobs, ReviewJob
+from utils import jobqueue
+from utils.metrics import stage
+from utils.encoding import encode
+from utils.scheduler import scheduler, priority
+from utils.gameanalysis import ANALYSIS_VERSION, compact_analysis, pack_analysis, unpack_analysis, load_analysis
+from utils.userstats import apply_deltas, contributions, save_review
+from utils.positionindex import index_game, index_games, find_position
+from utils.singleflight import SingleFlight
 
 router = APIRouter(
     dependencies=[Depends(get_current_active_user)]
@@ -19,23 +34,60 @@ class GameUpload(BaseModel):
     opponent_rating: int | None = None
     result: str = "1/2-1/2"
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()    
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "200"))
+IMPORT_ANALYSIS_CONCURRENCY = int(os.getenv("IMPORT_ANALYSIS_CONCURRENCY", "2"))
+REVIEW_WAIT_S = float(os.getenv("REVIEW_WAIT_S", "120"))                  # queue mode: how long /review waits for a worker
+_background_analysis = asyncio.Semaphore(IMPORT_ANALYSIS_CONCURRENCY)    # imports and lazy refreshes
+_reviewing: dict[int, ReviewJob] = {}                                      # game id -> review in flight
+review_flight = SingleFlight("review")                                     # same moves -> one analysis
+
+def _shape(analysis: dict, verbose: bool) -> dict:
+    """Parallel per-ply arrays (see compact_analysis); verbose=true keeps the old per-ply objects."""
+    return analysis if verbose else compact_analysis(analysis)
 
 @router.post("/review")
-async def upload_game(data: GameUpload, db: Session = Depends(get_db), user: User = Depends(get_current_active_user)):
-    is_valid, error_message = validate_pgn(data.pgn)
+async def upload_game(data: GameUpload, request: Request, response: Response, background: bool = False,
+                      verbose: bool = False, db: AsyncSession = Depends(get_db),
+                      user: User = Depends(get_current_active_user)):
+    """Store and review a game. The analysis is sent as JSON, or MessagePack when the Accept
+    header asks for it, gzipped if the client accepts that."""
+    parsed = parse_pgn(data.pgn)
+    is_valid, error_message = validate_pgn(parsed)
     
 
     if not is_valid:
         raise HTTPException(status_code=400, detail=error_message) 
     
-    game_analysis_result = await game_analysis(data.pgn)
-    
+    if jobqueue.EXECUTOR != "queue":
+        scheduler.admit("review", user.id)
+
+    if background:
+        # Store the game first so the client gets its id straight away; analysis follows.
+        new_game = await _store_game(db, data, user, parsed=parsed)
+        job_id = await _start_review(new_game.id, parsed, user, queued=False)
+        response.status_code = 202
+        return {"message": "Review queued", "id": new_game.id, "job_id": job_id}
+
+    if jobqueue.EXECUTOR == "queue":
+        # A worker process does the analysis (and stores it); wait for it up to REVIEW_WAIT_S.
+        game_id = (await _store_game(db, data, user, parsed=parsed)).id
+        job_id = (await jobqueue.enqueue(db, game_id, user.id)).id
+        with stage("game_analysis"):
+            job = await jobqueue.wait(db, job_id, REVIEW_WAIT_S)
+        if job is None:
+            response.status_code = 202
+            return {"message": "Review queued", "id": game_id, "job_id": str(job_id)}
+        analysis = json.loads(job.result) if job.status == "done" else {"error": job.error}
+        return encode(request, {"message": "Game uploaded", "id": game_id, 'analysis': _shape(analysis, verbose)})
+
+    with stage("game_analysis"), priority("review", user.id):
+        game_analysis_result, _ = await review_flight.do(parsed.key, lambda: game_analysis(parsed))
+    new_game = await _store_game(db, data, user, game_analysis_result, parsed)
+    return encode(request, {"message": "Game uploaded", "id": new_game.id,
+                            'analysis': _shape(game_analysis_result, verbose)})
+
+async def _store_game(db: AsyncSession, data: GameUpload, user: User, analysis: dict | None = None,
+                      parsed=None) -> Game:
     new_game = Game(
         user_id=user.id, 
         user_color=data.user_color,
@@ -46,26 +98,284 @@ async def upload_game(data: GameUpload, db: Session = Depends(get_db), user: Use
         opponent_rating=data.opponent_rating,
         result=data.result
     )
-    db.add(new_game)
-    db.commit()
-    db.refresh(new_game)
-    return {"message": "Game uploaded", "id": new_game.id, 'analysis': game_analysis_result}
+    with stage("db_commit"):
+        db.add(new_game)
+        await db.flush()
+        await index_game(db, new_game, parsed.game)
+        if analysis is not None and "error" not in analysis:
+            new_game.analysis = GameAnalysis(**pack_analysis(analysis))
+            await apply_deltas(db, user.id, contributions(new_game, new_game.analysis, parsed))
+        await db.commit()
+        await db.refresh(new_game)
+    return new_game
+
+def _get_job(job_id: str, user: User) -> ReviewJob:
+    job = jobs.get(job_id)
+    if job is None or job.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Review job not found")
+    return job
+
+async def _get_queued_job(db: AsyncSession, job_id: str, user: User):
+    """Queue-mode jobs have numeric ids; None if job_id is an in-process one."""
+    if jobs.get(job_id) is not None or not job_id.isdigit():
+        return None
+    job = await jobqueue.get_job(db, int(job_id))
+    if job is None or job.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Review job not found")
+    return job
+
+@router.get("/review/jobs/{job_id}")
+async def review_status(job_id: str, request: Request, verbose: bool = False, db: AsyncSession = Depends(get_db),
+                        user: User = Depends(get_current_active_user)):
+    queued = await _get_queued_job(db, job_id, user)
+    out = jobqueue.summary(queued) if queued is not None else _get_job(job_id, user).summary()
+    if "analysis" in out:
+        out["analysis"] = _shape(out["analysis"], verbose)
+    return encode(request, out)
+
+async def _follow_queued(job_id: int):
+    """Status events for a queue-mode job (the worker doesn't publish per-ply progress)."""
+    last = None
+    async with AsyncSessionLocal() as db:
+        while True:
+            job = await jobqueue.get_job(db, job_id)
+            if job is None:
+                yield {"event": "error", "job_id": str(job_id), "error": "Review job not found"}
+                return
+            if job.status != last:
+                last = job.status
+                yield {"event": job.status, **jobqueue.summary(job, include_result=False)}
+            if job.status in ("done", "error"):
+                return
+            await db.rollback()
+            await asyncio.sleep(jobqueue.POLL_S)
+
+@router.get("/review/jobs/{job_id}/stream")
+async def review_stream(job_id: str, format: str = "ndjson", user: User = Depends(get_current_active_user)):
+    """Per-ply progress as NDJSON (default) or Server-Sent Events (format=sse).
+    Jobs run by worker.py (REVIEW_EXECUTOR=queue) only report status changes."""
+    async with AsyncSessionLocal() as db:
+        queued = await _get_queued_job(db, job_id, user)
+    events = _follow_queued(queued.id) if queued is not None else _get_job(job_id, user).follow()
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'sse'")
+
+    async def lines():
+        async for ev in events:
+            if format == "sse":
+                yield f"event: {ev['event']}\ndata: {json.dumps(ev)}\n\n"
+            else:
+                yield json.dumps(ev) + "\n"
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(lines(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+async def _review_and_store(game_id: int, pgn, job: ReviewJob, cls: str = "review"):
+    parsed = pgn if isinstance(pgn, ParsedGame) else parse_pgn(pgn)
+    with priority(cls, job.user_id):
+        result, leader = await review_flight.do(parsed.key, lambda: game_analysis(parsed, on_ply=job.push))
+    if not leader and "error" not in result:
+        # Someone else's review of the same moves ran; this job gets the plies all at once.
+        replay_plies(result, job.push)
+    if "error" not in result:
+        async with AsyncSessionLocal() as db:
+            game = await db.get(Game, game_id)
+            if game is not None:
+                with stage("db_commit"):
+                    await save_review(db, game, result)
+    return result
+
+async def _queued_review(game_id: int, pgn: str, job: ReviewJob):
+    async with _background_analysis:
+        return await _review_and_store(game_id, pgn, job, "backfill")
+
+def _submit_review(game_id: int, pgn, user: User, queued: bool = True) -> ReviewJob:
+    """Background review of a stored game, stored when done. At most one runs per game.
+    queued=False is a review the user just asked for; otherwise it's backfill (imports, stale analyses)."""
+    for gid in [g for g, j in _reviewing.items() if j.done]:
+        del _reviewing[gid]
+    job = _reviewing.get(game_id)
+    if job is None:
+        run = _queued_review if queued else _review_and_store
+        job = jobs.submit(ReviewJob(user_id=user.id, game_id=game_id), lambda job: run(game_id, pgn, job))
+        _reviewing[game_id] = job
+    return job
+
+async def _start_review(game_id: int, pgn, user: User, queued: bool = True) -> str:
+    """Job id of the game's background review: a worker.py job with REVIEW_EXECUTOR=queue, else in-process."""
+    if jobqueue.EXECUTOR == "queue":
+        async with AsyncSessionLocal() as db:
+            return str((await jobqueue.enqueue(db, game_id, user.id)).id)
+    return _submit_review(game_id, pgn, user, queued).id
 
 @router.get("/games/{game_id}")
-def get_game(game_id: int, db: Session = Depends(get_db)):
-    game = db.query(Game).filter(Game.id == game_id).first()
+async def get_game(game_id: int, include: str = "", db: AsyncSession = Depends(get_db),
+                   user: User = Depends(get_current_active_user)):
+    """include=analysis adds the stored review. If it is missing or was made with other engine
+    settings, a refresh is queued and its job_id returned as analysis_job_id (a stale one is still sent)."""
+    game = await db.get(Game, game_id)
     if not game:
         raise HTTPException(status_code=404, detail="Game not found")
-    return {"game": game}
+    if game.user_id != user.id:
+        raise HTTPException(status_code=403, detail="Not authorized to view this game")
+    out = {"game": game}
+    if "analysis" in include.split(","):
+        row = await load_analysis(db, game_id)
+        out["analysis"] = unpack_analysis(row) if row is not None else None
+        if row is None or row.version != ANALYSIS_VERSION:
+            out["analysis_job_id"] = await _start_review(game.id, game.pgn, user)
+    return out
+
+SUMMARY_COLUMNS = (Game.id, Game.user_id, Game.user_color, Game.result, Game.opponent_rating,
+                   Game.time_control, Game.game_type, Game.description, Game.created_at)
+MAX_PAGE_SIZE = 200
+
+def _encode_cursor(created_at: datetime, game_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{game_id}".encode()).decode()
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        created_at, game_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(game_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def _list_games(db: AsyncSession, response: Response, user_id: int, limit: int, cursor: str | None,
+                include_pgn: bool, time_control: str | None, game_type: str | None, result: str | None):
+    """Newest first, keyset-paginated on (created_at, id). The next page's cursor is sent in X-Next-Cursor."""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    columns = SUMMARY_COLUMNS + ((Game.pgn,) if include_pgn else ())
+    q = select(*columns).where(Game.user_id == user_id)
+    if time_control:
+        q = q.where(Game.time_control == time_control)
+    if game_type:
+        q = q.where(Game.game_type == game_type)
+    if result:
+        q = q.where(Game.result == result)
+    if cursor:
+        created_at, game_id = _decode_cursor(cursor)
+        q = q.where(or_(Game.created_at < created_at,
+                        and_(Game.created_at == created_at, Game.id < game_id)))
+    rows = (await db.execute(q.order_by(Game.created_at.desc(), Game.id.desc()).limit(limit + 1))).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(rows[-1].created_at, rows[-1].id)
+    return [dict(row._mapping) for row in rows]
 
 @router.get("/games")
-def list_games(db: Session = Depends(get_db)):
-    games = db.query(Game).all()
-    return [{"id": game.id, "user_id": game.user_id, "pgn": game.pgn} for game in games]
+async def list_games(response: Response, limit: int = 50, cursor: str | None = None, include_pgn: bool = False,
+               time_control: str | None = None, game_type: str | None = None, result: str | None = None,
+               db: AsyncSession = Depends(get_db), user: User = Depends(get_current_active_user)):
+    """The current user's games; same as /users/{id}/games for your own id."""
+    return await _list_games(db, response, user.id, limit, cursor, include_pgn, time_control, game_type, result)
 
 @router.get("/users/{user_id}/games")
-def list_user_games(user_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_active_user)):
+async def list_user_games(user_id: int, response: Response, limit: int = 50, cursor: str | None = None,
+                    include_pgn: bool = False, time_control: str | None = None, game_type: str | None = None,
+                    result: str | None = None, db: AsyncSession = Depends(get_db),
+                    user: User = Depends(get_current_active_user)):
+    if user.id != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to view these games")
+    return await _list_games(db, response, user_id, limit, cursor, include_pgn, time_control, game_type, result)
+
+@router.get("/users/{user_id}/positions")
+async def search_position(user_id: int, fen: str, limit: int = 50, db: AsyncSession = Depends(get_db),
+                          user: User = Depends(get_current_active_user)):
+    """The user's games that reached this position, newest first, with their score from it."""
     if user.id != user_id:
         raise HTTPException(status_code=403, detail="Not authorized to view these games")
-    games = db.query(Game).filter(Game.user_id == user_id).all()
-    return [{"id": game.id, "pgn": game.pgn} for game in games]
\ No newline at end of file
+    try:
+        chess.Board(fen)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid FEN")
+    return await find_position(db, user_id, fen, max(1, min(limit, MAX_PAGE_SIZE)))
+
+def _import_games(fileobj, user: User, player: str | None, game_type: str) -> tuple[list, list]:
+    """Read games one by one and insert them in batches. Returns (per-game summary, [(id, pgn)]).
+
+    Runs in a worker thread (parsing is CPU-bound), so it uses the sync session.
+    """
+    summary, stored = [], []
+    pending = []                                           # (summary entry, Game, pgn, chess.pgn.Game)
+    db = SessionLocal()
+
+    def flush():
+        if not pending:
+            return
+        db.add_all([g for _, g, _, _ in pending])
+        db.flush()
+        index_games(db, [(g, game) for _, g, _, game in pending])
+        db.commit()
+        for entry, g, pgn, _ in pending:
+            entry["id"] = g.id
+            stored.append((g.id, pgn))
+        pending.clear()
+
+    try:
+        text = io.TextIOWrapper(fileobj, encoding="utf-8", errors="replace")
+        for index, game in enumerate(iter_games(text)):
+            headers = game.headers
+            entry = {"index": index, "white": headers.get("White"), "black": headers.get("Black")}
+            summary.append(entry)
+            ok, error = validate_game(game)
+            result = headers.get("Result")
+            if ok and result not in Game.RESULTS:
+                ok, error = False, "Unfinished game"
+            if ok and player:
+                if headers.get("White", "").lower() == player.lower():
+                    user_color = True
+                elif headers.get("Black", "").lower() == player.lower():
+                    user_color = False
+                else:
+                    ok, error = False, f"{player} did not play in this game"
+            else:
+                user_color = True
+            if not ok:
+                entry.update(status="rejected", error=error)
+                continue
+            pgn = str(game)
+            entry["status"] = "accepted"
+            pending.append((entry, Game(
+                user_id=user.id,
+                user_color=user_color,
+                pgn=pgn,
+                time_control=time_control_from_headers(headers) or "rapid",
+                game_type=game_type,
+                description=headers.get("Event", "")[:255],
+                opponent_rating=_opponent_rating(headers, user_color),
+                result=result,
+            ), pgn, game))
+            if len(pending) >= IMPORT_BATCH_SIZE:
+                flush()
+        flush()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    return summary, stored
+
+def _opponent_rating(headers, user_color: bool) -> int | None:
+    elo = headers.get("BlackElo" if user_color else "WhiteElo", "")
+    return int(elo) if elo.isdigit() else None
+
+@router.post("/games/import")
+async def import_games(file: UploadFile = File(...), player: str | None = Form(None),
+                       game_type: str = Form("online"), analyze: bool = Form(False),
+                       user: User = Depends(get_current_active_user)):
+    """Import a multi-game PGN file (e.g. a Lichess or Chess.com archive).
+
+    `player` is the uploader's username in the archive; it decides user_color for each game.
+    With analyze=true every accepted game also gets a background review job, stored when it finishes.
+    """
+    if game_type not in Game.GAME_TYPES:
+        raise HTTPException(status_code=400, detail=f"game_type must be one of {Game.GAME_TYPES}")
+    summary, stored = await asyncio.to_thread(_import_games, file.file, user, player, game_type)
+
+    if analyze:
+        by_id = {e["id"]: e for e in summary if "id" in e}
+        for game_id, pgn in stored:
+            by_id[game_id]["job_id"] = await _start_review(game_id, pgn, user)
+
+    accepted = sum(1 for e in summary if e["status"] == "accepted")
+    return {"accepted": accepted, "rejected": len(summary) - accepted, "games": summary}
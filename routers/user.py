@@ -1,10 +1,12 @@
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from database import SessionLocal
-from auth_utils import auth_user, create_access_token, get_password_hash, get_current_active_user
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
+from auth_utils import auth_user, create_access_token, hash_password_async, get_current_active_user
 from models import User
+from utils.userstats import read_stats
 
 router = APIRouter()
 
@@ -24,26 +26,19 @@ class RegisterResponse(BaseModel):
     access_token: str
     token_type: str
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @router.get('/')
 def home():
     return {"message": "Welcome to the User API"}
 
 @router.post("/create_user", response_model=RegisterResponse, status_code=201)
-def create_user(user: UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
     # Check if username or email already exists
-    if db.query(User).filter(User.username == user.username).first():
+    if (await db.execute(select(User.id).where(User.username == user.username))).first():
         raise HTTPException(status_code=400, detail="Username already registered")
-    if db.query(User).filter(User.email == user.email).first():
+    if (await db.execute(select(User.id).where(User.email == user.email))).first():
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await hash_password_async(user.password)
     new_user = User(
         username=user.username,
         email=user.email,
@@ -51,8 +46,8 @@ def create_user(user: UserCreate, db: Session = Depends(get_db)):
         password_hash=hashed_password
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     access_token = create_access_token(data={"sub": user.username})
     return {
         "user": UserInDB(
@@ -67,15 +62,22 @@ def create_user(user: UserCreate, db: Session = Depends(get_db)):
 
 
 @router.get("/users/{user_id}")
-def get_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def get_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return {"id": user.id, "username": user.username, "email": user.email}
 
+@router.get("/users/{user_id}/stats")
+async def user_stats(user_id: int, db: AsyncSession = Depends(get_db), user: User = Depends(get_current_active_user)):
+    """Mistake/blunder rates and average centipawn loss, overall and by phase, time control, color and opening."""
+    if user.id != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to view these stats")
+    return {"user_id": user_id, **await read_stats(db, user_id)}
+
 @router.get("/users")
-def list_users(db: Session = Depends(get_db)):
-    users = db.query(User).all()
+async def list_users(db: AsyncSession = Depends(get_db)):
+    users = (await db.execute(select(User))).scalars().all()
     users[0].password_hash
     return [{"id": user.id, "username": user.username, "email": user.email, 'pw': user.password} for user in users]
 
@@ -88,8 +90,8 @@ def protected(user: User = Depends(get_current_active_user)):
     return {"message": f"Hello, {user.username}. This is a protected route."}
 
 @router.post("/token", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = auth_user(db, form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await auth_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
     access_token = create_access_token(data={"sub": user.username})
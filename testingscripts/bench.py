@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Load/latency benchmark for the API against SQLite and the fake UCI engine.
+
+    python testingscripts/bench.py                       # in-process, all scenarios
+    python testingscripts/bench.py -c 16 -n 200 --scenarios review,list
+    python testingscripts/bench.py --url http://localhost:8000   # a running server (its own DB/engine)
+
+In-process runs create a throwaway SQLite database and point STOCKFISH_PATH at
+testingscripts/fake_uci.py unless they are already set. Reports p50/p95/p99 latency and
+throughput per scenario; --json writes the same numbers to a file for comparing runs.
+"""
+import os, sys, json, time, asyncio, argparse, tempfile, statistics
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+OPERA_GAME = """[Event "Paris"]
+[White "Morphy"]
+[Black "Duke Karl / Count Isouard"]
+[Result "1-0"]
+
+1. e4 e5 2. Nf3 d6 3. d4 Bg4 4. dxe5 Bxf3 5. Qxf3 dxe5 6. Bc4 Nf6 7. Qb3 Qe7
+8. Nc3 c6 9. Bg5 b5 10. Nxb5 cxb5 11. Bxb5+ Nbd7 12. O-O-O Rd8 13. Rxd7 Rxd7
+14. Rd1 Qe6 15. Bxd7+ Nxd7 16. Qb8+ Nxb8 17. Rd8# 1-0
+"""
+
+ANALYZE_FENS = [
+    "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3",
+    "rnbqkb1r/pp2pppp/3p1n2/8/3NP3/8/PPP2PPP/RNBQKB1R w KQkq - 1 5",
+    "r1bq1rk1/ppp2ppp/2np1n2/2b1p3/2B1P3/2PP1N2/PP3PPP/RNBQ1RK1 w - - 0 7",
+]
+
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return 0.0
+    k = (len(sorted_vals) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+def setup_env(args):
+    tmp = tempfile.mkdtemp(prefix="deepply-bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tmp, 'bench.sqlite')}")
+    os.environ.setdefault("SECRET_KEY", "bench-secret-key-bench-secret-key")
+    fake = os.path.join(HERE, "fake_uci.py")
+    os.environ.setdefault("STOCKFISH_PATH", fake)
+    os.environ.setdefault("BCRYPT_ROUNDS", str(args.bcrypt_rounds))
+    if args.cold:
+        os.environ["EVAL_CACHE_SIZE"] = "0"
+        os.environ["EVAL_CACHE_DB"] = "0"
+    sys.path.insert(0, ROOT)
+
+class Bench:
+    def __init__(self, client, users):
+        self.client = client
+        self.users = users            # [(username, password, user_id, token)]
+
+    def _user(self, i):
+        return self.users[i % len(self.users)]
+
+    async def login(self, i):
+        name, pw, _, _ = self._user(i)
+        return await self.client.post("/token", data={"username": name, "password": pw})
+
+    async def review(self, i):
+        _, _, _, tok = self._user(i)
+        return await self.client.post("/review", json={"pgn": OPERA_GAME, "user_color": True},
+                                      headers={"Authorization": f"Bearer {tok}"})
+
+    async def analyze(self, i):
+        _, _, _, tok = self._user(i)
+        return await self.client.post("/analyze", json={"fens": [ANALYZE_FENS[i % len(ANALYZE_FENS)]], "depth": 12},
+                                      headers={"Authorization": f"Bearer {tok}"})
+
+    async def list(self, i):
+        _, _, uid, tok = self._user(i)
+        return await self.client.get(f"/users/{uid}/games", params={"limit": 50},
+                                     headers={"Authorization": f"Bearer {tok}"})
+
+async def make_users(client, n):
+    users = []
+    for k in range(n):
+        name, pw = f"bench{k}_{int(time.time() * 1000) % 100000}", "bench-password"
+        r = await client.post("/create_user", json={"username": name, "email": f"{name}@bench.local", "password": pw})
+        r.raise_for_status()
+        body = r.json()
+        users.append((name, pw, body["user"]["id"], body["access_token"]))
+    return users
+
+async def run_scenario(fn, concurrency, total):
+    latencies, errors, statuses = [], 0, {}
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                r = await fn(i)
+                code = r.status_code
+            except Exception:
+                code = "exc"
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[code] = statuses.get(code, 0) + 1
+            if code == "exc" or code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    if total and errors == total:
+        # Timing nothing but failures would look like a fast server.
+        raise RuntimeError(f"every request failed: {statuses}")
+    lat = sorted(latencies)
+    return {
+        "requests": total,
+        "errors": errors,
+        "status": {str(k): v for k, v in statuses.items()},
+        "throughput_rps": total / wall if wall else 0.0,
+        "p50_ms": percentile(lat, 50),
+        "p95_ms": percentile(lat, 95),
+        "p99_ms": percentile(lat, 99),
+        "mean_ms": statistics.fmean(lat) if lat else 0.0,
+    }
+
+async def main(args):
+    import httpx
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=120)
+        lifespan = None
+    else:
+        setup_env(args)
+        from database import engine
+        from models import Base                            # with every model registered
+        Base.metadata.create_all(bind=engine)
+        from main import app
+        lifespan = app.router.lifespan_context(app)
+        await lifespan.__aenter__()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=120)
+
+    report = {}
+    try:
+        users = await make_users(client, args.users)
+        bench = Bench(client, users)
+        # A few stored games so listing has something to page through.
+        if "list" in args.scenarios and "review" not in args.scenarios:
+            await run_scenario(bench.review, args.concurrency, args.users)
+        for name in args.scenarios:
+            fn = getattr(bench, name)
+            await run_scenario(fn, min(args.concurrency, 2), min(args.warmup, args.requests))
+            report[name] = await run_scenario(fn, args.concurrency, args.requests)
+            r = report[name]
+            print(f"{name:8s} n={r['requests']:<5d} err={r['errors']:<4d} {r['throughput_rps']:8.1f} req/s  "
+                  f"p50={r['p50_ms']:8.1f}ms  p95={r['p95_ms']:8.1f}ms  p99={r['p99_ms']:8.1f}ms  {r['status']}")
+    finally:
+        await client.aclose()
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": report}, f, indent=2)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-c", "--concurrency", type=int, default=8)
+    ap.add_argument("-n", "--requests", type=int, default=100, help="requests per scenario")
+    ap.add_argument("--warmup", type=int, default=5)
+    ap.add_argument("--users", type=int, default=4)
+    ap.add_argument("--scenarios", type=lambda s: s.split(","), default=["login", "review", "analyze", "list"])
+    ap.add_argument("--cold", action="store_true", help="disable the eval cache so every review searches")
+    ap.add_argument("--bcrypt-rounds", type=int, default=12)
+    ap.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    ap.add_argument("--json", help="write results to this file")
+    asyncio.run(main(ap.parse_args()))
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""Deterministic stand-in for Stockfish, for benchmarks and local runs without an engine.
+
+Speaks enough UCI for python-chess (utils/batchsf.py).
+Scores and PVs are derived from a hash of the position, so the same position always gets
+the same answer. Point STOCKFISH_PATH at this file (it must be executable).
+
+    FAKE_UCI_LATENCY_MS   fixed delay per "go"; default: the requested movetime (or 1 ms per depth)
+    FAKE_UCI_DEPTH        depth to report when "go" doesn't ask for one (default 20)
+    FAKE_UCI_SCRIPT       JSON file {epd: {"cp": int} | {"mate": int}, "pv": [uci, ...]} to override positions
+"""
+import os, sys, json, time, hashlib, threading
+import chess
+
+LATENCY_MS = os.getenv("FAKE_UCI_LATENCY_MS")
+DEFAULT_DEPTH = int(os.getenv("FAKE_UCI_DEPTH", "20"))
+SCRIPT = {}
+if os.getenv("FAKE_UCI_SCRIPT"):
+    with open(os.environ["FAKE_UCI_SCRIPT"]) as f:
+        SCRIPT = json.load(f)
+
+OPTIONS = [
+    "option name Threads type spin default 1 min 1 max 1024",
+    "option name Hash type spin default 16 min 1 max 33554432",
+    "option name MultiPV type spin default 1 min 1 max 500",
+    "option name Skill Level type spin default 20 min 0 max 20",
+    "option name Move Overhead type spin default 10 min 0 max 5000",
+    "option name Ponder type check default false",
+    "option name UCI_Chess960 type check default false",
+    "option name UCI_LimitStrength type check default false",
+    "option name UCI_Elo type spin default 1320 min 1320 max 3190",
+    "option name SyzygyPath type string default <empty>",
+]
+
+out_lock = threading.Lock()
+
+def send(line):
+    with out_lock:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+def _h(text):
+    return int(hashlib.md5(text.encode()).hexdigest(), 16)
+
+def lines_for(board, multipv):
+    """[(score_str, [uci...])] for the top `multipv` lines, best first."""
+    epd = board.epd()
+    legal = sorted(m.uci() for m in board.legal_moves)
+    if not legal:
+        return []
+    h = _h(epd)
+    start = h % len(legal)
+    firsts = [legal[(start + k) % len(legal)] for k in range(min(multipv, len(legal)))]
+    base = (h >> 8) % 601 - 300
+    scripted = SCRIPT.get(epd)
+    out = []
+    for k, first in enumerate(firsts):
+        pv = [first]
+        b = board.copy(stack=False)
+        b.push_uci(first)
+        for _ in range(3):
+            nxt = sorted(m.uci() for m in b.legal_moves)
+            if not nxt:
+                break
+            pv.append(nxt[_h(b.epd()) % len(nxt)])
+            b.push_uci(pv[-1])
+        if k == 0 and scripted:
+            score = f"mate {scripted['mate']}" if "mate" in scripted else f"cp {scripted.get('cp', base)}"
+            pv = scripted.get("pv", pv)
+        else:
+            score = f"cp {base - 25 * k}"
+        out.append((score, pv))
+    return out
+
+class Engine:
+    def __init__(self):
+        self.board = chess.Board()
+        self.multipv = 1
+        self.search = None
+        self.stop = threading.Event()
+
+    def position(self, args):
+        moves = []
+        if "moves" in args:
+            i = args.index("moves")
+            args, moves = args[:i], args[i + 1:]
+        if args and args[0] == "fen":
+            self.board = chess.Board(" ".join(args[1:]))
+        elif args and args[0] == "startpos":
+            self.board = chess.Board()
+        else:
+            return                                         # like Stockfish: anything else leaves the position alone
+        for m in moves:
+            self.board.push_uci(m)
+
+    def go(self, args):
+        def arg(name, default=None):
+            return int(args[args.index(name) + 1]) if name in args else default
+        depth = arg("depth", DEFAULT_DEPTH)
+        if LATENCY_MS is not None:
+            wait = float(LATENCY_MS) / 1000
+        elif "movetime" in args:
+            wait = arg("movetime") / 1000
+        elif "infinite" in args:
+            wait = None
+        else:
+            wait = depth / 1000
+        board, multipv = self.board.copy(), self.multipv
+        self.stop.clear()
+
+        def run():
+            start = time.time()
+            self.stop.wait(wait)
+            ms = max(1, int((time.time() - start) * 1000))
+            nodes = ms * 1000
+            lines = lines_for(board, multipv)
+            for k, (score, pv) in enumerate(lines, 1):
+                send(f"info depth {depth} seldepth {depth + 4} multipv {k} score {score} "
+                     f"nodes {nodes} nps {nodes * 1000 // ms} time {ms} pv {' '.join(pv)}")
+            if not lines:
+                send(f"info depth 0 score {'mate 0' if board.is_checkmate() else 'cp 0'}")
+            send(f"bestmove {lines[0][1][0] if lines else '(none)'}")
+
+        self.search = threading.Thread(target=run, daemon=True)
+        self.search.start()
+
+    def loop(self):
+        for raw in sys.stdin:
+            parts = raw.split()
+            if not parts:
+                continue
+            cmd, args = parts[0], parts[1:]
+            if cmd == "uci":
+                send("id name Stockfish 16 (fake_uci)")
+                send("id author DeepPly testingscripts")
+                for o in OPTIONS:
+                    send(o)
+                send("uciok")
+            elif cmd == "isready":
+                if self.search is not None:
+                    self.search.join()
+                send("readyok")
+            elif cmd == "setoption":
+                if "name" in args and "value" in args:
+                    name = " ".join(args[args.index("name") + 1:args.index("value")])
+                    if name == "MultiPV":
+                        self.multipv = max(1, int(args[args.index("value") + 1]))
+            elif cmd == "ucinewgame":
+                self.board = chess.Board()
+            elif cmd == "position":
+                self.position(args)
+            elif cmd == "go":
+                self.go(args)
+            elif cmd == "stop":
+                self.stop.set()
+                if self.search is not None:
+                    self.search.join()
+            elif cmd == "quit":
+                self.stop.set()
+                return
+
+if __name__ == "__main__":
+    Engine().loop()
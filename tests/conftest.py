@@ -0,0 +1,58 @@
+import os, sys, asyncio, itertools, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_UCI = os.path.join(ROOT, "testingscripts", "fake_uci.py")
+_DB = os.path.join(tempfile.mkdtemp(prefix="deepply-tests-"), "test.sqlite")
+
+# Settings are read at import time, so these go in before any app module is imported.
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{_DB}",
+    "SECRET_KEY": "test-secret-key-test-secret-key-00",
+    "BCRYPT_ROUNDS": "4",
+    "STOCKFISH_PATH": FAKE_UCI,
+    "SF_THREADS": "1",
+    "SF_HASH": "16",
+    "SF_POOL_SIZE": "2",
+    "SF_HEALTH_INTERVAL": "0",
+    "FAKE_UCI_LATENCY_MS": "1",
+    "ENGINE_PROFILE": os.devnull,
+})
+sys.path.insert(0, ROOT)
+
+import pytest
+
+@pytest.fixture(scope="session", autouse=True)
+def tables():
+    from database import engine
+    from models import Base                                # with every model registered
+    Base.metadata.create_all(bind=engine)
+    yield
+    engine.dispose()
+
+_users = itertools.count()
+
+@pytest.fixture
+def api():
+    """api(body) runs body(client) against the app, inside its lifespan."""
+    import httpx
+    from main import app
+
+    def run(body):
+        async def main():
+            async with app.router.lifespan_context(app):
+                transport = httpx.ASGITransport(app=app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                    return await body(client)
+        return asyncio.run(main())
+    return run
+
+@pytest.fixture
+def new_user():
+    """await new_user(client) -> (user id, auth headers) for a freshly registered user."""
+    async def create(client):
+        n = next(_users)
+        r = await client.post("/create_user", json={"username": f"user{n}", "email": f"user{n}@test.local",
+                                                    "password": "test-password"})
+        body = r.json()
+        return body["user"]["id"], {"Authorization": f"Bearer {body['access_token']}"}
+    return create
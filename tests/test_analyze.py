@@ -0,0 +1,29 @@
+from sqlalchemy import func, select
+
+from database import SessionLocal
+from models import Analysis
+
+FENS = ["r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3",
+        "rnbqkb1r/pp2pppp/3p1n2/8/3NP3/8/PPP2PPP/RNBQKB1R w KQkq - 1 5"]
+
+def test_batch_results_in_order_and_recorded_once(api, new_user):
+    async def body(client):
+        _, auth = await new_user(client)
+        first = await client.post("/analyze", json={"fens": FENS, "depth": 8}, headers=auth)
+        again = await client.post("/analyze", json={"fens": FENS, "depth": 8}, headers=auth)
+        return first.json(), again.status_code
+    first, again = api(body)
+    assert again == 200
+    assert [r["fen"] for r in first["results"]] == FENS
+    with SessionLocal() as db:
+        rows = db.execute(select(Analysis.fen, func.count()).where(Analysis.depth == 8)
+                          .group_by(Analysis.fen)).all()
+    assert sorted(rows) == sorted((f, 1) for f in FENS)       # upserted, not duplicated
+
+def test_bad_requests(api, new_user):
+    async def body(client):
+        _, auth = await new_user(client)
+        both = await client.post("/analyze", json={"fens": FENS, "depth": 8, "time_ms": 50}, headers=auth)
+        bad = await client.post("/analyze", json={"fens": ["not a fen"]}, headers=auth)
+        return both.status_code, bad.status_code
+    assert api(body) == (400, 400)
@@ -0,0 +1,7 @@
+def test_hash_latency_is_exported(api, new_user):
+    async def body(client):
+        await new_user(client)
+        return (await client.get("/metrics")).text
+    text = api(body)
+    assert "# TYPE deepply_password_hash_seconds histogram" in text
+    assert 'deepply_password_hash_seconds_count{op="hash"}' in text
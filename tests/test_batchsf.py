@@ -0,0 +1,60 @@
+import asyncio
+import chess
+
+from utils import batchsf
+from utils.enginepool import EnginePool
+
+FENS = [chess.Board().fen(), "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3",
+        "r1bq1rk1/ppp2ppp/2np1n2/2b1p3/2B1P3/2PP1N2/PP3PPP/RNBQ1RK1 w - - 0 7"]
+
+def analyse_on_pool(monkeypatch, size=2, **kwargs):
+    async def run():
+        pool = EnginePool(size=size, threads=1, hash_mb=16)
+        await pool.start()
+        monkeypatch.setattr(batchsf, "pool", pool)
+        try:
+            return await batchsf.analyse_batch_stockfishlike(FENS, depth=6, use_cache=False, _probe=False, **kwargs), pool
+        finally:
+            await pool.close(timeout=1)
+    return asyncio.run(run())
+
+def test_plan_workers_stays_within_the_core_budget():
+    assert batchsf.plan_workers(40, workers=4, threads=1, budget=8) == 4
+    assert batchsf.plan_workers(40, workers=4, threads=4, budget=8) == 2
+    assert batchsf.plan_workers(2, workers=4, threads=1, budget=8) == 2
+    assert batchsf.plan_workers(40, workers=4, threads=16, budget=8) == 1
+
+def test_chunks_are_contiguous_and_cover_everything():
+    chunks = batchsf._chunks(list(range(7)), 3)
+    assert [list(c) for c in chunks] == [[0, 1, 2], [3, 4], [5, 6]]
+
+def test_split_across_engines_keeps_order(monkeypatch):
+    seen = []
+    results, pool = analyse_on_pool(monkeypatch, workers=2, on_result=lambda i, r: seen.append(i))
+    assert sorted(seen) == [0, 1, 2]
+    single, _ = analyse_on_pool(monkeypatch, size=1, workers=1)
+    assert [r["top_moves"][0]["Move"] for r in results] == [r["top_moves"][0]["Move"] for r in single]
+    assert pool.restarts == 0
+
+def test_searches_with_history_are_not_cached(monkeypatch):
+    from utils.evalcache import EvalCache
+    cache = EvalCache(use_db=False)
+    monkeypatch.setattr(batchsf, "eval_cache", cache)
+    board, fens = chess.Board(), []
+    for move in ("e2e4", "e7e5"):
+        board.push_uci(move)
+        fens.append(board.fen())
+
+    async def run():
+        pool = EnginePool(size=1, threads=1, hash_mb=16)
+        await pool.start()
+        monkeypatch.setattr(batchsf, "pool", pool)
+        try:
+            await batchsf.analyse_batch_stockfishlike(fens, depth=6, _probe=False, order="backward",
+                                                      history=(chess.STARTING_FEN, ["e2e4", "e7e5"], [0, 1]))
+            await batchsf.analyse_batch_stockfishlike(fens[:1], depth=6, _probe=False)
+        finally:
+            await pool.close(timeout=1)
+    asyncio.run(run())
+    assert cache.get_many(fens, depth=6) == [cache.get(fens[0], depth=6), None]
+    assert cache.get(fens[0], depth=6) is not None
@@ -0,0 +1,47 @@
+import numpy as np
+
+from utils import classify as cls
+from utils.classify import EvalSeries, classify, label, winning_chances
+
+def ev(cp=None, mate=None, moves=("e2e4",), second=None):
+    if cp is None and mate is None:
+        return {"evaluation": {"type": "cp", "value": 0}, "top_moves": []}
+    evaluation = {"type": "mate", "value": mate} if mate is not None else {"type": "cp", "value": cp}
+    top = [{"Move": moves[0], "Centipawn": cp, "Mate": mate}]
+    if second is not None:
+        top.append({"Move": "a2a3", "Centipawn": second, "Mate": None})
+    return {"evaluation": evaluation, "top_moves": top}
+
+def labels(results, played, mode="cp"):
+    return [label(c) for c in classify(EvalSeries.from_results(results), played, mode)]
+
+def test_loss_thresholds():
+    # Side to move's POV: white is +20, then each move hands the opponent a score.
+    results = [ev(20), ev(-10), ev(90), ev(400)]
+    assert labels(results, [None, "e2e4", "e7e5", "d1h5"]) == [None, None, "mistake", "blunder"]
+
+def test_great_move_needs_the_best_move_and_a_gap():
+    results = [ev(300, moves=("d1h5",), second=50), ev(-300)]
+    assert labels(results, [None, "d1h5"]) == [None, "great"]
+    assert labels(results, [None, "a2a3"]) == [None, None]
+
+def test_unknown_positions_stay_unlabelled():
+    results = [ev(20), ev(), ev(-500)]
+    assert labels(results, [None, "e2e4", "e7e5"]) == [None, None, None]
+    series = EvalSeries.from_results(results)
+    assert np.isnan(series.score[1]) and series.best[1] is None
+
+def test_mates_map_near_mate_cp():
+    series = EvalSeries.from_results([ev(mate=3), ev(mate=-2)])
+    assert series.score[0] == cls.MATE_CP - 3
+    assert series.score[1] == -(cls.MATE_CP - 2)
+
+def test_winprob_mode_forgives_losses_in_won_positions():
+    results = [ev(1500), ev(-1200)]                        # 3 pawns dropped, still completely winning
+    assert labels(results, [None, "e2e4"], mode="cp") == [None, "blunder"]
+    assert labels(results, [None, "e2e4"], mode="winprob") == [None, None]
+
+def test_winning_chances_is_bounded_and_odd():
+    wc = winning_chances(np.array([-10000.0, -100.0, 0.0, 100.0, 10000.0]))
+    assert wc[2] == 0 and wc[1] == -wc[3]
+    assert -1 < wc[0] < -0.99 and 0.99 < wc[4] < 1
@@ -0,0 +1,28 @@
+import gzip
+import msgpack
+import orjson
+from starlette.requests import Request
+
+from utils.encoding import encode
+
+def request(accept="", accept_encoding=""):
+    headers = [(b"accept", accept.encode()), (b"accept-encoding", accept_encoding.encode())]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+PAYLOAD = {"plies": 3, "cp": [20, None, -15], "best": ["e2e4", None, "g1f3"]}
+
+def test_json_by_default():
+    r = encode(request(), PAYLOAD)
+    assert r.media_type == "application/json" and orjson.loads(r.body) == PAYLOAD
+    assert "Accept" in r.headers["Vary"]
+
+def test_msgpack_when_asked():
+    r = encode(request("application/json;q=0.5, application/msgpack"), PAYLOAD)
+    assert r.media_type == "application/msgpack" and msgpack.unpackb(r.body) == PAYLOAD
+
+def test_gzip_only_for_large_bodies():
+    small = encode(request(accept_encoding="gzip"), PAYLOAD)
+    assert "content-encoding" not in small.headers
+    big = {"cp": list(range(2000))}
+    r = encode(request(accept_encoding="gzip, br"), big)
+    assert r.headers["content-encoding"] == "gzip" and orjson.loads(gzip.decompress(r.body)) == big
@@ -0,0 +1,117 @@
+import asyncio
+import chess
+import chess.engine
+from fastapi import HTTPException
+
+from utils.enginepool import EnginePool
+from utils.scheduler import scheduler, priority
+
+def run_with_pool(body, size=2):
+    async def run():
+        pool = EnginePool(size=size, threads=1, hash_mb=16)
+        await pool.start()
+        try:
+            return await body(pool)
+        finally:
+            await pool.close(timeout=1)
+    return asyncio.run(run())
+
+def test_checkout_and_checkin():
+    async def body(pool):
+        assert pool.idle == 2
+        async with pool.lease() as lease:
+            assert pool.idle == 1
+            info = await lease.engine.analyse(chess.Board(), chess.engine.Limit(depth=5))
+            assert info["depth"] == 5 and info["pv"]
+        assert pool.idle == 2
+        return True
+    assert run_with_pool(body)
+
+def test_try_checkout_does_not_wait():
+    async def body(pool):
+        held = await pool.checkout()
+        assert await pool.try_checkout() is None
+        await pool.checkin(held)
+        extra = await pool.try_checkout()
+        assert extra is not None
+        await pool.checkin(extra)
+        return True
+    assert run_with_pool(body, size=1)
+
+def test_broken_lease_gets_a_fresh_engine():
+    async def body(pool):
+        lease = await pool.checkout()
+        old = lease.engine
+        await pool.checkin(lease, broken=True)
+        async with pool.lease() as again:
+            assert again.engine is not old
+            await again.engine.ping()
+        return pool.restarts
+    assert run_with_pool(body, size=1) == 1
+
+def test_caller_errors_do_not_restart_the_engine():
+    async def body(pool):
+        for exc in (HTTPException(status_code=400), ValueError("bad input"), asyncio.CancelledError()):
+            try:
+                async with pool.lease():
+                    raise exc
+            except BaseException as e:
+                assert e is exc
+        return pool.restarts
+    assert run_with_pool(body, size=1) == 0
+
+def test_engine_errors_restart_the_engine():
+    async def body(pool):
+        try:
+            async with pool.lease():
+                raise chess.engine.EngineTerminatedError("engine died")
+        except chess.engine.EngineError:
+            pass
+        return pool.restarts
+    assert run_with_pool(body, size=1) == 1
+
+def test_close_fails_queued_checkouts():
+    async def run():
+        pool = EnginePool(size=1, threads=1, hash_mb=16)
+        await pool.start()
+        held = await pool.checkout()
+        waiter = asyncio.create_task(pool.checkout())
+        await asyncio.sleep(0.01)
+        await pool.close(timeout=0.1)
+        await pool.checkin(held)
+        try:
+            await asyncio.wait_for(waiter, 1)
+        except HTTPException as e:
+            return e.status_code, scheduler.waiting()
+    assert asyncio.run(run()) == (503, 0)
+
+def test_waiters_are_served_by_priority():
+    async def body(pool):
+        held = await pool.checkout()
+        served = []
+
+        async def want(cls):
+            with priority(cls, None):
+                async with pool.lease():
+                    served.append(cls)
+
+        tasks = [asyncio.create_task(want("backfill")), asyncio.create_task(want("interactive"))]
+        await asyncio.sleep(0.01)
+        assert scheduler.waiting() == 2
+        await pool.checkin(held)
+        await asyncio.gather(*tasks)
+        return served
+    assert run_with_pool(body, size=1) == ["interactive", "backfill"]
+
+def test_cancelled_waiter_releases_its_place():
+    async def body(pool):
+        held = await pool.checkout()
+        waiter = asyncio.create_task(pool.checkout())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert scheduler.waiting() == 0 and not scheduler._queues["review"]
+        await pool.checkin(held)
+        assert pool.idle == 1                              # nobody to hand it to: parked
+        return True
+    assert run_with_pool(body, size=1)
@@ -0,0 +1,70 @@
+from utils.evalcache import EvalCache, position_key
+
+FEN = "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3"
+
+def result(cp, depth, moves=("f1b5", "f1c4", "d2d4")):
+    return {"evaluation": {"type": "cp", "value": cp},
+            "top_moves": [{"Move": m, "Centipawn": cp - 10 * i, "Mate": None, "Depth": depth, "Time": 50}
+                          for i, m in enumerate(moves)]}
+
+def test_position_key_ignores_move_counters():
+    assert position_key(FEN) == position_key(FEN.replace(" 2 3", " 0 9"))
+    assert position_key(FEN) != position_key(FEN.replace(" w ", " b "))
+
+def test_deeper_entry_answers_shallower_requests():
+    cache = EvalCache(use_db=False)
+    cache.put(FEN, result(30, 18), depth=18, multipv=3)
+    assert cache.get(FEN, depth=12)["evaluation"]["value"] == 30
+    assert cache.get(FEN, depth=20) is None
+    assert cache.get(FEN, depth=12, multipv=4) is None
+    assert len(cache.get(FEN, depth=12, multipv=2)["top_moves"]) == 2
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 2
+
+def test_shallower_put_keeps_the_deeper_entry():
+    cache = EvalCache(use_db=False)
+    cache.put(FEN, result(30, 18), depth=18)
+    cache.put(FEN, result(-5, 8), depth=8)
+    assert cache.get(FEN, depth=18)["evaluation"]["value"] == 30
+
+def test_lru_evicts_oldest():
+    cache = EvalCache(size=1, use_db=False)
+    cache.put(FEN, result(30, 10), depth=10)
+    cache.put("8/8/8/4k3/8/8/4P3/4K3 w - - 0 1", result(200, 10), depth=10)
+    assert cache.stats()["size"] == 1
+    assert cache.get(FEN, depth=10) is None
+
+def test_empty_results_are_not_cached():
+    cache = EvalCache(use_db=False)
+    cache.put(FEN, {"evaluation": {"type": "cp", "value": 0}, "top_moves": []}, depth=10)
+    assert cache.stats()["size"] == 0
+
+def test_database_tier():
+    fen = "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1"
+    EvalCache().put(fen, result(500, 16, ("d1d8",)), depth=16)
+    fresh = EvalCache()                                    # another process: empty memory tier
+    assert fresh.get(fen, depth=16)["top_moves"][0]["Move"] == "d1d8"
+    assert fresh.stats()["db_hits"] == 1
+    EvalCache().put(fen, result(480, 20, ("d1d8",)), depth=20)
+    EvalCache().put(fen, result(0, 10, ("g1f1",)), depth=10)  # shallower: doesn't replace the stored row
+    assert EvalCache().get(fen, depth=20)["evaluation"]["value"] == 480
+
+def test_losing_the_insert_race_keeps_the_deeper_row(monkeypatch):
+    from utils import evalcache
+    fen = "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1"
+    EvalCache().put(fen, result(90, 22, ("e2e4",)), depth=22)   # the other writer got there first
+
+    class Stale:                                           # its row wasn't visible to our pre-check
+        def filter(self, *args):
+            return []
+    real = evalcache.SessionLocal
+
+    def session():
+        db = real()
+        db.query = lambda *args: Stale()
+        return db
+    monkeypatch.setattr(evalcache, "SessionLocal", session)
+    other = "8/8/8/4k3/8/8/4P3/4K3 b - - 0 1"
+    EvalCache().put_many([fen, other], [result(10, 12, ("b4b1",)), result(-200, 12)], depth=12)
+    monkeypatch.setattr(evalcache, "SessionLocal", real)
+    assert EvalCache().get(fen, depth=22)["evaluation"]["value"] == 90
+    assert EvalCache().get(other, depth=12) is not None    # the rest of the batch still commits
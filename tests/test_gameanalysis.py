@@ -0,0 +1,70 @@
+from models import GameAnalysis
+from utils.gameanalysis import (ANALYSIS_VERSION, _pack_move, _unpack_move, compact_analysis,
+                                pack_analysis, unpack_analysis)
+
+def ply(move, kind="cp", value=0, best="e2e4", label=None):
+    top = [{"Move": best}] if kind else []
+    return {"move_made": move, "evaluation": {"type": kind or "cp", "value": value},
+            "top_moves": top, "classification": label}
+
+RESULT = {
+    "opening": {"eco": "C41", "name": "Philidor Defense"},
+    "evaluations": [
+        ply(None, value=25, label="book"),
+        ply("e2e4", value=-30, best="e7e5", label="book"),
+        ply("e7e5", value=40, best="g1f3"),
+        ply("g1f3", kind=None),                             # timed out
+        ply("d7d6", kind="mate", value=3, best="d1h5", label="blunder"),
+        ply("d1h5", kind="mate", value=-2, best="b7b8q", label="great"),
+    ],
+}
+
+def test_moves_pack_into_16_bits():
+    for uci in ("e2e4", "a7a8q", "h2h1n", "e1g1"):
+        code = _pack_move(uci)
+        assert code < 2**16 and _unpack_move(code) == uci
+    assert _unpack_move(_pack_move(None)) is None
+
+def test_pack_unpack_round_trip():
+    row = GameAnalysis(game_id=1, **pack_analysis(RESULT))
+    out = unpack_analysis(row)
+    assert out["version"] == ANALYSIS_VERSION and not out["stale"]
+    assert out["plies"] == 6 and out["book_plies"] == 2
+    assert out["opening"] == {"eco": "C41", "name": "Philidor Defense"}
+    assert out["cp"] == [25, -30, 40, None, None, None]
+    assert out["mate"] == [None, None, None, None, 3, -2]
+    assert out["best"] == ["e2e4", "e7e5", "g1f3", None, "d1h5", "b7b8q"]
+    assert out["classification"] == ["book", "book", None, None, "blunder", "great"]
+
+def test_stale_version_is_flagged():
+    row = GameAnalysis(game_id=1, **{**pack_analysis(RESULT), "version": "old"})
+    assert unpack_analysis(row)["stale"]
+
+def test_compact_matches_stored_arrays():
+    stored = unpack_analysis(GameAnalysis(game_id=1, **pack_analysis(RESULT)))
+    compact = compact_analysis(RESULT)
+    for field in ("plies", "book_plies", "opening", "cp", "mate", "best", "classification"):
+        assert compact[field] == stored[field], field
+    assert compact["moves"] == [e["move_made"] for e in RESULT["evaluations"]]
+
+
+def test_errors_pass_through_compact():
+    assert compact_analysis({"error": "Invalid PGN"}) == {"error": "Invalid PGN"}
+
+def test_only_the_owner_can_read_a_game(api, new_user):
+    from database import AsyncSessionLocal
+    from models import Game
+
+    async def body(client):
+        owner, _ = await new_user(client)
+        _, other = await new_user(client)
+        async with AsyncSessionLocal() as db:
+            game = Game(user_id=owner, user_color=True, result="1-0", pgn="1. e4 e5 1-0",
+                        time_control="blitz", game_type="online")
+            db.add(game)
+            await db.commit()
+            game_id = game.id
+        theirs = await client.get(f"/games/{game_id}", headers=other)
+        missing = await client.get("/games/999999", headers=other)
+        return theirs.status_code, missing.status_code
+    assert api(body) == (403, 404)
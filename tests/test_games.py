@@ -0,0 +1,49 @@
+from database import AsyncSessionLocal
+from models import Game
+
+async def add_games(user_id, n):
+    async with AsyncSessionLocal() as db:
+        for _ in range(n):
+            db.add(Game(user_id=user_id, user_color=True, result="1-0", pgn="1. e4 e5 1-0",
+                        time_control="blitz", game_type="online"))
+        await db.commit()
+
+def test_pagination_walks_every_page_once(api, new_user):
+    async def body(client):
+        uid, auth = await new_user(client)
+        await add_games(uid, 5)
+        pages, cursor = [], None
+        while len(pages) < 10:
+            params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+            r = await client.get(f"/users/{uid}/games", params=params, headers=auth)
+            assert r.status_code == 200
+            pages.append([g["id"] for g in r.json()])
+            cursor = r.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+        return pages
+    pages = api(body)
+    ids = [i for page in pages for i in page]
+    assert [len(p) for p in pages] == [2, 2, 1]
+    assert len(set(ids)) == 5 and ids == sorted(ids, reverse=True)
+
+def test_invalid_cursor_is_a_400(api, new_user):
+    async def body(client):
+        uid, auth = await new_user(client)
+        r = await client.get(f"/users/{uid}/games", params={"cursor": "nope"}, headers=auth)
+        return r.status_code
+    assert api(body) == 400
+
+def test_listings_only_show_your_own_games(api, new_user):
+    async def body(client):
+        a, auth_a = await new_user(client)
+        _, auth_b = await new_user(client)
+        await add_games(a, 2)
+        mine = await client.get("/games", params={"include_pgn": True}, headers=auth_a)
+        theirs = await client.get("/games", params={"user_id": a, "include_pgn": True}, headers=auth_b)
+        direct = await client.get(f"/users/{a}/games", headers=auth_b)
+        anonymous = await client.get("/games")
+        return mine.json(), theirs.json(), direct.status_code, anonymous.status_code
+    mine, theirs, direct, anonymous = api(body)
+    assert len(mine) == 2 and all(g["pgn"] for g in mine)
+    assert theirs == [] and direct == 403 and anonymous == 401
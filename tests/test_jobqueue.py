@@ -0,0 +1,136 @@
+import asyncio, itertools
+from datetime import timedelta, timezone
+
+from sqlalchemy import select
+
+from database import AsyncSessionLocal, async_engine
+from models import Game, GameAnalysis, User
+from utils import jobqueue
+
+_ids = itertools.count()
+
+def run(body):
+    async def wrapper():
+        try:
+            async with AsyncSessionLocal() as db:
+                return await body(db)
+        finally:
+            await async_engine.dispose()
+    return asyncio.run(wrapper())
+
+async def new_game(db):
+    n = next(_ids)
+    user = User(username=f"jq{n}", email=f"jq{n}@test.local", password_hash="x")
+    db.add(user)
+    await db.flush()
+    game = Game(user_id=user.id, user_color=True, result="1-0", pgn="1. e4 e5 1-0",
+                time_control="blitz", game_type="online")
+    db.add(game)
+    await db.commit()
+    return game
+
+async def drain(db):
+    """Finish any job earlier tests left runnable so claim() sees only this test's jobs."""
+    while (job := await jobqueue.claim(db, "drain")) is not None:
+        await jobqueue.complete(db, job.id, "drain", {})
+
+def test_enqueue_is_idempotent_per_game():
+    async def body(db):
+        game = await new_game(db)
+        first = await jobqueue.enqueue(db, game.id, game.user_id)
+        again = await jobqueue.enqueue(db, game.id, game.user_id)
+        return first.id == again.id and first.status == "queued"
+    assert run(body)
+
+def test_claim_complete():
+    async def body(db):
+        await drain(db)
+        game = await new_game(db)
+        queued = await jobqueue.enqueue(db, game.id, game.user_id)
+        job = await jobqueue.claim(db, "w1")
+        job_id = job.id                                    # claim() rolls back when it finds nothing
+        assert job_id == queued.id and job.status == "running" and job.attempts == 1
+        assert await jobqueue.claim(db, "w2") is None
+        assert await jobqueue.heartbeat(db, job_id, "w1")
+        assert not await jobqueue.complete(db, job_id, "w2", {"evaluations": []})   # not its job
+        assert await jobqueue.complete(db, job_id, "w1", {"evaluations": []})
+        return jobqueue.summary(await jobqueue.get_job(db, job_id))
+    done = run(body)
+    assert done["status"] == "done" and done["analysis"] == {"evaluations": []}
+
+def test_expired_lease_is_reclaimed():
+    async def body(db):
+        await drain(db)
+        game = await new_game(db)
+        await jobqueue.enqueue(db, game.id, game.user_id)
+        job = await jobqueue.claim(db, "dead", lease_s=-1)
+        again = await jobqueue.claim(db, "alive")
+        assert again.id == job.id and again.worker_id == "alive" and again.attempts == 2
+        assert not await jobqueue.heartbeat(db, job.id, "dead")                     # the old owner lost it
+        await jobqueue.complete(db, job.id, "alive", {})
+        return True
+    assert run(body)
+
+def test_fail_backs_off_then_gives_up():
+    async def body(db):
+        await drain(db)
+        game = await new_game(db)
+        await jobqueue.enqueue(db, game.id, game.user_id)
+        job = await jobqueue.claim(db, "w1")
+        job_id = job.id
+        await jobqueue.fail(db, job, "w1", "engine crashed")
+        job = await jobqueue.get_job(db, job_id)
+        assert job.status == "queued" and job.run_after.replace(tzinfo=timezone.utc) > jobqueue._now()   # SQLite hands back naive UTC
+        assert await jobqueue.claim(db, "w1") is None                               # still backing off
+        job = await jobqueue.get_job(db, job_id)
+        job.run_after = jobqueue._now() - timedelta(seconds=1)
+        await db.commit()
+        job = await jobqueue.claim(db, "w1")
+        await jobqueue.fail(db, job, "w1", "bad pgn", retry=False)
+        return jobqueue.summary(await jobqueue.get_job(db, job_id))
+    out = run(body)
+    assert out["status"] == "error" and out["error"] == "bad pgn" and out["attempts"] == 2
+
+def test_release_does_not_count_the_attempt():
+    async def body(db):
+        await drain(db)
+        game = await new_game(db)
+        await jobqueue.enqueue(db, game.id, game.user_id)
+        job = await jobqueue.claim(db, "w1")
+        await jobqueue.release(db, job.id, "w1")
+        job = await jobqueue.get_job(db, job.id)
+        assert job.status == "queued" and job.attempts == 0 and job.worker_id is None
+        job = await jobqueue.claim(db, "w2")
+        await jobqueue.complete(db, job.id, "w2", {})
+        return job.attempts
+    assert run(body) == 1
+
+def test_purge_removes_finished_jobs():
+    async def body(db):
+        await drain(db)
+        game = await new_game(db)
+        job = await jobqueue.enqueue(db, game.id, game.user_id)
+        job = await jobqueue.claim(db, "w1")
+        await jobqueue.complete(db, job.id, "w1", {})
+        assert await jobqueue.purge(db, retention_s=-60) >= 1
+        return await jobqueue.get_job(db, job.id)
+    assert run(body) is None
+
+def test_worker_that_lost_its_lease_writes_nothing(monkeypatch):
+    import worker
+
+    async def analysis(pgn):
+        return {"evaluations": []}
+    monkeypatch.setattr(worker, "game_analysis", analysis)
+
+    async def body(db):
+        await drain(db)
+        game = await new_game(db)
+        await jobqueue.enqueue(db, game.id, game.user_id)
+        job = await jobqueue.claim(db, worker.WORKER_ID, lease_s=-1)
+        await jobqueue.claim(db, "alive")
+        await worker._run(job)
+        job = await jobqueue.get_job(db, job.id)
+        saved = (await db.execute(select(GameAnalysis).where(GameAnalysis.game_id == game.id))).scalar()
+        return job.status, job.worker_id, saved
+    assert run(body) == ("running", "alive", None)
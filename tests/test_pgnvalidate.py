@@ -0,0 +1,31 @@
+import asyncio
+
+from utils import batchsf, pgnvalidate
+from utils.evalcache import EvalCache
+
+PGN = "1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 4. Ba4 Nf6 1-0"
+
+def test_book_plies_are_not_searched(monkeypatch):
+    cache = EvalCache(use_db=False)
+    monkeypatch.setattr(batchsf, "eval_cache", cache)
+    monkeypatch.setattr(pgnvalidate, "eval_cache", cache)
+    monkeypatch.setattr(pgnvalidate, "BOOK_MS", 0)
+    monkeypatch.setattr(pgnvalidate.opening_book, "book_plies", lambda root, moves: 4)
+    parsed = pgnvalidate.parse_pgn(PGN)
+    cache.put(parsed.fens[0], {"evaluation": {"type": "cp", "value": 30},
+                               "top_moves": [{"Move": "e7e5", "Centipawn": 30, "Mate": None}]}, depth=20)
+    searched = []
+
+    async def spy(fens, **kwargs):
+        searched.extend(fens)
+        return await batchsf.analyse_batch_stockfishlike(fens, **kwargs)
+    monkeypatch.setattr(pgnvalidate, "analyse_batch_stockfishlike", spy)
+
+    out = asyncio.run(pgnvalidate.game_analysis(parsed))
+    evals = out["evaluations"]
+    assert not set(searched) & set(parsed.fens[:3])
+    assert parsed.fens[3] in searched                      # the last book ply is the baseline for ply 4
+    assert evals[0]["evaluation"]["value"] == 30           # cached
+    assert [e["top_moves"] for e in evals[1:3]] == [[], []]
+    assert [e["classification"] for e in evals[:4]] == ["book"] * 4
+    assert all(e["top_moves"] for e in evals[3:])
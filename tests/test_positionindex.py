@@ -0,0 +1,41 @@
+import asyncio, io
+import chess
+import chess.pgn
+
+from database import AsyncSessionLocal, async_engine
+from models import Game, User
+from utils.positionindex import find_position, index_game, position_hash, position_hashes
+
+def parse(moves):
+    return chess.pgn.read_game(io.StringIO(moves))
+
+def test_root_is_ply_zero():
+    hashes = dict((ply, h) for h, ply in position_hashes(parse("1. Nf3 Nf6 2. Ng1 Ng8 3. e4 *")))
+    assert hashes[0] == position_hash(chess.Board())
+    assert 4 not in hashes                                 # back at the start: first occurrence only
+    assert sorted(hashes) == [0, 1, 2, 3, 5]
+
+def test_unfinished_games_are_not_scored():
+    async def run():
+        try:
+            async with AsyncSessionLocal() as db:
+                user = User(username="posidx", email="posidx@test.local", password_hash="x")
+                db.add(user)
+                await db.flush()
+                for result in ("1-0", "0-1", "1/2-1/2", "*"):
+                    pgn = f"1. e4 e5 {result}"
+                    game = Game(user_id=user.id, user_color=True, result=result, pgn=pgn,
+                                time_control="blitz", game_type="online")
+                    db.add(game)
+                    await db.flush()
+                    await index_game(db, game, parse(pgn))
+                await db.commit()
+                start = await find_position(db, user.id, chess.STARTING_FEN)
+                after = await find_position(db, user.id, "rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2")
+                return start, after
+        finally:
+            await async_engine.dispose()
+    start, after = asyncio.run(run())
+    assert start["games"] == 4 and start["matches"][0]["ply"] == 0
+    assert after["stats"] == {"wins": 1, "draws": 1, "losses": 1, "unfinished": 1, "score": 0.5}
+    assert sorted(m["score"] is None for m in after["matches"]) == [False, False, False, True]
@@ -0,0 +1,101 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+
+from utils import scheduler as sched
+from utils.scheduler import Scheduler, priority, current
+
+def test_priority_is_scoped():
+    assert current() == ("review", None)
+    with priority("interactive", 7):
+        assert current() == ("interactive", 7)
+    assert current() == ("review", None)
+
+def test_classes_share_by_weight():
+    async def run():
+        s = Scheduler(weights={"interactive": 2, "review": 1, "backfill": 1})
+        futs = {c: [s.enqueue(c, None) for _ in range(4)] for c in ("interactive", "backfill")}
+        order = []
+        while (fut := s.next()) is not None:
+            fut.set_result(None)
+            order.append("i" if fut in futs["interactive"] else "b")
+        return "".join(order)
+    order = asyncio.run(run())
+    assert sorted(order) == sorted("iiiibbbb")
+    assert order[:3] in ("iib", "ibi")                     # backfill isn't starved by interactive
+
+def test_users_take_turns_within_a_class():
+    async def run():
+        s = Scheduler()
+        a = [s.enqueue("review", 1) for _ in range(3)]
+        for _ in range(2):
+            s.enqueue("review", 2)
+        order = []
+        while (fut := s.next()) is not None:
+            fut.set_result(None)
+            order.append(1 if fut in a else 2)
+        return order
+    assert asyncio.run(run()) == [1, 2, 1, 2, 1]
+
+def test_next_skips_cancelled_waiters():
+    async def run():
+        s = Scheduler()
+        gone = s.enqueue("review", 1)
+        live = s.enqueue("review", 2)
+        gone.cancel()
+        return s.next() is live and s.next() is None
+    assert asyncio.run(run())
+
+def test_admit_limits(monkeypatch):
+    monkeypatch.setattr(sched, "MAX_QUEUE_PER_USER", 2)
+    monkeypatch.setattr(sched, "MAX_QUEUE", 3)
+
+    async def run():
+        s = Scheduler()
+        s.enqueue("review", 1)
+        s.admit("review", 1)
+        s.enqueue("review", 1)
+        with pytest.raises(HTTPException) as per_user:
+            s.admit("review", 1)
+        s.enqueue("review", 2)
+        with pytest.raises(HTTPException) as full:
+            s.admit("review", 3)
+        s.admit("interactive", 3)                          # other classes have their own queue
+        return per_user.value, full.value, s.rejected
+    per_user, full, rejected = asyncio.run(run())
+    assert per_user.status_code == 429 and full.status_code == 503
+    assert "Retry-After" in full.headers
+    assert rejected == 2
+
+def test_cancelled_waiters_do_not_count(monkeypatch):
+    monkeypatch.setattr(sched, "MAX_QUEUE_PER_USER", 1)
+
+    async def run():
+        s = Scheduler()
+        gone = s.enqueue("review", 1)
+        gone.cancel()
+        assert s.waiting() == 0
+        s.admit("review", 1)                               # not a 429 for a request that went away
+        s.discard("review", 1, gone)
+        return s._queues["review"]
+    assert not asyncio.run(run())
+
+def test_quota():
+    s = Scheduler(quota_s=10, window_s=3600)
+    s.charge("review", 1, 6)
+    s.admit("review", 1)
+    s.charge("review", 1, 6)
+    assert s.over_quota(1) and not s.over_quota(2)
+    with pytest.raises(HTTPException) as exc:
+        s.admit("review", 1)
+    assert exc.value.status_code == 429
+    assert s.snapshot()["users_over_quota"] == 1
+
+def test_over_quota_backfill_yields():
+    async def run():
+        s = Scheduler(quota_s=1, window_s=3600)
+        s.charge("backfill", 1, 5)
+        heavy = s.enqueue("backfill", 1)
+        light = s.enqueue("backfill", 2)
+        return s.next() is light and s.next() is heavy
+    assert asyncio.run(run())
@@ -1,17 +1,34 @@
 # utils/batchsf.py
 from __future__ import annotations
-import os, asyncio, inspect
-from typing import List, Dict, Any
+import os, asyncio
+from typing import List, Dict, Any, Optional, Callable, Sequence, Tuple, Union
 import chess
 import chess.engine
 
-ENGINE_PATH    = os.getenv("STOCKFISH_PATH", "/usr/games/stockfish")
-SF_THREADS     = int(os.getenv("SF_THREADS", "4"))
-SF_HASH_MB     = int(os.getenv("SF_HASH", "256"))
+from utils.enginepool import ENGINE_PATH, ENGINE_FAILURES, SF_THREADS, SF_HASH_MB, pool, Lease, spawn_engine, close_engine
+from utils.evalcache import eval_cache
+from utils.tablebase import tablebase
+from utils.metrics import metrics, stage, record_search
+
 PER_POS_MS     = os.getenv("REVIEW_MS_PER_POS", 100)
 
-def _limits() -> chess.engine.Limit:
-    return chess.engine.Limit(time=int(PER_POS_MS) / 1000.0)
+OnResult = Optional[Callable[[int, Dict[str, Any]], None]]     # (index into fens, result)
+Position = Union[str, chess.Board]                             # a Board keeps its move history
+History  = Optional[Tuple[str, Sequence[str], Sequence[int]]]  # (root fen, uci moves, ply of each fen)
+REVIEW_WORKERS = int(os.getenv("REVIEW_WORKERS", "1"))
+CORE_BUDGET    = int(os.getenv("REVIEW_CORE_BUDGET", os.cpu_count() or 1))  # cores one review may use (engines x threads)
+REVIEW_ORDER   = os.getenv("REVIEW_ORDER", "forward")      # "forward" | "backward"
+DEPTH_TIMEOUT  = float(os.getenv("SF_DEPTH_TIMEOUT", "60"))  # depth-limited searches get this long before the engine is replaced
+
+def _limits(time_ms: Optional[int] = None, depth: Optional[int] = None) -> chess.engine.Limit:
+    if depth is not None:
+        return chess.engine.Limit(depth=int(depth))
+    return chess.engine.Limit(time=int(time_ms if time_ms is not None else PER_POS_MS) / 1000.0)
+
+def _timeout(lim: chess.engine.Limit) -> float:
+    if lim.time is None:
+        return DEPTH_TIMEOUT
+    return max(5.0, 2 * lim.time + 1.0)
 
 def _pov_to_eval(ps: chess.engine.PovScore, turn: chess.Color) -> Dict[str, Any]:
     """Return {"type": "cp"|"mate", "value": int} from a PovScore, POV = side to move."""
@@ -67,44 +84,255 @@ def _topmove(board: chess.Board, info: Dict[str, Any]) -> Dict[str, Any]:
         "Pv": " ".join(pv_uci),
     }
 
-async def _analyse_with_engine(eng: chess.engine.AsyncEngine, fens: List[str], multipv: int) -> List[Dict[str, Any]]:
+def _remap(on_result: OnResult, index: List[int]) -> OnResult:
+    """Translate callback indices of a sub-list back to the caller's list."""
+    if on_result is None:
+        return None
+    return lambda i, r: on_result(index[i], r)
+
+async def _analyse_with_engine(eng: chess.engine.AsyncEngine, fens: List[Position], multipv: int,
+                               lease: Optional[Lease] = None, on_result: OnResult = None,
+                               time_ms: Optional[int] = None, depth: Optional[int] = None) -> List[Dict[str, Any]]:
     # Do NOT set MultiPV here; python-chess manages it when you pass multipv=
-    await eng.configure({"Threads": SF_THREADS, "Hash": SF_HASH_MB})
-    lim = _limits()
+    # Threads/Hash are set once when the engine is spawned (see utils/enginepool.py).
+    lim = _limits(time_ms, depth)
     out: List[Dict[str, Any]] = []
     for fen in fens:
-        board = chess.Board(fen)
+        board = fen if isinstance(fen, chess.Board) else chess.Board(fen)
         try:
-            info = await asyncio.wait_for(eng.analyse(board, lim, multipv=multipv), timeout=5.0)
+            info = await asyncio.wait_for(eng.analyse(board, lim, multipv=multipv), timeout=_timeout(lim))
         except asyncio.TimeoutError:
+            metrics.inc("deepply_engine_timeouts_total")
+            # A hung search leaves the engine in an unknown state; swap it for a fresh one.
+            if lease is not None:
+                eng = await lease.restart()
             out.append({"evaluation": {"type": "cp", "value": 0}, "top_moves": []})
-            continue
-        infos = info if isinstance(info, list) else [info]
-        if infos and "score" in infos[0]:
-            eval_obj = _pov_to_eval(infos[0]["score"], board.turn)
         else:
-            eval_obj = {"type": "cp", "value": 0}
-        out.append({"evaluation": eval_obj, "top_moves": [_topmove(board, v) for v in infos]})
+            infos = info if isinstance(info, list) else [info]
+            if infos and "score" in infos[0]:
+                eval_obj = _pov_to_eval(infos[0]["score"], board.turn)
+            else:
+                eval_obj = {"type": "cp", "value": 0}
+            out.append({"evaluation": eval_obj, "top_moves": [_topmove(board, v) for v in infos]})
+            if out[-1]["top_moves"]:
+                record_search(out[-1]["top_moves"][0])
+        if on_result is not None:
+            on_result(len(out) - 1, out[-1])
     return out
 
-async def analyse_batch_stockfishlike(fens: List[str], multipv: int = 1) -> List[Dict[str, Any]]:
+def _chunks(fens: List[str], n: int) -> List[range]:
+    """Split into n contiguous index ranges (neighbouring plies share hash entries)."""
+    size, extra = divmod(len(fens), n)
+    out, start = [], 0
+    for i in range(n):
+        end = start + size + (1 if i < extra else 0)
+        out.append(range(start, end))
+        start = end
+    return out
+
+def plan_workers(n_fens: int, workers: int, threads: int, budget: int = CORE_BUDGET) -> int:
+    """How many engines to use so that engines x threads stays within the per-request core budget."""
+    return max(1, min(workers, max(1, budget // max(1, threads)), n_fens))
+
+async def _analyse_pooled(fens: List[str], multipv: int, workers: int, on_result: OnResult = None,
+                          time_ms: Optional[int] = None, depth: Optional[int] = None) -> List[Dict[str, Any]]:
+    workers = plan_workers(len(fens), workers, pool.threads)
+    leases: List[Lease] = []
+    broken = False
+    try:
+        # Taken inside the try so the finally returns whatever was checked out if one of these fails.
+        with stage("engine_checkout"):
+            leases.append(await pool.checkout())
+        # Extra engines only if they're free right now; waiting for them could deadlock two requests.
+        while len(leases) < workers:
+            extra = await pool.try_checkout()
+            if extra is None:
+                break
+            leases.append(extra)
+        parts = await asyncio.gather(*(
+            _analyse_with_engine(l.engine, fens[c.start:c.stop], multipv, l, _remap(on_result, c), time_ms, depth)
+            for l, c in zip(leases, _chunks(fens, len(leases)))
+        ))
+    except ENGINE_FAILURES:
+        broken = True
+        raise
+    finally:
+        for l in leases:
+            await pool.checkin(l, broken=broken)
+    return [r for part in parts for r in part]
+
+async def _analyse_oneoff(fens: List[str], multipv: int, workers: int, on_result: OnResult = None,
+                          time_ms: Optional[int] = None, depth: Optional[int] = None) -> List[Dict[str, Any]]:
+    workers = plan_workers(len(fens), workers, 1)
+    threads = max(1, min(SF_THREADS, CORE_BUDGET // workers))
+    with stage("engine_spawn"):
+        spawned = await asyncio.gather(*(spawn_engine(threads, SF_HASH_MB) for _ in range(workers)),
+                                       return_exceptions=True)
+    engines = [e for e in spawned if not isinstance(e, BaseException)]
+    if len(engines) < len(spawned):
+        await asyncio.gather(*(close_engine(t, eng) for t, eng in engines))
+        raise next(e for e in spawned if isinstance(e, BaseException))
+    try:
+        parts = await asyncio.gather(*(
+            _analyse_with_engine(eng, fens[c.start:c.stop], multipv, on_result=_remap(on_result, c),
+                                 time_ms=time_ms, depth=depth)
+            for (_, eng), c in zip(engines, _chunks(fens, workers))
+        ))
+    finally:
+        await asyncio.gather(*(close_engine(t, eng) for t, eng in engines))
+    return [r for part in parts for r in part]
+
+async def _analyse_uncached(fens: List[str], multipv: int, workers: int, on_result: OnResult = None,
+                            time_ms: Optional[int] = None, depth: Optional[int] = None) -> List[Dict[str, Any]]:
+    if pool.started:
+        return await _analyse_pooled(fens, multipv, workers, on_result, time_ms, depth)
+
+    # No pool (scripts, tests): spin up one-off engines for this batch.
     if not ENGINE_PATH or not os.path.exists(ENGINE_PATH):
         raise FileNotFoundError(f"Stockfish not found at STOCKFISH_PATH='{ENGINE_PATH}'")
+    return await _analyse_oneoff(fens, multipv, workers, on_result, time_ms, depth)
+
+def _positions(fens: List[str], idx: Sequence[int], history: History) -> List[Position]:
+    """fens[idx], as Boards carrying the game's moves when a history is given."""
+    if history is None:
+        return [fens[i] for i in idx]
+    root, moves, plies = history
+    board = chess.Board(root)
+    wanted = sorted(range(len(idx)), key=lambda k: plies[idx[k]])
+    out: List[Position] = [None] * len(idx)
+    for k in wanted:
+        while len(board.move_stack) < plies[idx[k]] + 1:
+            board.push_uci(moves[len(board.move_stack)])
+        out[k] = board.copy()
+    return out
+
+async def _search(items: List[Position], multipv: int, workers: int, on_result: OnResult,
+                  time_ms: Optional[int], order: str, depth: Optional[int] = None) -> List[Dict[str, Any]]:
+    if order == "backward":
+        # Last position first, all on one engine, so later searches seed the hash for earlier ones.
+        rev = list(range(len(items) - 1, -1, -1))
+        res = await _analyse_uncached([items[i] for i in rev], multipv, 1, _remap(on_result, rev), time_ms, depth)
+        return res[::-1]
+    return await _analyse_uncached(items, multipv, workers, on_result, time_ms, depth)
+
+async def analyse_batch_stockfishlike(fens: List[str], multipv: int = 1,
+                                      workers: int = REVIEW_WORKERS, use_cache: bool = True,
+                                      on_result: OnResult = None, time_ms: Optional[int] = None,
+                                      order: str = REVIEW_ORDER, history: History = None,
+                                      depth: Optional[int] = None, _probe: bool = True) -> List[Dict[str, Any]]:
+    """Analyse fens and return one result per fen, in order.
+
+    With workers > 1 the list is split across several engines that search concurrently.
+    Positions already in the eval cache at >= this time budget are not searched again.
+    on_result(i, result) is called as soon as each position is done (not necessarily in order).
+    time_ms overrides REVIEW_MS_PER_POS for this call; depth searches to a fixed depth instead.
+    order="backward" searches the last position first on a single engine. With history, positions
+    are sent as the game's move list (position startpos moves ...) instead of bare FENs, and the
+    results, which may depend on that history, are not written to the eval cache.
+    Positions covered by the Syzygy tables (SYZYGY_PATH) are answered exactly and never searched.
+    """
     try:
         multipv = max(1, min(int(multipv), 50))
     except Exception:
         multipv = 1
+    if not fens:
+        return []
+    workers = max(1, int(workers or 1))
+
+    if _probe and tablebase.enabled:
+        with stage("tablebase_probe"):
+            exact = await asyncio.to_thread(lambda: [tablebase.probe(f) for f in fens])   # file I/O; keep it off the loop
+        rest = [i for i, r in enumerate(exact) if r is None]
+        if len(rest) < len(fens):
+            metrics.inc("deepply_positions_total", len(fens) - len(rest), source="tablebase")
+            if on_result is not None:
+                for i, r in enumerate(exact):
+                    if r is not None:
+                        on_result(i, r)
+            if history is not None:
+                history = (history[0], history[1], [history[2][i] for i in rest])
+            searched = await analyse_batch_stockfishlike(
+                [fens[i] for i in rest], multipv, workers, use_cache, _remap(on_result, rest),
+                time_ms, order, history, depth, _probe=False) if rest else []
+            for i, r in zip(rest, searched):
+                exact[i] = r
+            return exact
+    if not use_cache:
+        metrics.inc("deepply_positions_total", len(fens), source="engine")
+        with stage("search"):
+            return await _search(_positions(fens, range(len(fens)), history), multipv, workers,
+                                 on_result, time_ms, order, depth)
+
+    if depth is None:
+        time_ms = int(time_ms if time_ms is not None else PER_POS_MS)
+    with stage("cache_lookup"):
+        out = await asyncio.to_thread(eval_cache.get_many, fens, depth, time_ms if depth is None else None, multipv)
+    todo = [i for i, r in enumerate(out) if r is None]
+    metrics.inc("deepply_positions_total", len(fens) - len(todo), source="cache")
+    metrics.inc("deepply_positions_total", len(todo), source="engine")
+    if on_result is not None:
+        for i, r in enumerate(out):
+            if r is not None:
+                on_result(i, r)
+    if todo:
+        with stage("search"):
+            fresh = await _search(_positions(fens, todo, history), multipv, workers,
+                                  _remap(on_result, todo), time_ms, order, depth)
+        for i, r in zip(todo, fresh):
+            out[i] = r
+        if history is None:                                # a search with history can see repetitions the FEN key can't
+            with stage("cache_store"):
+                await asyncio.to_thread(eval_cache.put_many, [fens[i] for i in todo], fresh,
+                                        time_ms if depth is None else None, multipv, depth)
+    return out
 
-    ctx = chess.engine.popen_uci(ENGINE_PATH)
-    if inspect.iscoroutine(ctx):                           # old API: await -> (transport, engine)
-        transport, eng = await ctx
+def search_stats(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Depth / nodes reached per position (from the first PV line), plus averages."""
+    per = []
+    for r in results:
+        top = (r.get("top_moves") or [{}])[0]
+        per.append({"depth": top.get("Depth", 0), "seldepth": top.get("Seldepth", 0),
+                    "nodes": top.get("Nodes", 0), "nps": top.get("Nps", 0)})
+    n = max(1, len(per))
+    return {
+        "positions": per,
+        "mean_depth": sum(p["depth"] for p in per) / n,
+        "mean_nodes": sum(p["nodes"] for p in per) / n,
+    }
+
+async def compare_orderings(fens: List[str], history: History = None, time_ms: Optional[int] = None,
+                            multipv: int = 1) -> Dict[str, Any]:
+    """Search the same positions forward and backward, each on a fresh engine, and report both."""
+    if not ENGINE_PATH or not os.path.exists(ENGINE_PATH):
+        raise FileNotFoundError(f"Stockfish not found at STOCKFISH_PATH='{ENGINE_PATH}'")
+    items = _positions(fens, range(len(fens)), history)
+    report: Dict[str, Any] = {}
+    for order in ("forward", "backward"):
+        transport, eng = await spawn_engine(SF_THREADS, SF_HASH_MB)
         try:
-            return await _analyse_with_engine(eng, fens, multipv)
+            seq = items if order == "forward" else items[::-1]
+            res = await _analyse_with_engine(eng, seq, multipv, time_ms=time_ms)
         finally:
-            try:
-                await eng.quit()
-            finally:
-                transport.close()
-    else:                                                  # new API: async context manager
-        async with ctx as eng:
-            return await _analyse_with_engine(eng, fens, multipv)
+            await close_engine(transport, eng)
+        report[order] = search_stats(res if order == "forward" else res[::-1])
+    report["mean_depth_gain"] = report["backward"]["mean_depth"] - report["forward"]["mean_depth"]
+    return report
+
+if __name__ == "__main__":
+    # python -m utils.batchsf game.pgn [ms_per_pos]: depth reached forward vs backward.
+    import sys, json
+    import chess.pgn
+    with open(sys.argv[1]) as f:
+        game = chess.pgn.read_game(f)
+    board, fens = game.board(), []
+    root, moves = board.fen(), [m.uci() for m in game.mainline_moves()]
+    for m in game.mainline_moves():
+        board.push(m)
+        if not board.is_game_over():
+            fens.append(board.fen())
+    ms = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].isdigit() else None
+    rep = asyncio.run(compare_orderings(fens, (root, moves, list(range(len(fens)))), ms))
+    if "-v" not in sys.argv:
+        for o in ("forward", "backward"):
+            del rep[o]["positions"]
+    print(json.dumps(rep, indent=2))
@@ -0,0 +1,72 @@
+# utils/budget.py
+from __future__ import annotations
+import os
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+import chess
+
+from utils.classify import EvalSeries
+
+PER_POS_MS     = int(os.getenv("REVIEW_MS_PER_POS", 100))
+REVIEW_MODE    = os.getenv("REVIEW_MODE", "fixed")                      # "fixed" (first 40 plies) | "budget" (whole game)
+BUDGET_MS      = int(os.getenv("REVIEW_BUDGET_MS", 40 * PER_POS_MS))    # whole game, both passes
+FIRST_PASS_MS  = int(os.getenv("REVIEW_FIRST_PASS_MS", "20"))
+MIN_DEEP_MS    = int(os.getenv("REVIEW_MIN_DEEP_MS", PER_POS_MS))
+MAX_DEEP_MS    = int(os.getenv("REVIEW_MAX_DEEP_MS", "1000"))
+SWING_CP       = float(os.getenv("REVIEW_SWING_CP", "50"))
+
+def first_pass_ms(n_positions: int, budget_ms: int = BUDGET_MS) -> int:
+    """Cheap time per position for the first pass; shrinks so the pass never eats more than half the budget."""
+    if n_positions == 0:
+        return FIRST_PASS_MS
+    return max(1, min(FIRST_PASS_MS, budget_ms // (2 * n_positions)))
+
+def _sharp(fen: str, best: Optional[str]) -> bool:
+    board = chess.Board(fen)
+    if board.is_check():
+        return True
+    if best is None:
+        return False
+    move = chess.Move.from_uci(best)
+    return board.is_capture(move) or board.gives_check(move)
+
+def plan_refinement(series: EvalSeries, played: Sequence[Optional[str]], fens: Sequence[str],
+                    remaining_ms: int, exact: Optional[Sequence[bool]] = None) -> Tuple[List[int], int]:
+    """Pick the positions worth a deeper look and the time each gets.
+
+    Priority: big eval swings first, then positions where the played move wasn't the
+    engine's choice, then tactically sharp ones. Positions flagged in `exact` (tablebase
+    answers) are never picked. Returns (sorted indices, ms per position).
+    """
+    n = len(series)
+    if n == 0 or remaining_ms < MIN_DEEP_MS:
+        return [], 0
+    s = series.score
+    priority = np.zeros(n)
+
+    # The move into position i is judged from position i-1, so both ends get refined.
+    swing = np.zeros(n)
+    with np.errstate(invalid="ignore"):
+        swing[1:] = np.nan_to_num(np.abs(s[:-1] + s[1:]))
+    big = swing >= SWING_CP
+    priority[big] += 1000 + np.minimum(swing[big], 5000)
+    priority[:-1][big[1:]] = np.maximum(priority[:-1][big[1:]], priority[1:][big[1:]])
+
+    deviated = np.zeros(n, dtype=bool)
+    deviated[:-1] = [b is not None and p is not None and b != p for b, p in zip(series.best[:-1], played[1:])]
+    priority[deviated] += 500
+
+    for i in range(n):
+        if priority[i] == 0 and (exact is None or not exact[i]) and _sharp(fens[i], series.best[i]):
+            priority[i] = 100
+    priority[np.isnan(s)] += 2000                          # first pass timed out: always retry
+    if exact is not None:
+        priority[np.asarray(exact, dtype=bool)] = 0
+
+    candidates = np.flatnonzero(priority > 0)
+    if candidates.size == 0:
+        return [], 0
+    k = int(min(candidates.size, remaining_ms // MIN_DEEP_MS))
+    chosen = candidates[np.argsort(-priority[candidates], kind="stable")[:k]]
+    ms = int(min(MAX_DEEP_MS, remaining_ms // k))
+    return sorted(chosen.tolist()), ms
@@ -0,0 +1,178 @@
+# utils/calibrate.py
+"""Benchmark engine settings on this machine and write an engine profile the service loads at startup.
+
+    python -m utils.calibrate                                 # default sweep, writes engine_profile.env
+    python -m utils.calibrate --engines 1,2 --threads 1,2,4 --hash 64,256 --time-ms 50,100,200
+    python -m utils.calibrate --json calibration.json --out /etc/deepply/engine_profile.env
+
+Each configuration (engines x threads x hash x time per position) runs the fixed position suite
+below on fresh engines, split across the engines like a pooled review. It's scored on throughput
+(positions/s over all engines) and on quality: the depth reached, and how often the best move
+(and how closely the eval) matches a long reference search. The recommendation is the fastest
+configuration whose best-move agreement reaches --min-agreement.
+"""
+from __future__ import annotations
+import os, time, asyncio, argparse, datetime, json
+from typing import Any, Dict, List, Optional
+import chess
+from dotenv import load_dotenv
+
+load_dotenv()
+load_dotenv(os.getenv("ENGINE_PROFILE", "engine_profile.env"))     # so "current" below is what the service runs with
+
+from utils.enginepool import ENGINE_PATH, SF_THREADS, SF_HASH_MB, spawn_engine, close_engine
+from utils.batchsf import _analyse_with_engine, _chunks
+
+PROFILE_PATH = os.getenv("ENGINE_PROFILE", "engine_profile.env")
+MULTIPV      = int(os.getenv("REVIEW_MULTIPV", "1"))
+CP_CLIP      = 1000                                # mates and won positions count as +/-10 pawns
+
+OPERA_MOVES = "e4 e5 Nf3 d6 d4 Bg4 dxe5 Bxf3 Qxf3 dxe5 Bc4 Nf6 Qb3 Qe7 Nc3 c6 Bg5 b5 Nxb5 cxb5 Bxb5+ Nbd7 O-O-O Rd8"
+
+def _opera(plies: List[int]) -> List[str]:
+    board, out = chess.Board(), []
+    for ply, san in enumerate(OPERA_MOVES.split(), 1):
+        board.push_san(san)
+        if ply in plies:
+            out.append(board.fen())
+    return out
+
+# Openings, sharp middlegames and endgames; the same suite every run so profiles are comparable.
+SUITE = [
+    "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3",
+    "rnbqkb1r/pp2pppp/3p1n2/8/3NP3/8/PPP2PPP/RNBQKB1R w KQkq - 1 5",
+    "r1bq1rk1/ppp2ppp/2np1n2/2b1p3/2B1P3/2PP1N2/PP3PPP/RNBQ1RK1 w - - 0 7",
+    "r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4",
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+    "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+    "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+    *_opera([12, 18, 21, 24]),
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+    "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1",
+    "1K1k4/1P6/8/8/8/8/r7/2R5 w - - 0 1",
+    "8/8/8/4k3/8/8/4P3/4K3 w - - 0 1",
+]
+
+def _ints(s: str) -> List[int]:
+    return [int(x) for x in s.split(",") if x.strip()]
+
+def _cp(res: Dict[str, Any]) -> Optional[int]:
+    ev = res.get("evaluation") or {}
+    if ev.get("type") == "mate":
+        return CP_CLIP if ev["value"] > 0 else -CP_CLIP
+    if ev.get("value") is None:
+        return None
+    return max(-CP_CLIP, min(CP_CLIP, int(ev["value"])))
+
+def _best(res: Dict[str, Any]) -> Optional[str]:
+    top = res.get("top_moves") or []
+    return top[0].get("Move") if top else None
+
+async def _run(fens: List[str], engines: int, threads: int, hash_mb: int, time_ms: int, multipv: int):
+    """Results in suite order, wall seconds, and the engine's name."""
+    spawned = [await spawn_engine(threads, hash_mb) for _ in range(engines)]
+    try:
+        start = time.perf_counter()
+        parts = await asyncio.gather(*(
+            _analyse_with_engine(eng, fens[c.start:c.stop], multipv, time_ms=time_ms)
+            for (_, eng), c in zip(spawned, _chunks(fens, engines))))
+        wall = time.perf_counter() - start
+        name = spawned[0][1].id.get("name", "")
+    finally:
+        await asyncio.gather(*(close_engine(t, eng) for t, eng in spawned))
+    return [r for part in parts for r in part], wall, name
+
+def score(results: List[Dict[str, Any]], reference: List[Dict[str, Any]], wall: float) -> Dict[str, Any]:
+    depths = [(r.get("top_moves") or [{}])[0].get("Depth", 0) or 0 for r in results]
+    agree = [_best(r) is not None and _best(r) == _best(ref) for r, ref in zip(results, reference)]
+    errs = [abs(a - b) for a, b in ((_cp(r), _cp(ref)) for r, ref in zip(results, reference))
+            if a is not None and b is not None]
+    n = max(1, len(results))
+    return {
+        "positions_per_s": len(results) / wall if wall > 0 else 0.0,
+        "mean_depth": sum(depths) / n,
+        "agreement": sum(agree) / n,
+        "mean_cp_error": sum(errs) / len(errs) if errs else None,
+    }
+
+def recommend(rows: List[Dict[str, Any]], min_agreement: float) -> Dict[str, Any]:
+    good = [r for r in rows if r["agreement"] >= min_agreement]
+    if not good:                                   # nothing is good enough: take the most accurate
+        best = max(r["agreement"] for r in rows)
+        good = [r for r in rows if r["agreement"] == best]
+    return max(good, key=lambda r: (round(r["positions_per_s"], 1), r["agreement"], -r["hash_mb"], -r["threads"]))
+
+def write_profile(path: str, pick: Dict[str, Any], multipv: int, engine: str) -> None:
+    stamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+    lines = [
+        f"# Engine profile written by `python -m utils.calibrate` on {stamp}",
+        f"# {os.cpu_count()} CPUs, {engine or os.path.basename(ENGINE_PATH)}. Loaded at startup by main.py and worker.py;",
+        "# anything set in the environment or .env wins over these.",
+        f"# {pick['positions_per_s']:.1f} positions/s, mean depth {pick['mean_depth']:.1f}, "
+        f"best-move agreement {pick['agreement']:.0%} with the reference search",
+        f"SF_POOL_SIZE={pick['engines']}",
+        f"SF_THREADS={pick['threads']}",
+        f"SF_HASH={pick['hash_mb']}",
+        f"REVIEW_MS_PER_POS={pick['time_ms']}",
+        f"REVIEW_MULTIPV={multipv}",
+    ]
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+async def calibrate(engines: List[int], threads: List[int], hashes: List[int], times: List[int],
+                    ref_ms: int, multipv: int = MULTIPV, oversubscribe: bool = False,
+                    fens: List[str] = SUITE) -> Dict[str, Any]:
+    if not ENGINE_PATH or not os.path.exists(ENGINE_PATH):
+        raise FileNotFoundError(f"Stockfish not found at STOCKFISH_PATH='{ENGINE_PATH}'")
+    cpus = os.cpu_count() or 1
+    ref_threads = max(t for t in threads if t <= cpus) if any(t <= cpus for t in threads) else 1
+    print(f"reference: {len(fens)} positions, {ref_ms} ms each on 1 engine x {ref_threads} threads")
+    reference, _, name = await _run(fens, 1, ref_threads, max(hashes), ref_ms, multipv)
+
+    rows = []
+    for e in engines:
+        for t in threads:
+            if e * t > cpus and not oversubscribe:
+                continue
+            for h in hashes:
+                for ms in times:
+                    results, wall, _ = await _run(fens, e, t, h, ms, multipv)
+                    row = {"engines": e, "threads": t, "hash_mb": h, "time_ms": ms, **score(results, reference, wall)}
+                    rows.append(row)
+                    err = row["mean_cp_error"]
+                    print(f"engines={e} threads={t} hash={h:>4}MB time={ms:>4}ms  {row['positions_per_s']:7.2f} pos/s  "
+                          f"depth {row['mean_depth']:5.1f}  agree {row['agreement']:4.0%}  "
+                          f"cp err {'-' if err is None else f'{err:.0f}'}")
+    if not rows:
+        raise ValueError(f"No configuration fits {cpus} CPUs; lower --engines/--threads or pass --oversubscribe")
+    return {"cpus": cpus, "engine": name, "multipv": multipv, "reference_ms": ref_ms,
+            "reference_threads": ref_threads, "results": rows}
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--engines", default="1,2,4", help="engines running at once (SF_POOL_SIZE)")
+    ap.add_argument("--threads", default="1,2,4", help="threads per engine (SF_THREADS)")
+    ap.add_argument("--hash", default="64,256", help="hash per engine in MB (SF_HASH)")
+    ap.add_argument("--time-ms", default="50,100,200", help="search time per position (REVIEW_MS_PER_POS)")
+    ap.add_argument("--ref-ms", type=int, default=2000, help="time per position of the reference search")
+    ap.add_argument("--multipv", type=int, default=MULTIPV)
+    ap.add_argument("--min-agreement", type=float, default=0.8, help="best-move agreement the pick must reach")
+    ap.add_argument("--oversubscribe", action="store_true", help="also try engines x threads > CPUs")
+    ap.add_argument("--out", default=PROFILE_PATH, help="profile to write (ENGINE_PROFILE)")
+    ap.add_argument("--no-write", action="store_true", help="only print the results")
+    ap.add_argument("--json", help="also write every result to this file")
+    args = ap.parse_args()
+
+    report = asyncio.run(calibrate(_ints(args.engines), _ints(args.threads), _ints(args.hash),
+                                   _ints(args.time_ms), args.ref_ms, args.multipv, args.oversubscribe))
+    pick = recommend(report["results"], args.min_agreement)
+    report["recommended"] = pick
+    print(f"recommended: engines={pick['engines']} threads={pick['threads']} hash={pick['hash_mb']}MB "
+          f"time={pick['time_ms']}ms (current: threads={SF_THREADS} hash={SF_HASH_MB}MB)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if not args.no_write:
+        write_profile(args.out, pick, args.multipv, report["engine"])
+        print(f"wrote {args.out}")
@@ -0,0 +1,92 @@
+# utils/classify.py
+from __future__ import annotations
+import os
+from typing import List, Dict, Any, Optional, Sequence
+import numpy as np
+
+MODE          = os.getenv("REVIEW_CLASSIFY_MODE", "cp")      # "cp" | "winprob"
+MISTAKE_CP    = float(os.getenv("REVIEW_MISTAKE_CP", "50"))   # loss > this is a mistake...
+BLUNDER_CP    = float(os.getenv("REVIEW_BLUNDER_CP", "200"))  # ...and >= this a blunder
+GREAT_CP      = float(os.getenv("REVIEW_GREAT_CP", "150"))    # best move beats the 2nd best by this much
+MISTAKE_WP    = float(os.getenv("REVIEW_MISTAKE_WP", "0.2"))  # same, in winning chances (-1..1)
+BLUNDER_WP    = float(os.getenv("REVIEW_BLUNDER_WP", "0.3"))
+GREAT_WP      = float(os.getenv("REVIEW_GREAT_WP", "0.3"))
+MATE_CP       = 32000                                          # same mate_score batchsf uses
+
+LABELS = (None, "mistake", "blunder", "great")
+NONE, MISTAKE, BLUNDER, GREAT = range(4)
+
+def _score(cp: Optional[int], mate: Optional[int]) -> float:
+    if mate is not None:
+        return float(np.sign(mate) * (MATE_CP - abs(mate))) if mate else -MATE_CP
+    return float(cp) if cp is not None else np.nan
+
+def winning_chances(cp: np.ndarray) -> np.ndarray:
+    """Lichess' logistic model: centipawns -> winning chances in -1..1."""
+    return 2.0 / (1.0 + np.exp(-0.00368208 * np.clip(cp, -4000, 4000))) - 1.0
+
+class EvalSeries:
+    """Per-ply engine output as flat arrays. Index i = position after move i, side-to-move POV."""
+    __slots__ = ("score", "mate", "best", "second")
+
+    def __init__(self, score: np.ndarray, mate: np.ndarray, best: List[Optional[str]], second: np.ndarray):
+        self.score = score          # float64, cp with mates mapped to +-(MATE_CP - n); NaN = no result
+        self.mate = mate            # int16, mate distance or 0
+        self.best = best            # best move (uci) per position
+        self.second = second        # float64, 2nd best line's score; NaN without MultiPV >= 2
+
+    def __len__(self) -> int:
+        return len(self.best)
+
+    @classmethod
+    def from_results(cls, results: Sequence[Dict[str, Any]]) -> "EvalSeries":
+        n = len(results)
+        score = np.full(n, np.nan)
+        mate = np.zeros(n, dtype=np.int16)
+        second = np.full(n, np.nan)
+        best: List[Optional[str]] = [None] * n
+        for i, r in enumerate(results):
+            top = r.get("top_moves") or []
+            if not top:                                    # timed out: leave as unknown
+                continue
+            ev = r["evaluation"]
+            if ev["type"] == "mate":
+                mate[i] = ev["value"]
+                score[i] = _score(None, ev["value"])
+            else:
+                score[i] = ev["value"]
+            best[i] = top[0].get("Move")
+            if len(top) > 1:
+                second[i] = _score(top[1].get("Centipawn"), top[1].get("Mate"))
+        return cls(score, mate, best, second)
+
+def classify(series: EvalSeries, played: Sequence[Optional[str]], mode: str = MODE) -> np.ndarray:
+    """Label code per ply (see LABELS). played[i] is the uci of the move that led to position i."""
+    n = len(series)
+    labels = np.zeros(n, dtype=np.int8)
+    if n < 2:
+        return labels
+    s = series.score
+    if mode == "winprob":
+        s = winning_chances(s)
+        second = winning_chances(series.second)
+        mistake, blunder, great = MISTAKE_WP, BLUNDER_WP, GREAT_WP
+    else:
+        second = series.second
+        mistake, blunder, great = MISTAKE_CP, BLUNDER_CP, GREAT_CP
+
+    # Mover's eval before move i is s[i-1]; after it, the opponent is to move, so it's -s[i].
+    loss = np.full(n, np.nan)
+    loss[1:] = s[:-1] + s[1:]
+    with np.errstate(invalid="ignore"):
+        labels[loss > mistake] = MISTAKE
+        labels[loss >= blunder] = BLUNDER
+        gap = np.full(n, np.nan)
+        gap[1:] = s[:-1] - second[:-1]
+        best_played = np.zeros(n, dtype=bool)
+        best_played[1:] = [b is not None and b == p for b, p in zip(series.best[:-1], played[1:])]
+        labels[best_played & (gap >= great) & (labels == NONE)] = GREAT
+    return labels
+
+def label(code: int) -> Optional[str]:
+    return LABELS[int(code)]
@@ -0,0 +1,38 @@
+# utils/encoding.py
+from __future__ import annotations
+import os, gzip
+from typing import Any, Optional
+import msgpack
+import orjson
+from fastapi import Request, Response
+
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", "1024"))     # smaller bodies aren't worth compressing
+GZIP_LEVEL     = int(os.getenv("GZIP_LEVEL", "5"))
+MSGPACK_TYPES  = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+def _default(obj: Any) -> Any:
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    raise TypeError(f"Cannot encode {type(obj).__name__}")
+
+def _wants_msgpack(accept: str) -> Optional[str]:
+    for part in accept.split(","):
+        media = part.split(";")[0].strip().lower()
+        if media in MSGPACK_TYPES:
+            return media
+    return None
+
+def encode(request: Request, payload: Any, status_code: int = 200, headers: Optional[dict] = None) -> Response:
+    """Serialise payload for the client: MessagePack if its Accept header asks for it, else JSON
+    (orjson), gzipped when it accepts gzip and the body is big enough."""
+    media = _wants_msgpack(request.headers.get("accept", ""))
+    if media:
+        body = msgpack.packb(payload, default=_default, strict_types=False)
+    else:
+        media = "application/json"
+        body = orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    headers = {**(headers or {}), "Vary": "Accept, Accept-Encoding"}
+    if len(body) >= GZIP_MIN_BYTES and "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, status_code=status_code, media_type=media, headers=headers)
@@ -0,0 +1,229 @@
+# utils/enginepool.py
+from __future__ import annotations
+import os, time, asyncio, inspect, contextlib
+from typing import List, Optional, Any
+import chess.engine
+from fastapi import HTTPException
+
+from utils.metrics import metrics
+from utils.scheduler import scheduler, current
+
+ENGINE_PATH     = os.getenv("STOCKFISH_PATH", "/usr/games/stockfish")
+SF_THREADS      = int(os.getenv("SF_THREADS", "4"))
+SF_HASH_MB      = int(os.getenv("SF_HASH", "256"))
+POOL_SIZE       = int(os.getenv("SF_POOL_SIZE", max(1, (os.cpu_count() or 1) // max(1, SF_THREADS))))
+HEALTH_INTERVAL = float(os.getenv("SF_HEALTH_INTERVAL", "30"))
+PING_TIMEOUT    = float(os.getenv("SF_PING_TIMEOUT", "2"))
+DRAIN_TIMEOUT   = float(os.getenv("SF_DRAIN_TIMEOUT", "30"))
+
+# Failures that leave the engine itself in doubt; anything else (a 4xx, a client disconnect) doesn't.
+ENGINE_FAILURES = (chess.engine.EngineError, chess.engine.EngineTerminatedError, asyncio.TimeoutError)
+
+async def spawn_engine(threads: int = SF_THREADS, hash_mb: int = SF_HASH_MB):
+    """Start and configure one UCI engine. Returns (transport, engine); transport may be None."""
+    ctx = chess.engine.popen_uci(ENGINE_PATH)
+    if inspect.iscoroutine(ctx):                           # old API: await -> (transport, engine)
+        transport, eng = await ctx
+    else:                                                  # new API: async context manager
+        transport, eng = ctx, await ctx.__aenter__()
+    await eng.configure({"Threads": threads, "Hash": hash_mb})
+    return transport, eng
+
+async def close_engine(transport: Any, eng: chess.engine.Protocol) -> None:
+    try:
+        await asyncio.wait_for(eng.quit(), timeout=PING_TIMEOUT)
+    except Exception:
+        pass
+    finally:
+        if hasattr(transport, "close"):
+            transport.close()
+        elif hasattr(transport, "__aexit__"):
+            with contextlib.suppress(Exception):
+                await transport.__aexit__(None, None, None)
+
+class _Slot:
+    def __init__(self, index: int):
+        self.index = index
+        self.transport: Any = None
+        self.engine: Optional[chess.engine.Protocol] = None
+
+    def alive(self) -> bool:
+        if self.engine is None:
+            return False
+        rc = getattr(self.engine, "returncode", None)
+        return not (rc is not None and rc.done())
+
+class Lease:
+    """A checked-out engine. Call restart() after a timeout or crash to get a fresh process."""
+    def __init__(self, pool: "EnginePool", slot: _Slot, cls: str = "review", user_id: Any = None):
+        self._pool = pool
+        self._slot = slot
+        self.cls = cls
+        self.user_id = user_id
+        self.since = time.monotonic()
+
+    @property
+    def engine(self) -> chess.engine.Protocol:
+        return self._slot.engine
+
+    async def restart(self) -> chess.engine.Protocol:
+        await self._pool._restart(self._slot)
+        return self._slot.engine
+
+class EnginePool:
+    """Fixed set of long-lived engines, started once and shared between requests.
+    When they're all busy, utils.scheduler decides which waiting checkout gets the next one."""
+
+    def __init__(self, size: int = POOL_SIZE, threads: int = SF_THREADS, hash_mb: int = SF_HASH_MB):
+        self.size = max(1, size)
+        self.threads = threads
+        self.hash_mb = hash_mb
+        self.restarts = 0
+        self._slots: List[_Slot] = []
+        self._idle: Optional[asyncio.Queue] = None
+        self._health_task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    @property
+    def started(self) -> bool:
+        return self._idle is not None and not self._closing
+
+    @property
+    def idle(self) -> int:
+        return self._idle.qsize() if self._idle is not None else 0
+
+    async def start(self) -> None:
+        if self._idle is not None:
+            return
+        if not ENGINE_PATH or not os.path.exists(ENGINE_PATH):
+            raise FileNotFoundError(f"Stockfish not found at STOCKFISH_PATH='{ENGINE_PATH}'")
+        self._closing = False
+        self._idle = asyncio.Queue()
+        self._slots = [_Slot(i) for i in range(self.size)]
+        await asyncio.gather(*(self._restart(s) for s in self._slots))
+        for s in self._slots:
+            self._idle.put_nowait(s)
+        if HEALTH_INTERVAL > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def _restart(self, slot: _Slot) -> None:
+        if slot.engine is not None:
+            await close_engine(slot.transport, slot.engine)
+            self.restarts += 1
+        slot.transport, slot.engine = None, None
+        slot.transport, slot.engine = await spawn_engine(self.threads, self.hash_mb)
+
+    async def _ensure_healthy(self, slot: _Slot) -> None:
+        ok = slot.alive()
+        if ok:
+            try:
+                await asyncio.wait_for(slot.engine.ping(), timeout=PING_TIMEOUT)
+            except Exception:
+                ok = False
+        if not ok:
+            await self._restart(slot)
+
+    def _release(self, slot: _Slot) -> None:
+        """Hand a free engine to the next waiter in scheduler order, or park it."""
+        fut = scheduler.next()
+        if fut is not None:
+            fut.set_result(slot)
+        else:
+            self._idle.put_nowait(slot)
+
+    async def checkout(self) -> Lease:
+        """An engine for the current task's priority class and user (see utils.scheduler.priority)."""
+        if not self.started:
+            raise RuntimeError("Engine pool is not running")
+        cls, user_id = current()
+        start = time.monotonic()
+        if not self._idle.empty():                          # an idle engine means nobody is waiting
+            slot = self._idle.get_nowait()
+        else:
+            fut = scheduler.enqueue(cls, user_id)
+            try:
+                slot = await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():      # granted just as we were cancelled
+                    self._release(fut.result())
+                else:
+                    scheduler.discard(cls, user_id, fut)
+                raise
+        metrics.observe("deepply_engine_queue_wait_seconds", time.monotonic() - start, **{"class": cls})
+        if not slot.alive():
+            try:
+                await self._restart(slot)
+            except Exception:
+                self._release(slot)
+                raise
+        return Lease(self, slot, cls, user_id)
+
+    async def try_checkout(self) -> Optional[Lease]:
+        """Like checkout() but returns None instead of waiting when no engine is idle."""
+        if not self.started or self._idle.empty():
+            return None
+        return await self.checkout()
+
+    async def checkin(self, lease: Lease, broken: bool = False) -> None:
+        slot = lease._slot
+        scheduler.charge(lease.cls, lease.user_id, time.monotonic() - lease.since)
+        if self._idle is None:                             # pool already drained; don't leak it
+            if slot.engine is not None:
+                await close_engine(slot.transport, slot.engine)
+            return
+        if broken or not slot.alive():
+            try:
+                await self._restart(slot)
+            except Exception:
+                slot.transport, slot.engine = None, None
+        self._release(slot)
+
+    @contextlib.asynccontextmanager
+    async def lease(self):
+        lease = await self.checkout()
+        broken = False
+        try:
+            yield lease
+        except ENGINE_FAILURES:
+            broken = True
+            raise
+        finally:
+            await self.checkin(lease, broken=broken)
+
+    async def _health_loop(self) -> None:
+        while not self._closing:
+            await asyncio.sleep(HEALTH_INTERVAL)
+            # Only engines that are idle right now; busy ones are checked on checkin.
+            for _ in range(self._idle.qsize()):
+                try:
+                    slot = self._idle.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                try:
+                    await self._ensure_healthy(slot)
+                except Exception:
+                    slot.transport, slot.engine = None, None
+                finally:
+                    self._release(slot)
+
+    async def close(self, timeout: float = DRAIN_TIMEOUT) -> None:
+        """Stop handing out engines, wait for leases to come back, then quit every engine."""
+        if self._idle is None:
+            return
+        self._closing = True
+        if self._health_task is not None:
+            self._health_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._health_task
+            self._health_task = None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._idle.qsize() < len(self._slots) and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        # Anyone still queued would otherwise wait forever for an engine that isn't coming.
+        scheduler.fail_all(HTTPException(status_code=503, detail="Engine pool is shutting down"))
+        await asyncio.gather(*(close_engine(s.transport, s.engine) for s in self._slots if s.engine is not None))
+        self._slots = []
+        self._idle = None
+
+pool = EnginePool()
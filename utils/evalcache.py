@@ -0,0 +1,182 @@
+# utils/evalcache.py
+from __future__ import annotations
+import os, json, time, threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+import chess
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+
+from database import SessionLocal
+from models import PositionEval
+
+CACHE_SIZE   = int(os.getenv("EVAL_CACHE_SIZE", "50000"))
+CACHE_TTL    = float(os.getenv("EVAL_CACHE_TTL", "86400"))     # seconds, in-process tier
+DB_TTL       = float(os.getenv("EVAL_CACHE_DB_TTL", "0"))      # seconds, 0 = keep forever
+USE_DB       = os.getenv("EVAL_CACHE_DB", "1") != "0"
+
+def position_key(fen: str) -> str:
+    """Normalized FEN: placement, turn, castling and a legal ep square only; move counters dropped."""
+    return chess.Board(fen).epd()
+
+def _satisfies(entry: Dict[str, Any], depth: Optional[int], time_ms: Optional[int], multipv: int) -> bool:
+    if entry["multipv"] < multipv:
+        return False
+    if depth is not None and entry["depth"] >= depth:
+        return True
+    if time_ms is not None and entry["time_ms"] >= time_ms:
+        return True
+    return False
+
+def _trim(result: Dict[str, Any], multipv: int) -> Dict[str, Any]:
+    return {**result, "top_moves": result.get("top_moves", [])[:multipv]}
+
+class EvalCache:
+    """In-process LRU (size + TTL) in front of the position_evals table.
+
+    Results are stored in the batchsf shape: {"evaluation": {...}, "top_moves": [...]},
+    side-to-move POV. A stored entry answers any request at the same or lower depth or time.
+    """
+
+    def __init__(self, size: int = CACHE_SIZE, ttl: float = CACHE_TTL, use_db: bool = USE_DB):
+        self.size = size
+        self.ttl = ttl
+        self.use_db = use_db
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self._lru: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.db_hits + self.misses
+        return {
+            "size": len(self._lru),
+            "hits": self.hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.db_hits) / total if total else 0.0,
+        }
+
+    def _mem_get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is None:
+                return None
+            if self.ttl and time.monotonic() - entry["stored"] > self.ttl:
+                del self._lru[key]
+                return None
+            self._lru.move_to_end(key)
+            return entry
+
+    def _mem_put(self, key: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            old = self._lru.get(key)
+            if old is not None and old["depth"] > entry["depth"] and old["multipv"] >= entry["multipv"]:
+                self._lru.move_to_end(key)
+                return
+            self._lru[key] = entry
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.size:
+                self._lru.popitem(last=False)
+
+    def _db_get_many(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            rows = db.query(PositionEval).filter(PositionEval.key.in_(keys)).all()
+        finally:
+            db.close()
+        out = {}
+        now = time.time()
+        for r in rows:
+            if DB_TTL and r.updated_at is not None and now - r.updated_at.timestamp() > DB_TTL:
+                continue
+            out[r.key] = {"depth": r.depth, "time_ms": r.time_ms, "multipv": r.multipv,
+                          "result": json.loads(r.result), "stored": time.monotonic()}
+        return out
+
+    def _db_put_many(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        db = SessionLocal()
+        try:
+            existing = {k for (k,) in db.query(PositionEval.key).filter(PositionEval.key.in_(list(entries)))}
+            for key, e in entries.items():
+                values = {"depth": e["depth"], "time_ms": e["time_ms"], "multipv": e["multipv"],
+                          "result": json.dumps(e["result"])}
+                # Only replace a row with a search at least as deep, or with more lines; checked in the UPDATE
+                # itself so a concurrent writer's deeper result isn't overwritten.
+                deeper = (update(PositionEval)
+                          .where(PositionEval.key == key,
+                                 or_(PositionEval.depth <= e["depth"], PositionEval.multipv < e["multipv"]))
+                          .values(**values))
+                if key in existing:
+                    db.execute(deeper)
+                    continue
+                try:
+                    with db.begin_nested():
+                        db.add(PositionEval(key=key, **values))
+                except IntegrityError:
+                    db.execute(deeper)                     # another request stored it first
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Eval cache write failed: {e}")
+        finally:
+            db.close()
+
+    def get_many(self, fens: List[str], depth: Optional[int] = None, time_ms: Optional[int] = None,
+                 multipv: int = 1) -> List[Optional[Dict[str, Any]]]:
+        """One cached result (or None) per fen."""
+        keys = [position_key(f) for f in fens]
+        out: List[Optional[Dict[str, Any]]] = [None] * len(fens)
+        missing: Dict[str, List[int]] = {}
+        for i, key in enumerate(keys):
+            entry = self._mem_get(key)
+            if entry is not None and _satisfies(entry, depth, time_ms, multipv):
+                self.hits += 1
+                out[i] = _trim(entry["result"], multipv)
+            else:
+                missing.setdefault(key, []).append(i)
+        if missing and self.use_db:
+            try:
+                found = self._db_get_many(list(missing))
+            except Exception as e:
+                print(f"Eval cache read failed: {e}")
+                found = {}
+            for key, entry in found.items():
+                self._mem_put(key, entry)
+                if _satisfies(entry, depth, time_ms, multipv):
+                    for i in missing.pop(key):
+                        self.db_hits += 1
+                        out[i] = _trim(entry["result"], multipv)
+        self.misses += sum(len(v) for v in missing.values())
+        return out
+
+    def get(self, fen: str, depth: Optional[int] = None, time_ms: Optional[int] = None,
+            multipv: int = 1) -> Optional[Dict[str, Any]]:
+        return self.get_many([fen], depth, time_ms, multipv)[0]
+
+    def put_many(self, fens: List[str], results: List[Dict[str, Any]], time_ms: Optional[int] = None,
+                 multipv: int = 1, depth: Optional[int] = None) -> None:
+        entries: Dict[str, Dict[str, Any]] = {}
+        for fen, res in zip(fens, results):
+            top = res.get("top_moves") or []
+            if not top:                                    # timed out / no info: don't cache
+                continue
+            entry = {"depth": int(depth if depth is not None else top[0].get("Depth") or 0),
+                     "time_ms": int(time_ms if time_ms is not None else top[0].get("Time") or 0),
+                     "multipv": multipv, "result": res, "stored": time.monotonic()}
+            key = position_key(fen)
+            self._mem_put(key, entry)
+            entries[key] = entry
+        if entries and self.use_db:
+            self._db_put_many(entries)
+
+    def put(self, fen: str, result: Dict[str, Any], time_ms: Optional[int] = None, multipv: int = 1,
+            depth: Optional[int] = None) -> None:
+        self.put_many([fen], [result], time_ms, multipv, depth)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._lru.clear()
+
+eval_cache = EvalCache()
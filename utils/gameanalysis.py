@@ -0,0 +1,137 @@
+# utils/gameanalysis.py
+from __future__ import annotations
+import os, json, hashlib
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+import chess
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import GameAnalysis
+from utils import budget, classify as cls
+from utils.batchsf import PER_POS_MS
+from utils.enginepool import ENGINE_PATH, SF_THREADS, SF_HASH_MB
+from utils.openings import BOOK_MS
+from utils.pgnvalidate import MPV
+from utils.tablebase import tablebase
+
+NO_EVAL  = -2**31          # score: position timed out
+IS_MATE  = -2**31 + 1      # score: see the mate array
+NO_MOVE  = 0xFFFF
+BOOK     = len(cls.LABELS) # label code for book plies, after classify's own codes
+
+def analysis_settings() -> Dict[str, Any]:
+    """Everything that changes what a review returns. A different hash means stored reviews are stale."""
+    return {
+        "format": 1,
+        "engine": os.path.basename(ENGINE_PATH or ""),
+        "threads": SF_THREADS, "hash_mb": SF_HASH_MB, "multipv": MPV,
+        "mode": budget.REVIEW_MODE, "per_pos_ms": int(PER_POS_MS), "budget_ms": budget.BUDGET_MS,
+        "first_pass_ms": budget.FIRST_PASS_MS, "deep_ms": [budget.MIN_DEEP_MS, budget.MAX_DEEP_MS],
+        "swing_cp": budget.SWING_CP, "book_ms": BOOK_MS, "tablebase": tablebase.enabled,
+        "classify": [cls.MODE, cls.MISTAKE_CP, cls.BLUNDER_CP, cls.GREAT_CP,
+                     cls.MISTAKE_WP, cls.BLUNDER_WP, cls.GREAT_WP],
+    }
+
+ANALYSIS_VERSION = hashlib.sha1(json.dumps(analysis_settings(), sort_keys=True).encode()).hexdigest()[:16]
+
+def _pack_move(uci: Optional[str]) -> int:
+    if not uci:
+        return NO_MOVE
+    m = chess.Move.from_uci(uci)
+    return m.from_square | m.to_square << 6 | (m.promotion or 0) << 12
+
+def _unpack_move(code: int) -> Optional[str]:
+    if code == NO_MOVE:
+        return None
+    return chess.Move(code & 63, code >> 6 & 63, (code >> 12) or None).uci()
+
+def pack_analysis(result: Dict[str, Any]) -> Dict[str, Any]:
+    """GameAnalysis column values from a game_analysis() result."""
+    evals = result["evaluations"]
+    n = len(evals)
+    score = np.full(n, NO_EVAL, dtype="<i4")
+    mate = np.zeros(n, dtype="<i2")
+    best = np.full(n, NO_MOVE, dtype="<u2")
+    labels = np.zeros(n, dtype="i1")
+    for i, e in enumerate(evals):
+        if e["top_moves"]:
+            if e["evaluation"]["type"] == "mate":
+                score[i], mate[i] = IS_MATE, e["evaluation"]["value"]
+            else:
+                score[i] = e["evaluation"]["value"]
+            best[i] = _pack_move(e["top_moves"][0].get("Move"))
+        kind = e.get("classification")
+        labels[i] = BOOK if kind == "book" else cls.LABELS.index(kind)
+    opening = result.get("opening") or {}
+    return {
+        "version": ANALYSIS_VERSION, "plies": n, "book_plies": int((labels == BOOK).sum()),
+        "score": score.tobytes(), "mate": mate.tobytes(), "best": best.tobytes(), "labels": labels.tobytes(),
+        "opening_eco": opening.get("eco"), "opening_name": opening.get("name"),
+    }
+
+def compact_analysis(result: Dict[str, Any]) -> Dict[str, Any]:
+    """A game_analysis() result as parallel per-ply arrays, in the same shape as unpack_analysis().
+
+    One pass over the plies; the eval objects aren't copied. Errors pass through unchanged.
+    """
+    if "evaluations" not in result:
+        return result
+    evals = result["evaluations"]
+    moves, cp, mate, best, labels = [], [], [], [], []
+    for e in evals:
+        ev, top = e["evaluation"], e["top_moves"]
+        moves.append(e["move_made"])
+        cp.append(ev["value"] if top and ev["type"] == "cp" else None)
+        mate.append(ev["value"] if top and ev["type"] == "mate" else None)
+        best.append(top[0].get("Move") if top else None)
+        labels.append(e.get("classification"))
+    return {
+        "plies": len(evals),
+        "book_plies": labels.count("book"),
+        "opening": result.get("opening"),
+        "moves": moves,
+        "cp": cp,
+        "mate": mate,
+        "best": best,
+        "classification": labels,
+    }
+
+def arrays(row: GameAnalysis) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """(score, mate, best, labels) views over a stored row's columns."""
+    return (np.frombuffer(row.score, dtype="<i4"), np.frombuffer(row.mate, dtype="<i2"),
+            np.frombuffer(row.best, dtype="<u2"), np.frombuffer(row.labels, dtype="i1"))
+
+def unpack_analysis(row: GameAnalysis) -> Dict[str, Any]:
+    """Parallel per-ply arrays: cp is None for mates and timeouts, mate is None unless it's a mate."""
+    score, mate, best, labels = arrays(row)
+    names: List[Optional[str]] = list(cls.LABELS) + ["book"]
+    return {
+        "version": row.version,
+        "stale": row.version != ANALYSIS_VERSION,
+        "analysed_at": row.created_at,
+        "plies": row.plies,
+        "book_plies": row.book_plies,
+        "opening": {"eco": row.opening_eco, "name": row.opening_name} if row.opening_name else None,
+        "cp": [None if s in (NO_EVAL, IS_MATE) else int(s) for s in score.tolist()],
+        "mate": [int(m) if s == IS_MATE else None for s, m in zip(score.tolist(), mate.tolist())],
+        "best": [_unpack_move(b) for b in best.tolist()],
+        "classification": [names[k] for k in labels.tolist()],
+    }
+
+async def load_analysis(db: AsyncSession, game_id: int) -> Optional[GameAnalysis]:
+    return (await db.execute(select(GameAnalysis).where(GameAnalysis.game_id == game_id))).scalar_one_or_none()
+
+async def save_analysis(db: AsyncSession, game_id: int, result: Dict[str, Any], commit: bool = True) -> GameAnalysis:
+    """Insert or replace the stored review of a game."""
+    values = pack_analysis(result)
+    row = await load_analysis(db, game_id)
+    if row is None:
+        row = GameAnalysis(game_id=game_id, **values)
+        db.add(row)
+    else:
+        for k, v in values.items():
+            setattr(row, k, v)
+    if commit:
+        await db.commit()
+    return row
@@ -0,0 +1,148 @@
+# utils/jobqueue.py
+from __future__ import annotations
+import os, json, asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import AnalysisJob
+
+EXECUTOR      = os.getenv("REVIEW_EXECUTOR", "inprocess")    # "inprocess" | "queue" (worker.py does the engine work)
+LEASE_S       = float(os.getenv("QUEUE_LEASE_S", "60"))       # a running job whose lease lapses is handed out again
+HEARTBEAT_S   = float(os.getenv("QUEUE_HEARTBEAT_S", "15"))
+POLL_S        = float(os.getenv("QUEUE_POLL_S", "1"))
+MAX_ATTEMPTS  = int(os.getenv("QUEUE_MAX_ATTEMPTS", "3"))
+RETRY_BASE_S  = float(os.getenv("QUEUE_RETRY_BASE_S", "10"))  # backoff: base * 2^(attempt-1)
+RETENTION_S   = float(os.getenv("QUEUE_RETENTION_S", "86400"))
+CLAIM_RETRIES = 5
+
+# Times are UTC from the worker's clock; leases are long enough to absorb normal skew between nodes.
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def _claimable(now: datetime):
+    return or_(
+        and_(AnalysisJob.status == "queued", or_(AnalysisJob.run_after.is_(None), AnalysisJob.run_after <= now)),
+        and_(AnalysisJob.status == "running", AnalysisJob.lease_until < now),      # worker died mid-job
+    )
+
+async def enqueue(db: AsyncSession, game_id: int, user_id: int, kind: str = "review") -> AnalysisJob:
+    """Queue a job unless one for the same game is already waiting or running."""
+    job = (await db.execute(
+        select(AnalysisJob).where(AnalysisJob.game_id == game_id, AnalysisJob.kind == kind,
+                                  AnalysisJob.status.in_(("queued", "running")))
+        .order_by(AnalysisJob.id.desc()).limit(1))).scalar_one_or_none()
+    if job is None:
+        job = AnalysisJob(kind=kind, game_id=game_id, user_id=user_id, max_attempts=MAX_ATTEMPTS)
+        db.add(job)
+        await db.commit()
+    return job
+
+async def get_job(db: AsyncSession, job_id: int) -> Optional[AnalysisJob]:
+    return await db.get(AnalysisJob, job_id, populate_existing=True)
+
+async def claim(db: AsyncSession, worker_id: str, lease_s: float = LEASE_S) -> Optional[AnalysisJob]:
+    """Take the oldest runnable job, or None.
+
+    MySQL/PostgreSQL: SELECT ... FOR UPDATE SKIP LOCKED, so workers never wait on each other.
+    SQLite has no row locks: pick a candidate and take it with a conditional UPDATE, retrying
+    if another worker got there first.
+    """
+    now = _now()
+    lease = {"status": "running", "worker_id": worker_id, "lease_until": now + timedelta(seconds=lease_s),
+             "heartbeat_at": now, "started_at": now, "attempts": AnalysisJob.attempts + 1}
+    if db.bind.dialect.name in ("mysql", "postgresql"):
+        job = (await db.execute(
+            select(AnalysisJob).where(_claimable(now)).order_by(AnalysisJob.id).limit(1)
+            .with_for_update(skip_locked=True))).scalar_one_or_none()
+        if job is None:
+            await db.rollback()
+            return None
+        await db.execute(update(AnalysisJob).where(AnalysisJob.id == job.id).values(**lease))
+        await db.commit()
+        return await get_job(db, job.id)
+
+    for _ in range(CLAIM_RETRIES):
+        job_id = (await db.execute(
+            select(AnalysisJob.id).where(_claimable(now)).order_by(AnalysisJob.id).limit(1))).scalar()
+        if job_id is None:
+            await db.rollback()
+            return None
+        # get_job() re-reads the row, so skip evaluating _claimable against loaded objects: SQLite
+        # hands datetimes back naive and they won't compare with an aware now.
+        res = await db.execute(update(AnalysisJob).where(AnalysisJob.id == job_id, _claimable(now)).values(**lease)
+                               .execution_options(synchronize_session=False))
+        await db.commit()
+        if res.rowcount == 1:
+            return await get_job(db, job_id)
+    return None
+
+def _owned(job_id: int, worker_id: str):
+    return and_(AnalysisJob.id == job_id, AnalysisJob.worker_id == worker_id, AnalysisJob.status == "running")
+
+async def heartbeat(db: AsyncSession, job_id: int, worker_id: str, lease_s: float = LEASE_S) -> bool:
+    """Extend the lease. False means the job was reclaimed and this worker should drop it."""
+    now = _now()
+    res = await db.execute(update(AnalysisJob).where(_owned(job_id, worker_id))
+                           .values(lease_until=now + timedelta(seconds=lease_s), heartbeat_at=now))
+    await db.commit()
+    return res.rowcount == 1
+
+async def complete(db: AsyncSession, job_id: int, worker_id: str, result: Dict[str, Any],
+                   commit: bool = True) -> bool:
+    """Mark the job done if this worker still owns it. commit=False leaves the transaction open so the
+    caller can write the results alongside, or roll back when it returns False."""
+    res = await db.execute(update(AnalysisJob).where(_owned(job_id, worker_id)).values(
+        status="done", result=json.dumps(result), error=None, lease_until=None, finished_at=_now()))
+    if commit:
+        await db.commit()
+    return res.rowcount == 1
+
+async def fail(db: AsyncSession, job: AnalysisJob, worker_id: str, error: str, retry: bool = True) -> bool:
+    """Requeue with exponential backoff, or give up once max_attempts is reached (or retry=False)."""
+    now = _now()
+    if retry and job.attempts < job.max_attempts:
+        values = {"status": "queued", "run_after": now + timedelta(seconds=RETRY_BASE_S * 2 ** (job.attempts - 1))}
+    else:
+        values = {"status": "error", "finished_at": now}
+    res = await db.execute(update(AnalysisJob).where(_owned(job.id, worker_id))
+                           .values(error=error[:2000], lease_until=None, **values))
+    await db.commit()
+    return res.rowcount == 1
+
+async def release(db: AsyncSession, job_id: int, worker_id: str) -> None:
+    """Hand a job back untouched (worker shutting down); the attempt doesn't count."""
+    await db.execute(update(AnalysisJob).where(_owned(job_id, worker_id)).values(
+        status="queued", lease_until=None, worker_id=None, attempts=AnalysisJob.attempts - 1))
+    await db.commit()
+
+async def purge(db: AsyncSession, retention_s: float = RETENTION_S) -> int:
+    cutoff = _now() - timedelta(seconds=retention_s)
+    res = await db.execute(delete(AnalysisJob).where(AnalysisJob.status.in_(("done", "error")),
+                                                     AnalysisJob.finished_at < cutoff))
+    await db.commit()
+    return res.rowcount
+
+def summary(job: AnalysisJob, include_result: bool = True) -> Dict[str, Any]:
+    """Same shape as ReviewJob.summary(); queued jobs have no per-ply progress."""
+    out: Dict[str, Any] = {"job_id": str(job.id), "game_id": job.game_id, "status": job.status,
+                           "attempts": job.attempts}
+    if job.error:
+        out["error"] = job.error
+    if include_result and job.status == "done" and job.result:
+        out["analysis"] = json.loads(job.result)
+    return out
+
+async def wait(db: AsyncSession, job_id: int, timeout: float, poll_s: float = POLL_S) -> Optional[AnalysisJob]:
+    """Poll until the job is done or failed; None on timeout."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        job = await get_job(db, job_id)
+        if job is None or job.status in ("done", "error"):
+            return job
+        if loop.time() >= deadline:
+            return None
+        await db.rollback()                                # end the read transaction between polls
+        await asyncio.sleep(poll_s)
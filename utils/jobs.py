@@ -0,0 +1,108 @@
+# utils/jobs.py
+from __future__ import annotations
+import os, time, uuid, asyncio
+from typing import Dict, Any, List, Optional, Callable, Awaitable, AsyncIterator
+
+JOB_TTL = float(os.getenv("REVIEW_JOB_TTL", "3600"))      # seconds a finished job stays queryable
+
+class ReviewJob:
+    """One background review. Per-ply events are appended as the engine produces them."""
+
+    def __init__(self, user_id: int, game_id: Optional[int] = None, total: int = 0):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.game_id = game_id
+        self.total = total
+        self.status = "queued"                             # queued | running | done | error
+        self.events: List[Dict[str, Any]] = []
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "error")
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def push(self, event: Dict[str, Any]) -> None:
+        self.total = event.get("total", self.total)
+        self.events.append(event)
+        self._notify()
+
+    def finish(self, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+        self.result = result
+        self.error = error
+        self.status = "error" if error else "done"
+        self.finished = time.time()
+        self._notify()
+
+    def summary(self, include_result: bool = True) -> Dict[str, Any]:
+        out = {
+            "job_id": self.id,
+            "game_id": self.game_id,
+            "status": self.status,
+            "progress": {"done": len(self.events), "total": self.total},
+        }
+        if self.error:
+            out["error"] = self.error
+        if include_result and self.result is not None:
+            out["analysis"] = self.result
+        return out
+
+    async def follow(self) -> AsyncIterator[Dict[str, Any]]:
+        """Yield every event (including ones already emitted), then a final status event."""
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self.events):
+                yield {"event": "ply", **self.events[sent]}
+                sent += 1
+            if self.done:
+                yield {"event": self.status, **self.summary(include_result=False)}
+                return
+            await changed.wait()
+
+class JobRegistry:
+    def __init__(self, ttl: float = JOB_TTL):
+        self.ttl = ttl
+        self._jobs: Dict[str, ReviewJob] = {}
+        self._tasks: set = set()
+
+    def _evict(self) -> None:
+        now = time.time()
+        for jid in [j.id for j in self._jobs.values() if j.finished and now - j.finished > self.ttl]:
+            del self._jobs[jid]
+
+    def get(self, job_id: str) -> Optional[ReviewJob]:
+        self._evict()
+        return self._jobs.get(job_id)
+
+    def submit(self, job: ReviewJob, run: Callable[[ReviewJob], Awaitable[Dict[str, Any]]]) -> ReviewJob:
+        """Run `run(job)` in the background; its return value becomes the job result."""
+        self._evict()
+        self._jobs[job.id] = job
+
+        async def _runner():
+            job.status = "running"
+            try:
+                result = await run(job)
+            except Exception as e:
+                print(f"Review job {job.id} failed: {e}")
+                job.finish(error=str(e))
+            else:
+                if isinstance(result, dict) and "error" in result:
+                    job.finish(error=str(result["error"]))
+                else:
+                    job.finish(result=result)
+
+        task = asyncio.create_task(_runner())
+        self._tasks.add(task)                              # keep a reference until it finishes
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+jobs = JobRegistry()
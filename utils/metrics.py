@@ -0,0 +1,149 @@
+# utils/metrics.py
+from __future__ import annotations
+import os, time, threading, contextvars, contextlib
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "0") == "1"   # always send the Server-Timing header
+
+SECONDS_BUCKETS = (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+DEPTH_BUCKETS   = (5, 10, 15, 20, 25, 30, 40, 60)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Per-request stage totals (ms), set by the HTTP middleware in main.py. Concurrent stages add up.
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("request_timings", default=None)
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _fmt(name: str, labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return name
+    body = ",".join('%s="%s"' % (k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return f"{name}{{{body}}}"
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    """Counters and histograms in Prometheus text format, without the client library."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}                       # name -> (type, help)
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._collectors: List[Callable[[], Iterator[Tuple[str, str, str, Dict[str, object], float]]]] = []
+
+    def counter(self, name: str, help: str) -> None:
+        self._help[name] = ("counter", help)
+        self._counters.setdefault(name, {})
+
+    def histogram(self, name: str, help: str, buckets: Tuple[float, ...] = SECONDS_BUCKETS) -> None:
+        self._help[name] = ("histogram", help)
+        self._histograms.setdefault(name, {})
+        self._buckets[name] = buckets
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms[name]
+            h = series.get(key)
+            if h is None:
+                h = series[key] = _Histogram(self._buckets[name])
+            h.observe(value)
+
+    def collector(self, fn: Callable[[], Iterator[Tuple[str, str, str, Dict[str, object], float]]]) -> None:
+        """fn() yields (name, type, help, labels, value) read from elsewhere at scrape time."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name, series in self._counters.items():
+                kind, help = self._help[name]
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                lines += [f"{_fmt(name, k)} {v:g}" for k, v in series.items()]
+            for name, series in self._histograms.items():
+                kind, help = self._help[name]
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                for k, h in series.items():
+                    acc = 0
+                    for b, c in zip(h.buckets, h.counts):
+                        acc += c
+                        lines.append(f"{_fmt(name + '_bucket', k, (('le', f'{b:g}'),))} {acc}")
+                    lines.append(f"{_fmt(name + '_bucket', k, (('le', '+Inf'),))} {h.count}")
+                    lines.append(f"{_fmt(name + '_sum', k)} {h.sum:g}")
+                    lines.append(f"{_fmt(name + '_count', k)} {h.count}")
+        seen = set()
+        for fn in self._collectors:
+            for name, kind, help, labels, value in fn():
+                if name not in seen:
+                    lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                    seen.add(name)
+                lines.append(f"{_fmt(name, _labels(labels))} {float(value):g}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.histogram("deepply_stage_seconds", "Time spent in each review/analysis stage.")
+metrics.histogram("deepply_http_request_seconds", "HTTP request latency by route.")
+metrics.counter("deepply_engine_searches_total", "Positions searched by an engine.")
+metrics.counter("deepply_engine_timeouts_total", "Searches abandoned after the engine stopped answering.")
+metrics.counter("deepply_engine_nodes_total", "Nodes searched, as reported by the engine.")
+metrics.counter("deepply_engine_search_seconds_total", "Search time reported by the engine; nodes_total / this is the mean nps.")
+metrics.histogram("deepply_engine_depth", "Depth reached per search.", DEPTH_BUCKETS)
+metrics.counter("deepply_positions_total", "Positions requested from analyse_batch_stockfishlike, by where the answer came from.")
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Time a block into deepply_stage_seconds{stage=name} and the current request's breakdown."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe("deepply_stage_seconds", elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed * 1000
+
+def record_search(info: Dict[str, object]) -> None:
+    """Engine statistics from one search's first PV line (a batchsf top_moves entry)."""
+    metrics.inc("deepply_engine_searches_total")
+    metrics.inc("deepply_engine_nodes_total", info.get("Nodes", 0) or 0)
+    metrics.inc("deepply_engine_search_seconds_total", (info.get("Time", 0) or 0) / 1000)
+    metrics.observe("deepply_engine_depth", info.get("Depth", 0) or 0)
+
+def start_request() -> contextvars.Token:
+    return _request_timings.set({})
+
+def end_request(token: contextvars.Token) -> Dict[str, float]:
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    return timings
+
+def server_timing(timings: Dict[str, float], total_ms: float) -> str:
+    """Server-Timing header value: one entry per stage plus the total."""
+    parts = [f"{name.replace(' ', '_')};dur={ms:.1f}" for name, ms in timings.items()]
+    parts.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(parts)
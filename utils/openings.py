@@ -0,0 +1,127 @@
+# utils/openings.py
+from __future__ import annotations
+import os, io, csv, glob
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+import chess
+import chess.pgn
+import chess.polyglot
+
+BOOK_PATH = os.getenv("OPENING_BOOK_PATH")       # Polyglot .bin
+ECO_PATH  = os.getenv("ECO_INDEX_PATH")          # lichess chess-openings style .tsv file, or a directory of them
+BOOK_MS   = int(os.getenv("REVIEW_BOOK_MS", "0"))     # 0: book plies take cached evals only; > 0 searches them this long
+
+def _line_from_row(row: Dict[str, str]) -> List[str]:
+    """EPDs of every position along the row's line; the last one is the named position."""
+    if row.get("epd") and not (row.get("uci") or row.get("pgn")):
+        return [row["epd"]]
+    board = chess.Board()
+    if row.get("uci"):
+        moves = [chess.Move.from_uci(u) for u in row["uci"].split()]
+    elif row.get("pgn"):
+        game = chess.pgn.read_game(io.StringIO(row["pgn"]))
+        moves = list(game.mainline_moves()) if game is not None else []
+    else:
+        return []
+    line = []
+    for move in moves:
+        board.push(move)
+        line.append(board.epd())
+    return line
+
+def load_eco_index(path: str) -> Tuple[Dict[str, Tuple[str, str]], Set[str]]:
+    """Read lichess-org/chess-openings style TSVs (eco, name, pgn / uci / epd columns).
+
+    Returns (EPD -> (eco, name) for named positions, EPDs of every position on a named line).
+    """
+    files = sorted(glob.glob(os.path.join(path, "*.tsv"))) if os.path.isdir(path) else [path]
+    names: Dict[str, Tuple[str, str]] = {}
+    theory: Set[str] = set()
+    for fn in files:
+        with open(fn, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f, delimiter="\t"):
+                try:
+                    line = _line_from_row(row)
+                except ValueError:
+                    continue
+                if line:
+                    names[line[-1]] = (row.get("eco", ""), row.get("name", ""))
+                    theory.update(line)
+    return names, theory
+
+class OpeningBook:
+    """Polyglot book (memory-mapped) plus an ECO name index, both optional and loaded on first use."""
+
+    def __init__(self, book_path: Optional[str] = BOOK_PATH, eco_path: Optional[str] = ECO_PATH):
+        self.book_path = book_path
+        self.eco_path = eco_path
+        self._reader = None
+        self._eco: Optional[Dict[str, Tuple[str, str]]] = None
+        self._theory: Set[str] = set()
+        self.hits = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.book_path or self.eco_path)
+
+    def _book(self):
+        if self._reader is None and self.book_path and os.path.exists(self.book_path):
+            self._reader = chess.polyglot.open_reader(self.book_path)      # MemoryMappedReader
+        return self._reader
+
+    def _index(self) -> Dict[str, Tuple[str, str]]:
+        if self._eco is None:
+            if self.eco_path and os.path.exists(self.eco_path):
+                self._eco, self._theory = load_eco_index(self.eco_path)
+            else:
+                self._eco = {}
+        return self._eco
+
+    def _in_book(self, board: chess.Board, move: chess.Move) -> bool:
+        reader = self._book()
+        if reader is not None and any(e.move == move for e in reader.find_all(board)):
+            return True
+        self._index()
+        after = board.copy(stack=False)
+        after.push(move)
+        return after.epd() in self._theory
+
+    def book_plies(self, root_fen: str, moves: Sequence[str]) -> int:
+        """How many leading moves of the game are theory. Stops at the first move out of book."""
+        if not self.enabled or root_fen != chess.STARTING_FEN:
+            return 0
+        board = chess.Board()
+        n = 0
+        for uci in moves:
+            move = chess.Move.from_uci(uci)
+            if not self._in_book(board, move):
+                break
+            board.push(move)
+            n += 1
+        self.hits += n
+        return n
+
+    def opening(self, root_fen: str, moves: Sequence[str]) -> Optional[Dict[str, str]]:
+        """Deepest named opening the game passed through."""
+        index = self._index()
+        if not index or root_fen != chess.STARTING_FEN:
+            return None
+        board = chess.Board()
+        found = None
+        for uci in moves:
+            board.push_uci(uci)
+            hit = index.get(board.epd())
+            if hit is not None:
+                found = hit
+        return {"eco": found[0], "name": found[1]} if found else None
+
+    def load(self) -> None:
+        """Open the book and build the ECO index now rather than on the first review."""
+        self._book()
+        self._index()
+
+    def close(self) -> None:
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+opening_book = OpeningBook()
@@ -1,108 +1,254 @@
-from concurrent.futures import ProcessPoolExecutor
-import copy
 import chess.pgn
 from chess import IllegalMoveError
-import io, os, asyncio
+import io, os, asyncio, hashlib
+from typing import Callable, Optional, List, Union
 
-from utils.batchsf import analyse_batch_stockfishlike
+from utils.batchsf import analyse_batch_stockfishlike, REVIEW_ORDER
+from utils.classify import EvalSeries, classify, label
+from utils.evalcache import eval_cache
+from utils.budget import REVIEW_MODE, BUDGET_MS, first_pass_ms, plan_refinement
+from utils.openings import opening_book, BOOK_MS
+from utils.metrics import stage
 MPV  = int(os.getenv("REVIEW_MULTIPV", "1"))
 
-def validate_pgn(pgn: str) -> tuple[bool, str]:
+class ParsedGame:
+    """A PGN read once and walked once; shared by validation, analysis and persistence."""
+
+    def __init__(self, pgn: str, game: Optional[chess.pgn.Game], error: Optional[str] = None):
+        self.pgn = pgn
+        self.game = game
+        self.error = error
+        self.moves: List[str] = []          # uci, mainline order
+        self.moves_san: List[str] = []
+        self.fens: List[str] = []           # position after each move that doesn't end the game
+        if game is not None and error is None:
+            board = game.board()
+            for move in game.mainline_moves():
+                self.moves.append(move.uci())
+                self.moves_san.append(board.san_and_push(move))
+                if not board.is_game_over():
+                    self.fens.append(board.fen())
+
+    @property
+    def root_fen(self) -> str:
+        return self.game.board().fen()
+
+    def history(self, plies):
+        """batchsf history for positions after the given plies (see analyse_batch_stockfishlike)."""
+        return (self.root_fen, self.moves, list(plies))
+
+    @property
+    def key(self) -> str:
+        """Identifies the game by its moves alone; the same game with other headers or comments matches."""
+        return hashlib.sha1(f"{self.root_fen} {' '.join(self.moves)}".encode()).hexdigest()
+
+    @property
+    def headers(self):
+        return self.game.headers if self.game is not None else {}
+
+def parse_pgn(pgn: str) -> ParsedGame:
+    with stage("parse_pgn"):
+        try:
+            return ParsedGame(pgn, chess.pgn.read_game(io.StringIO(pgn)))
+        except Exception as e:
+            print(f"PGN validation error: {e}")
+            return ParsedGame(pgn, None, str(e))
+
+def validate_pgn(pgn: Union[str, ParsedGame]) -> tuple[bool, str]:
     """
     Validate the provided PGN string.
     
     Args:
-        pgn (str): The PGN string to validate.
+        pgn (str | ParsedGame): The PGN string to validate, or the result of parse_pgn.
 
     Returns:
         tuple[bool, str]: A tuple containing a boolean indicating validity and an error message if invalid.
     """
+    parsed = pgn if isinstance(pgn, ParsedGame) else parse_pgn(pgn)
+    if parsed.error is not None:
+        return False, parsed.error
+    with stage("validate_pgn"):
+        return validate_game(parsed.game)
+
+def validate_game(game: Optional[chess.pgn.Game]) -> tuple[bool, str]:
+    """Same checks as validate_pgn, on a game that has already been read."""
+    if game is None:
+        return False, "Invalid PGN format"
+
+    if game.errors == []:
+        # Check if the game has a valid result
+        if game.headers.get("Result") not in ["1-0", "0-1", "1/2-1/2", "*"]:
+            return False, "Invalid game result"
+        return True, "PGN is valid"
+    else:
+        for error in game.errors:
+            if isinstance(error, IllegalMoveError):
+                return False, "Illegal moves found in PGN"
+            else:
+                return False, str(error)
+
+def time_control_from_headers(headers: chess.pgn.Headers) -> Optional[str]:
+    """Map a TimeControl header ("300+2", "1/259200", "-") to Game.TIME_CONTROLS, Lichess-style."""
+    tc = headers.get("TimeControl", "")
+    if not tc or tc in ("-", "?"):
+        return None
+    if "/" in tc:                                          # correspondence / moves-per-period
+        return "classical"
+    base, _, inc = tc.partition("+")
     try:
-        pgn_io = io.StringIO(pgn)
-        game = chess.pgn.read_game(pgn_io)
+        estimate = int(base) + 40 * int(inc or 0)
+    except ValueError:
+        return None
+    if estimate < 180:
+        return "bullet"
+    if estimate < 480:
+        return "blitz"
+    if estimate < 1500:
+        return "rapid"
+    return "classical"
+
+def iter_games(text_io):
+    """Yield games from a PGN stream one at a time, without reading the whole stream."""
+    while True:
+        game = chess.pgn.read_game(text_io)
         if game is None:
-            return False, "Invalid PGN format"
-
-        
-        if game.errors == []:
-            # Check if the game has a valid result
-            if game.headers.get("Result") not in ["1-0", "0-1", "1/2-1/2", "*"]:
-                return False, "Invalid game result"
-            return True, "PGN is valid"
-        else:
-            for error in game.errors:
-                if isinstance(error, IllegalMoveError):
-                    return False, "Illegal moves found in PGN"
-                else:
-                    return False, str(error)
-    except Exception as e:
-        print(f"PGN validation error: {e}")
-        return False, str(e)
-
-async def game_analysis(pgn: str) -> dict:
-    pgn_io = io.StringIO(pgn)
-    game = chess.pgn.read_game(pgn_io)
-    if game is None or game.errors != []:
+            return
+        yield game
+
+def classify_ply(prev: dict, cur: dict, played: Optional[str] = None) -> Optional[str]:
+    """Classification of the move between two consecutive position evaluations."""
+    return label(classify(EvalSeries.from_results([prev, cur]), [None, played])[1])
+
+def _ply_emitter(on_ply, fens, moves, moves_san, book_n=0):
+    """batchsf on_result callback that turns results into ply events, released in order."""
+    if on_ply is None:
+        return None
+    ready = {}
+    emitted = 0
+
+    def on_result(i, res):
+        # Engines may finish out of order; release plies as a contiguous prefix.
+        nonlocal emitted
+        ready[i] = res
+        while emitted in ready:
+            cur = ready[emitted]
+            prev = ready.get(emitted - 1)
+            if emitted < book_n:
+                kind = "book"
+            else:
+                kind = classify_ply(prev, cur, moves[emitted]) if prev is not None else None
+            on_ply({
+                "ply": emitted,
+                "total": len(fens),
+                "move_made": moves_san[emitted],
+                "evaluation": cur["evaluation"],
+                "top_moves": cur["top_moves"],
+                "classification": kind,
+            })
+            emitted += 1
+
+    return on_result
+
+def replay_plies(result: dict, on_ply: Callable[[dict], None]) -> None:
+    """Send a finished analysis to on_ply as ply events, for a caller that joined someone else's review."""
+    evals = result["evaluations"]
+    for i, e in enumerate(evals):
+        on_ply({
+            "ply": i,
+            "total": len(evals),
+            "move_made": e["move_made"],
+            "evaluation": e["evaluation"],
+            "top_moves": e["top_moves"],
+            "classification": e["classification"],
+        })
+
+async def game_analysis(pgn: Union[str, ParsedGame], on_ply: Optional[Callable[[dict], None]] = None) -> dict:
+    """Analyse a game. If given, on_ply(event) is called for each ply, in order, as soon as it is ready."""
+    parsed = pgn if isinstance(pgn, ParsedGame) else parse_pgn(pgn)
+    if parsed.game is None or parsed.error is not None or parsed.game.errors != []:
         return {"error": "Invalid PGN"}
-    
-    board = game.board()
-    
-    evals = []
-    fens = []
-    moves = []
-    moves_san = []
-    for move in game.mainline_moves():
-        moves.append(move)
-        moves_san.append(board.san(move))
-        board.push(move)
-        if not board.is_game_over():
-            fens.append(board.fen())
-
-    fens = fens[:40]
-    evals = await analyse_batch_stockfishlike(fens, multipv=MPV)
-    
+
+    moves, moves_san = parsed.moves, parsed.moves_san
+    fens = parsed.fens if REVIEW_MODE == "budget" else parsed.fens[:40]
+    with stage("opening_book"):
+        book_n = min(opening_book.book_plies(parsed.root_fen, moves), len(fens))
+    evals = [None] * len(fens)
+    on_result = _ply_emitter(on_ply, fens, moves, moves_san, book_n)
+
+    # Move history only pays off when one engine walks the game backwards; otherwise send bare FENs,
+    # whose results can be shared through the eval cache.
+    history = parsed.history if REVIEW_ORDER == "backward" else lambda idx: None
+
+    async def run(idx, time_ms=None, emit=True):
+        cb = (lambda j, r: on_result(idx[j], r)) if on_result and emit else None
+        res = await analyse_batch_stockfishlike([fens[i] for i in idx], multipv=MPV, time_ms=time_ms,
+                                                on_result=cb, history=history(idx))
+        for i, r in zip(idx, res):
+            evals[i] = r
+
+    if book_n and BOOK_MS:
+        with stage("book_pass"):
+            await run(list(range(book_n)), BOOK_MS)
+    elif book_n:
+        # Known theory: whatever the eval cache already has, no search. The last book position is the
+        # baseline for the first move out of theory, so that one is searched on a miss.
+        with stage("book_pass"):
+            cached = await asyncio.to_thread(eval_cache.get_many, fens[:book_n], None, 0, MPV)
+            if cached[-1] is None and book_n < len(fens):
+                await run([book_n - 1])
+            for i, r in enumerate(cached):
+                if evals[i] is None:
+                    evals[i] = r or {"evaluation": {"type": "cp", "value": 0}, "top_moves": []}
+                    if on_result is not None:
+                        on_result(i, evals[i])
+    rest = list(range(book_n, len(fens)))
+    if rest and REVIEW_MODE == "budget":
+        # Cheap pass over every position, then spend what's left where it matters.
+        first_ms = first_pass_ms(len(rest))
+        with stage("first_pass"):
+            await run(rest, first_ms, emit=False)
+        with stage("plan_refinement"):
+            exact = [bool(e["top_moves"]) and "Tablebase" in e["top_moves"][0] for e in evals[book_n:]]
+            refine, deep_ms = plan_refinement(EvalSeries.from_results(evals[book_n:]), moves[book_n:len(fens)],
+                                              fens[book_n:], BUDGET_MS - first_ms * len(rest), exact)
+        refine = [book_n + i for i in refine]
+        if on_result is not None:
+            refine_set = set(refine)
+            for i in rest:
+                if i not in refine_set:
+                    on_result(i, evals[i])
+        if refine:
+            with stage("deep_pass"):
+                await run(refine, deep_ms)
+    elif rest:
+        with stage("fixed_pass"):
+            await run(rest)
+
+    with stage("classify"):
+        codes = classify(EvalSeries.from_results(evals), moves[:len(evals)])
+    codes[:book_n] = 0
     mistakes = {}
     blunders = {}
     great_moves = {}
-    for i in range(1, len(evals)):
-        diff = None
-        if evals[i]['evaluation']['type'] == 'mate':
-            if evals[i - 1]['evaluation']['type'] == 'cp':
-                mistakes[i] = (evals[i], evals[i - 1])
-        elif evals[i]['evaluation']['type'] == 'cp' and evals[i - 1]['evaluation']['type'] == 'cp':
-            diff = abs(evals[i]['evaluation']['value'] - evals[i - 1]['evaluation']['value'])
-
-        if diff: 
-            if 200 > diff > 50:
-                mistakes[i] = (evals[i - 1], evals[i], moves_san[i])
-            elif diff >= 200:
-                blunders[i] = (evals[i], evals[i - 1], moves_san[i])
-
-        if i == 0: continue
-        is_top_move = False
-        second_best = None
-        if isinstance(evals[i], dict) and 'top_moves' in evals[i]:
-            move_san = moves[i]
-            top_moves = [m['Move'] for m in evals[i - 1]['top_moves']]
-            if move_san == top_moves[0]:
-                is_top_move = True
-                second_best = evals[i]['top_moves'][1] if len(top_moves) > 1 else None
-
-
-        if is_top_move:
-            if second_best is not None:
-                if second_best['Mate'] is not None:
-                    if evals[i] - second_best['evaluation'] >= abs(evals[i]) * 0.85:
-                        great_moves[i] = (evals[i], moves_san[i])
-
-
-    eval_copy = copy.deepcopy(evals)
-    for i in range(len(evals)):
-        eval_copy[i]['move_made'] = moves_san[i]
+    for i in codes.nonzero()[0].tolist():
+        kind = label(codes[i])
+        if kind == 'mistake':
+            mistakes[i] = (evals[i - 1], evals[i], moves_san[i])
+        elif kind == 'blunder':
+            blunders[i] = (evals[i], evals[i - 1], moves_san[i])
+        else:
+            great_moves[i] = (evals[i], moves_san[i])
+
+    # New outer dicts only; the nested eval objects are shared, not deep-copied.
+    evaluations = [
+        {**e, 'move_made': moves_san[i], 'classification': 'book' if i < book_n else label(codes[i])}
+        for i, e in enumerate(evals)
+    ]
 
     return {
-        "evaluations": eval_copy, 
+        "evaluations": evaluations, 
         "mistakes": mistakes, 
         "blunders": blunders, 
-        "great_moves": great_moves
+        "great_moves": great_moves,
+        "opening": opening_book.opening(parsed.root_fen, moves),
     }
@@ -0,0 +1,121 @@
+# utils/positionindex.py
+from __future__ import annotations
+import os
+from typing import Any, Dict, List, Optional, Tuple
+import chess
+import chess.pgn
+import chess.polyglot
+from sqlalchemy import and_, case, delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models import Game, PositionIndex
+
+REBUILD_BATCH = int(os.getenv("POSITION_INDEX_BATCH", "500"))
+
+def position_hash(board: chess.Board) -> int:
+    """Polyglot Zobrist hash as a signed 64-bit int, so it fits a BIGINT column."""
+    h = chess.polyglot.zobrist_hash(board)
+    return h - (1 << 64) if h >= 1 << 63 else h
+
+def position_hashes(game: chess.pgn.Game) -> List[Tuple[int, int]]:
+    """(hash, ply) of each position in the game, the starting one as ply 0; first occurrence only."""
+    board = game.board()
+    seen: Dict[int, int] = {position_hash(board): 0}
+    for ply, move in enumerate(game.mainline_moves(), 1):
+        board.push(move)
+        seen.setdefault(position_hash(board), ply)
+    return list(seen.items())
+
+def index_rows(game_id: int, user_id: int, game: chess.pgn.Game) -> List[Dict[str, int]]:
+    return [{"user_id": user_id, "hash": h, "game_id": game_id, "ply": ply} for h, ply in position_hashes(game)]
+
+async def index_game(db: AsyncSession, game: Game, pgn_game: chess.pgn.Game) -> None:
+    """Index a stored (flushed) game in the caller's transaction."""
+    rows = index_rows(game.id, game.user_id, pgn_game)
+    if rows:
+        await db.execute(insert(PositionIndex), rows)
+
+def index_games(db: Session, games: List[Tuple[Game, chess.pgn.Game]]) -> None:
+    """Sync bulk variant for the import path and rebuilds: one executemany for the whole batch."""
+    rows = [r for g, pg in games for r in index_rows(g.id, g.user_id, pg)]
+    if rows:
+        db.execute(insert(PositionIndex), rows)
+
+def _user_score(result: str, user_color: bool) -> Optional[float]:
+    if result == "1/2-1/2":
+        return 0.5
+    if result in ("1-0", "0-1"):
+        return 1.0 if (result == "1-0") == bool(user_color) else 0.0
+    return None
+
+async def find_position(db: AsyncSession, user_id: int, fen: str, limit: int = 50) -> Dict[str, Any]:
+    """The user's games that reached `fen` (newest first, up to limit) and how they scored from there."""
+    h = position_hash(chess.Board(fen))
+    match = and_(PositionIndex.user_id == user_id, PositionIndex.hash == h)
+
+    # Same buckets as _user_score: unfinished games ("*") count as reached but not as scored.
+    won = case((Game.result == "1/2-1/2", "draw"),
+               (Game.result.not_in(("1-0", "0-1")), "unfinished"),
+               ((Game.result == "1-0") == Game.user_color, "win"), else_="loss")
+    counts = dict((await db.execute(
+        select(won, func.count()).select_from(PositionIndex).join(Game, Game.id == PositionIndex.game_id)
+        .where(match).group_by(won))).all())
+    total = sum(counts.values())
+
+    rows = (await db.execute(
+        select(Game.id, Game.user_color, Game.result, Game.opponent_rating, Game.time_control,
+               Game.game_type, Game.description, Game.created_at, PositionIndex.ply)
+        .join(PositionIndex, PositionIndex.game_id == Game.id).where(match)
+        .order_by(Game.created_at.desc(), Game.id.desc()).limit(limit))).all()
+    games = [{**dict(r._mapping), "score": _user_score(r.result, r.user_color)} for r in rows]
+
+    wins, draws, losses = counts.get("win", 0), counts.get("draw", 0), counts.get("loss", 0)
+    decided = wins + draws + losses
+    return {
+        "fen": fen,
+        "games": total,
+        "stats": {"wins": wins, "draws": draws, "losses": losses, "unfinished": counts.get("unfinished", 0),
+                  "score": (wins + 0.5 * draws) / decided if decided else None},
+        "matches": games,
+    }
+
+def rebuild(user_id: Optional[int] = None, batch: int = REBUILD_BATCH) -> int:
+    """Drop and re-create the index for one user (or everyone), a batch of games per commit. Returns games indexed."""
+    from database import SessionLocal
+    from utils.pgnvalidate import parse_pgn
+
+    db = SessionLocal()
+    n = 0
+    try:
+        q = delete(PositionIndex)
+        if user_id is not None:
+            q = q.where(PositionIndex.user_id == user_id)
+        db.execute(q)
+        db.commit()
+        last = 0
+        while True:
+            q = select(Game).where(Game.id > last).order_by(Game.id).limit(batch)
+            if user_id is not None:
+                q = q.where(Game.user_id == user_id)
+            games = db.execute(q).scalars().all()
+            if not games:
+                break
+            last = games[-1].id
+            parsed = [(g, parse_pgn(g.pgn).game) for g in games]
+            index_games(db, [(g, pg) for g, pg in parsed if pg is not None])
+            db.commit()
+            db.expunge_all()
+            n += len(games)
+    finally:
+        db.close()
+    return n
+
+if __name__ == "__main__":
+    # python -m utils.positionindex [--user ID]: rebuild the position index from stored PGNs.
+    import argparse
+    ap = argparse.ArgumentParser(description="Rebuild the position search index.")
+    ap.add_argument("--user", type=int, help="only this user's games (default: all)")
+    ap.add_argument("--batch", type=int, default=REBUILD_BATCH)
+    args = ap.parse_args()
+    print(f"indexed {rebuild(args.user, args.batch)} games")
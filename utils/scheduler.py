@@ -0,0 +1,162 @@
+# utils/scheduler.py
+from __future__ import annotations
+import os, time, asyncio, contextvars, contextlib
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional, Tuple
+from fastapi import HTTPException
+
+from utils.metrics import metrics
+
+CLASSES = ("interactive", "review", "backfill")
+WEIGHTS = {
+    "interactive": int(os.getenv("SCHED_WEIGHT_INTERACTIVE", "8")),
+    "review":      int(os.getenv("SCHED_WEIGHT_REVIEW", "4")),
+    "backfill":    int(os.getenv("SCHED_WEIGHT_BACKFILL", "1")),
+}
+MAX_QUEUE          = int(os.getenv("SCHED_MAX_QUEUE", "64"))          # waiting checkouts per class; beyond -> 503
+MAX_QUEUE_PER_USER = int(os.getenv("SCHED_MAX_QUEUE_PER_USER", "8"))  # per user and class; beyond -> 429
+QUOTA_S            = float(os.getenv("ENGINE_QUOTA_S", "0"))          # engine-seconds per user per window; 0 = off
+QUOTA_WINDOW_S     = float(os.getenv("ENGINE_QUOTA_WINDOW_S", "3600"))
+
+metrics.histogram("deepply_engine_queue_wait_seconds", "Time from asking for an engine to getting one, by class.")
+metrics.counter("deepply_engine_seconds_total", "Engine time held, by class.")
+metrics.counter("deepply_scheduler_rejected_total", "Requests refused by admission control, by class and reason.")
+
+# (class, user id) of the engine work running in this task; set by routers and the worker.
+_current: contextvars.ContextVar[Tuple[str, Optional[int]]] = contextvars.ContextVar("engine_priority", default=("review", None))
+
+@contextlib.contextmanager
+def priority(cls: str, user_id: Optional[int] = None):
+    """Engine checkouts made inside this block (and tasks started from it) queue as cls for user_id."""
+    token = _current.set((cls, user_id))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+def current() -> Tuple[str, Optional[int]]:
+    return _current.get()
+
+class Scheduler:
+    """Decides who gets the next free engine.
+
+    Classes share engines by smooth weighted round-robin, so backfill still moves while
+    interactive traffic is heavy; within a class, users take turns, one checkout each.
+    Backfill work of users over their engine-seconds quota only runs when nobody else waits.
+    """
+
+    def __init__(self, weights: Dict[str, int] = WEIGHTS, quota_s: float = QUOTA_S, window_s: float = QUOTA_WINDOW_S):
+        self.weights = {c: max(1, weights.get(c, 1)) for c in CLASSES}
+        self.quota_s = quota_s
+        self.window_s = window_s
+        self._queues: Dict[str, "OrderedDict[Any, Deque[asyncio.Future]]"] = {c: OrderedDict() for c in CLASSES}
+        self._credit = {c: 0 for c in CLASSES}
+        self._usage: Dict[Any, Tuple[float, float]] = {}               # user -> (window start, engine-seconds)
+        self.rejected = 0
+
+    def waiting(self, cls: Optional[str] = None, user_id: Any = None) -> int:
+        """Live waiters (cancelled ones may sit in the deques until next() skips them)."""
+        classes = (cls,) if cls else CLASSES
+        return sum(not f.done() for c in classes for u, q in self._queues[c].items()
+                   if user_id is None or u == user_id for f in q)
+
+    def usage(self, user_id: Any) -> float:
+        start, used = self._usage.get(user_id, (0.0, 0.0))
+        return used if time.monotonic() - start < self.window_s else 0.0
+
+    def charge(self, cls: str, user_id: Any, seconds: float) -> None:
+        metrics.inc("deepply_engine_seconds_total", seconds, **{"class": cls})
+        if user_id is None:
+            return
+        now = time.monotonic()
+        start, used = self._usage.get(user_id, (now, 0.0))
+        if now - start >= self.window_s:
+            start, used = now, 0.0
+        self._usage[user_id] = (start, used + seconds)
+
+    def over_quota(self, user_id: Any) -> bool:
+        return self.quota_s > 0 and user_id is not None and self.usage(user_id) >= self.quota_s
+
+    def _reject(self, cls: str, reason: str, status: int, detail: str, retry_after: float) -> None:
+        self.rejected += 1
+        metrics.inc("deepply_scheduler_rejected_total", reason=reason, **{"class": cls})
+        raise HTTPException(status_code=status, detail=detail, headers={"Retry-After": str(max(1, int(retry_after)))})
+
+    def admit(self, cls: str, user_id: Any) -> None:
+        """Admission control for request-bound work: 429 past the user's quota or queue share, 503 when the class queue is full."""
+        if self.over_quota(user_id):
+            start, _ = self._usage[user_id]
+            self._reject(cls, "quota", 429, "Engine time quota exceeded",
+                         start + self.window_s - time.monotonic())
+        if user_id is not None and self.waiting(cls, user_id) >= MAX_QUEUE_PER_USER:
+            self._reject(cls, "user_queue", 429, "Too many analyses in progress", 1)
+        if self.waiting(cls) >= MAX_QUEUE:
+            self._reject(cls, "queue", 503, "Server busy, try again shortly", 1)
+
+    def enqueue(self, cls: str, user_id: Any) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self._queues[cls].setdefault(user_id, deque()).append(fut)
+        return fut
+
+    def discard(self, cls: str, user_id: Any, fut: asyncio.Future) -> None:
+        """Forget a waiter whose checkout was cancelled."""
+        waiters = self._queues[cls].get(user_id)
+        if waiters is None:
+            return
+        with contextlib.suppress(ValueError):
+            waiters.remove(fut)
+        if not waiters:
+            del self._queues[cls][user_id]
+
+    def fail_all(self, exc: BaseException) -> int:
+        """Raise exc in every waiting checkout (the pool is closing). Returns how many there were."""
+        n = 0
+        for q in self._queues.values():
+            for waiters in q.values():
+                for fut in waiters:
+                    if not fut.done():
+                        fut.set_exception(exc)
+                        n += 1
+            q.clear()
+        return n
+
+    def _pop_user(self, cls: str) -> Optional[asyncio.Future]:
+        users = self._queues[cls]
+        pick = next(iter(users))
+        if cls == "backfill" and self.quota_s > 0:
+            pick = next((u for u in users if not self.over_quota(u)), pick)
+        waiters = users[pick]
+        fut = waiters.popleft()
+        if waiters:
+            users.move_to_end(pick)                        # back of the line for this user's next checkout
+        else:
+            del users[pick]
+        return fut
+
+    def next(self) -> Optional[asyncio.Future]:
+        """The waiter that gets the engine being released, or None if nobody waits."""
+        while True:
+            for q in self._queues.values():                # drop waiters whose request went away
+                for u in [u for u, w in q.items() if all(f.done() for f in w)]:
+                    del q[u]
+            active = [c for c in CLASSES if self._queues[c]]
+            if not active:
+                return None
+            total = 0
+            for c in CLASSES:
+                if c not in active:
+                    self._credit[c] = 0                    # idle classes don't bank turns
+            for c in active:
+                self._credit[c] += self.weights[c]
+                total += self.weights[c]
+            cls = max(active, key=lambda c: self._credit[c])
+            self._credit[cls] -= total
+            fut = self._pop_user(cls)
+            if not fut.done():
+                return fut
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"waiting": {c: self.waiting(c) for c in CLASSES}, "rejected": self.rejected,
+                "users_over_quota": sum(1 for u in self._usage if self.over_quota(u))}
+
+scheduler = Scheduler()
@@ -0,0 +1,39 @@
+# utils/singleflight.py
+from __future__ import annotations
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from utils.metrics import metrics
+
+metrics.counter("deepply_singleflight_total", "Calls through a singleflight group, by role (leader runs, follower waits).")
+
+class SingleFlight:
+    """Run one call per key at a time; concurrent callers with the same key share its result.
+
+    The call runs as its own task, so a leader whose request is cancelled (client gone)
+    doesn't cancel the followers still waiting on it. Exceptions reach every caller.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()                               # retrieved, even if every caller went away
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """(result, leader): leader is True for the caller whose fn actually ran."""
+        task = self._calls.get(key)
+        leader = task is None
+        if leader:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        metrics.inc("deepply_singleflight_total", flight=self.name, role="leader" if leader else "follower")
+        return await asyncio.shield(task), leader
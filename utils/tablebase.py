@@ -0,0 +1,91 @@
+# utils/tablebase.py
+from __future__ import annotations
+import os, threading
+from typing import Dict, Any, Optional
+import chess
+import chess.syzygy
+
+SYZYGY_PATH   = os.getenv("SYZYGY_PATH")                 # directory (or os.pathsep-separated list) of .rtbw/.rtbz
+SYZYGY_PIECES = int(os.getenv("SYZYGY_PIECES", "7"))     # only probe positions with at most this many pieces
+TB_WIN_CP     = 20000                                    # tablebase wins rank below mates (32000) in classify
+
+class Tablebase:
+    """Syzygy probing in the same {"evaluation", "top_moves"} shape batchsf returns."""
+
+    def __init__(self, path: Optional[str] = SYZYGY_PATH, max_pieces: int = SYZYGY_PIECES):
+        self.path = path
+        self.max_pieces = max_pieces
+        self.probes = 0
+        self.hits = 0
+        self._tb: Optional[chess.syzygy.Tablebase] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _open(self) -> Optional[chess.syzygy.Tablebase]:
+        if self._tb is None and self.path:
+            with self._lock:
+                if self._tb is None:
+                    tb = chess.syzygy.Tablebase()
+                    for d in self.path.split(os.pathsep):
+                        if os.path.isdir(d):
+                            tb.add_directory(d)
+                    self._tb = tb
+        return self._tb
+
+    def stats(self) -> Dict[str, Any]:
+        return {"probes": self.probes, "hits": self.hits,
+                "hit_rate": self.hits / self.probes if self.probes else 0.0}
+
+    def _cp(self, wdl: int, dtz: int) -> int:
+        # Cursed wins / blessed losses (|wdl| == 1) are draws under the 50-move rule.
+        if wdl >= 2:
+            return TB_WIN_CP - abs(dtz)
+        if wdl <= -2:
+            return -(TB_WIN_CP - abs(dtz))
+        return 0
+
+    def probe(self, fen: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        board = chess.Board(fen)
+        if chess.popcount(board.occupied) > self.max_pieces or board.castling_rights:
+            return None
+        tb = self._open()
+        if tb is None:
+            return None
+        self.probes += 1
+        try:
+            wdl = tb.probe_wdl(board)
+            dtz = tb.probe_dtz(board)
+            best, best_key = None, None
+            for move in board.legal_moves:
+                board.push(move)
+                try:
+                    ours = -tb.probe_wdl(board)
+                    d = abs(tb.probe_dtz(board))
+                finally:
+                    board.pop()
+                # Win: fastest conversion; loss or draw: hold out longest.
+                key = (ours, -d if ours > 0 else d)
+                if best_key is None or key > best_key:
+                    best, best_key = move, key
+        except (KeyError, chess.syzygy.MissingTableError):
+            return None
+        self.hits += 1
+        cp = self._cp(wdl, dtz)
+        top = [{
+            "Move": best.uci() if best else None, "Centipawn": cp, "Mate": None,
+            "Depth": 0, "Seldepth": 0, "Time": 0, "Nodes": 0, "Nps": 0,
+            "Pv": best.uci() if best else "", "Tablebase": {"wdl": wdl, "dtz": dtz},
+        }]
+        return {"evaluation": {"type": "cp", "value": cp}, "top_moves": top}
+
+    def close(self) -> None:
+        if self._tb is not None:
+            self._tb.close()
+            self._tb = None
+
+tablebase = Tablebase()
@@ -0,0 +1,178 @@
+# utils/userstats.py
+from __future__ import annotations
+import os, asyncio
+from typing import Any, Dict, Optional, Tuple
+import numpy as np
+import chess
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Game, GameAnalysis, UserStat
+from utils.classify import MATE_CP, MISTAKE, BLUNDER, GREAT
+from utils.gameanalysis import NO_EVAL, IS_MATE, BOOK, arrays, load_analysis, save_analysis
+from utils.pgnvalidate import ParsedGame, parse_pgn
+
+OPENING_PLIES  = int(os.getenv("STATS_OPENING_PLIES", "20"))     # plies counted as opening even out of book
+ENDGAME_PIECES = int(os.getenv("STATS_ENDGAME_PIECES", "6"))     # queens, rooks and minors left, both sides
+CP_LOSS_CAP    = 1000                                            # one lost game shouldn't swamp the average
+
+FIELDS = ("games", "moves", "mistakes", "blunders", "great_moves", "cp_loss", "cp_loss_moves")
+Key = Tuple[str, str]                                            # (dimension, bucket)
+
+def _phase(board: chess.Board, ply: int, book: bool) -> str:
+    if book or ply < OPENING_PLIES:
+        return "opening"
+    if chess.popcount(board.occupied & ~board.pawns & ~board.kings) <= ENDGAME_PIECES:
+        return "endgame"
+    return "middlegame"
+
+def contributions(game: Game, row: GameAnalysis, parsed: Optional[ParsedGame] = None) -> Dict[Key, np.ndarray]:
+    """What one reviewed game adds to its owner's counters, per (dimension, bucket). Only the owner's moves count."""
+    score, mate, _, labels = arrays(row)
+    n = len(score)
+    parsed = parsed or parse_pgn(game.pgn)
+    if n == 0 or parsed.game is None:
+        return {}
+
+    s = score.astype(float)
+    s[score == NO_EVAL] = np.nan
+    mates = score == IS_MATE
+    s[mates] = np.where(mate[mates] > 0, MATE_CP - np.abs(mate[mates]), -(MATE_CP - np.abs(mate[mates])))
+    # Same loss as classify(): mover's eval before the move plus the opponent's after it.
+    loss = np.full(n, np.nan)
+    loss[1:] = np.clip(s[:-1] + s[1:], 0, CP_LOSS_CAP)
+    book = labels == BOOK
+
+    root = chess.Board(parsed.root_fen)
+    first = 0 if root.turn == bool(game.user_color) else 1
+    per_move = np.zeros((n, len(FIELDS)), dtype=np.int64)
+    phases = {}
+    for i in range(first, n, 2):
+        board = root if i == 0 else chess.Board(parsed.fens[i - 1])
+        phases[i] = _phase(board, i, book[i])
+        counted = not book[i] and not np.isnan(loss[i])
+        per_move[i] = (0, 1, labels[i] == MISTAKE, labels[i] == BLUNDER, labels[i] == GREAT,
+                       round(loss[i]) if counted else 0, counted)
+
+    total = per_move.sum(axis=0)
+    total[0] = 1
+    out: Dict[Key, np.ndarray] = {
+        ("all", "all"): total,
+        ("time_control", game.time_control): total,
+        ("color", "white" if game.user_color else "black"): total,
+    }
+    if row.opening_name:
+        out[("opening", row.opening_name[:255])] = total
+    for phase in set(phases.values()):
+        part = per_move[[i for i, p in phases.items() if p == phase]].sum(axis=0)
+        part[0] = 1
+        out[("phase", phase)] = part
+    return out
+
+def _merge(into: Dict[Key, np.ndarray], deltas: Dict[Key, np.ndarray], sign: int = 1) -> Dict[Key, np.ndarray]:
+    for key, v in deltas.items():
+        into[key] = into.get(key, 0) + sign * v
+    return into
+
+async def apply_deltas(db: AsyncSession, user_id: int, deltas: Dict[Key, np.ndarray]) -> None:
+    """Add deltas to the stored counters in place (no read-modify-write), creating missing buckets."""
+    for (dimension, bucket), v in deltas.items():
+        if not np.any(v):
+            continue
+        values = dict(zip(FIELDS, (int(x) for x in v)))
+        stmt = (update(UserStat)
+                .where(UserStat.user_id == user_id, UserStat.dimension == dimension, UserStat.bucket == bucket)
+                .values({f: getattr(UserStat, f) + values[f] for f in FIELDS}))
+        if (await db.execute(stmt)).rowcount:
+            continue
+        try:
+            async with db.begin_nested():
+                db.add(UserStat(user_id=user_id, dimension=dimension, bucket=bucket, **values))
+        except IntegrityError:
+            await db.execute(stmt)                         # another review created the bucket first
+
+async def save_review(db: AsyncSession, game: Game, result: Dict[str, Any]) -> GameAnalysis:
+    """save_analysis plus the owner's counters, in one commit. A re-review replaces the old contribution."""
+    parsed = parse_pgn(game.pgn)
+    deltas: Dict[Key, np.ndarray] = {}
+    old = await load_analysis(db, game.id)
+    if old is not None:
+        _merge(deltas, contributions(game, old, parsed), -1)
+    row = await save_analysis(db, game.id, result, commit=False)
+    _merge(deltas, contributions(game, row, parsed))
+    await apply_deltas(db, game.user_id, deltas)
+    await db.commit()
+    return row
+
+def _summary(row: UserStat) -> Dict[str, Any]:
+    out: Dict[str, Any] = {f: getattr(row, f) for f in FIELDS}
+    out["mistake_rate"] = row.mistakes / row.moves if row.moves else 0.0
+    out["blunder_rate"] = row.blunders / row.moves if row.moves else 0.0
+    out["acpl"] = row.cp_loss / row.cp_loss_moves if row.cp_loss_moves else None
+    return out
+
+async def read_stats(db: AsyncSession, user_id: int) -> Dict[str, Any]:
+    rows = (await db.execute(select(UserStat).where(UserStat.user_id == user_id))).scalars().all()
+    out: Dict[str, Any] = {"overall": None, "phase": {}, "time_control": {}, "color": {}, "opening": {}}
+    for r in rows:
+        if r.dimension == "all":
+            out["overall"] = _summary(r)
+        else:
+            out.setdefault(r.dimension, {})[r.bucket] = _summary(r)
+    return out
+
+async def backfill(user_id: Optional[int] = None, analyze: bool = False) -> Dict[int, int]:
+    """Rebuild counters from stored analyses; with analyze, review games that have none first.
+
+    Replaces each user's counters in one transaction. A review finishing for that user while
+    their games are being read can be missed; run it again if reviews were in flight.
+    Returns {user_id: games counted}.
+    """
+    from database import AsyncSessionLocal
+    from utils.pgnvalidate import game_analysis
+
+    counted: Dict[int, int] = {}
+    async with AsyncSessionLocal() as db:
+        if analyze:
+            q = select(Game).outerjoin(GameAnalysis, GameAnalysis.game_id == Game.id).where(GameAnalysis.id.is_(None))
+            if user_id is not None:
+                q = q.where(Game.user_id == user_id)
+            for game in (await db.execute(q)).scalars().all():
+                result = await game_analysis(game.pgn)
+                if "error" not in result:
+                    await save_analysis(db, game.id, result)
+                    print(f"reviewed game {game.id}")
+
+        users = [user_id] if user_id is not None else (await db.execute(select(Game.user_id).distinct())).scalars().all()
+        for uid in users:
+            totals: Dict[Key, np.ndarray] = {}
+            n = 0
+            q = (select(Game, GameAnalysis).join(GameAnalysis, GameAnalysis.game_id == Game.id)
+                 .where(Game.user_id == uid).execution_options(yield_per=200))
+            async for game, row in await db.stream(q):
+                _merge(totals, contributions(game, row))
+                n += 1
+            await db.execute(delete(UserStat).where(UserStat.user_id == uid))
+            db.add_all(UserStat(user_id=uid, dimension=d, bucket=b, **dict(zip(FIELDS, (int(x) for x in v))))
+                       for (d, b), v in totals.items())
+            await db.commit()
+            counted[uid] = n
+    return counted
+
+if __name__ == "__main__":
+    # python -m utils.userstats [--user ID] [--analyze]: rebuild weakness counters for existing games.
+    import argparse
+    ap = argparse.ArgumentParser(description="Rebuild per-user review statistics from stored analyses.")
+    ap.add_argument("--user", type=int, help="only this user (default: everyone with games)")
+    ap.add_argument("--analyze", action="store_true", help="review games without a stored analysis first")
+    args = ap.parse_args()
+
+    async def main():
+        from database import async_engine
+        try:
+            for uid, n in (await backfill(args.user, args.analyze)).items():
+                print(f"user {uid}: {n} reviewed games counted")
+        finally:
+            await async_engine.dispose()
+    asyncio.run(main())
@@ -0,0 +1,147 @@
+"""Standalone analysis worker: claims review jobs from the analysis_jobs table and runs them.
+
+    python worker.py [--concurrency N]
+
+Run as many as you like, on any node that can reach the database and has Stockfish. The API
+queues work here when REVIEW_EXECUTOR=queue.
+"""
+import os, socket, signal, asyncio, argparse, contextlib
+from dotenv import load_dotenv
+
+load_dotenv()
+load_dotenv(os.getenv("ENGINE_PROFILE", "engine_profile.env"))
+
+from database import AsyncSessionLocal, async_engine
+from models import Game
+from utils import jobqueue
+from utils.enginepool import pool as engine_pool
+from utils.openings import opening_book
+from utils.tablebase import tablebase
+from utils.pgnvalidate import game_analysis
+from utils.userstats import save_review
+from utils.scheduler import priority
+
+WORKER_ID   = os.getenv("WORKER_ID", f"{socket.gethostname()}:{os.getpid()}")[:64]
+CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", str(engine_pool.size)))
+DRAIN_S     = float(os.getenv("WORKER_DRAIN_S", "60"))      # on SIGTERM, wait this long before handing jobs back
+
+async def _run(job):
+    async with AsyncSessionLocal() as db:
+        game = await db.get(Game, job.game_id)
+        if game is None:
+            return None
+        with priority("review", job.user_id):
+            result = await game_analysis(game.pgn)
+        if "error" in result:
+            return result
+        # Mark the job done and store the review in one transaction, so a worker whose lease has
+        # lapsed can't overwrite whatever the new owner writes.
+        if not await jobqueue.complete(db, job.id, WORKER_ID, result, commit=False):
+            await db.rollback()
+            print(f"[{WORKER_ID}] lost the lease on job {job.id}; discarding its result")
+            return result
+        await save_review(db, game, result)
+        return result
+
+async def _heartbeat(job_id: int, work: asyncio.Task) -> None:
+    while True:
+        await asyncio.sleep(jobqueue.HEARTBEAT_S)
+        try:
+            async with AsyncSessionLocal() as db:
+                owned = await jobqueue.heartbeat(db, job_id, WORKER_ID)
+        except Exception as e:
+            # A database blip isn't a lost lease; try again next beat.
+            print(f"[{WORKER_ID}] heartbeat for job {job_id} failed: {e}")
+            continue
+        if not owned:
+            print(f"[{WORKER_ID}] lost the lease on job {job_id}; dropping it")
+            work.cancel()
+            return
+
+async def process(job) -> None:
+    if job.attempts > job.max_attempts:
+        # Its lease ran out that many times: it keeps killing workers.
+        async with AsyncSessionLocal() as db:
+            await jobqueue.fail(db, job, WORKER_ID, f"abandoned after {job.attempts - 1} lost leases", retry=False)
+        return
+    work = asyncio.create_task(_run(job))
+    beat = asyncio.create_task(_heartbeat(job.id, work))
+    try:
+        result = await work
+    except asyncio.CancelledError:
+        if beat.done():                                    # lease lost: someone else owns the job now
+            return
+        raise
+    except Exception as e:
+        print(f"[{WORKER_ID}] job {job.id} failed: {e}")
+        async with AsyncSessionLocal() as db:
+            await jobqueue.fail(db, job, WORKER_ID, str(e) or type(e).__name__)
+        return
+    finally:
+        beat.cancel()
+    async with AsyncSessionLocal() as db:
+        if result is None:
+            await jobqueue.fail(db, job, WORKER_ID, "game not found", retry=False)
+        elif "error" in result:
+            await jobqueue.fail(db, job, WORKER_ID, str(result["error"]), retry=False)
+
+async def slot(stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        try:
+            async with AsyncSessionLocal() as db:
+                job = await jobqueue.claim(db, WORKER_ID)
+        except Exception as e:
+            print(f"[{WORKER_ID}] claim failed: {e}")
+            job = None
+        if job is None:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stop.wait(), jobqueue.POLL_S)
+            continue
+        task = asyncio.create_task(process(job))
+        try:
+            await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # Shutdown: give the job a moment to finish, then hand it back.
+            try:
+                await asyncio.wait_for(task, DRAIN_S)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                async with AsyncSessionLocal() as db:
+                    await jobqueue.release(db, job.id, WORKER_ID)
+            raise
+
+async def janitor(stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        with contextlib.suppress(Exception):
+            async with AsyncSessionLocal() as db:
+                await jobqueue.purge(db)
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(stop.wait(), 3600)
+
+async def main(concurrency: int) -> None:
+    try:
+        await engine_pool.start()
+    except Exception as e:
+        print(f"Engine pool not started: {e}")
+    opening_book.load()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    print(f"[{WORKER_ID}] started, {concurrency} slot(s)")
+    slots = [asyncio.create_task(slot(stop)) for _ in range(concurrency)]
+    cleaner = asyncio.create_task(janitor(stop))
+    await stop.wait()
+    print(f"[{WORKER_ID}] stopping")
+    for t in slots:
+        t.cancel()
+    await asyncio.gather(*slots, cleaner, return_exceptions=True)
+    await engine_pool.close()
+    opening_book.close()
+    tablebase.close()
+    await async_engine.dispose()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--concurrency", type=int, default=CONCURRENCY, help="jobs in flight (default: engine pool size)")
+    args = ap.parse_args()
+    asyncio.run(main(max(1, args.concurrency)))